@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""Persistent, content-addressed cache for AI schedule responses.
+
+Entries are keyed by a SHA-256 hash of the normalized prompt, the model name and
+the generation config, so pressing "Tạo Lịch với AI" again with unchanged data
+(or after a browser refresh) returns the stored markdown without a new model call.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+import unicodedata
+
+CACHE_FORMAT_VERSION = 1
+
+
+def normalize_prompt(prompt):
+    """Normalizes a prompt so cosmetic whitespace/encoding differences map to the same key."""
+    text = unicodedata.normalize("NFC", str(prompt)).replace("\r\n", "\n")
+    lines = [line.rstrip() for line in text.strip().split("\n")]
+    return "\n".join(lines)
+
+
+def make_cache_key(prompt, model_name, generation_config):
+    """Returns the content hash identifying one (prompt, model, config) request."""
+    payload = json.dumps({
+        "v": CACHE_FORMAT_VERSION,
+        "prompt": normalize_prompt(prompt),
+        "model": model_name,
+        "config": generation_config or {},
+    }, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """On-disk response cache with TTL, entry-count and total-size eviction.
+
+    Each entry is one JSON file named after its key. The file mtime is the time the
+    entry was stored and is never touched again: ``get`` and ``evict`` both expire
+    entries by it. The access time is set on every hit, so size eviction removes
+    the least recently used entries first.
+    """
+
+    def __init__(self, directory, max_entries=200, max_bytes=20 * 1024 * 1024, ttl_seconds=7 * 24 * 3600):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """Returns the cached entry dict for ``key`` or None if missing/expired/corrupt."""
+        path = self._path(key)
+        try:
+            created = os.stat(path).st_mtime
+            if time.time() - created > self.ttl_seconds:
+                self._remove(path)
+                return None
+            with open(path, encoding="utf-8") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(path, (time.time(), created))  # Đánh dấu vừa được dùng (LRU), giữ nguyên thời điểm tạo
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, text, model_name=None):
+        """Stores a response atomically, then enforces the size/TTL limits."""
+        created = time.time()
+        entry = {"created": created, "model": model_name, "text": text}
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(entry, file, ensure_ascii=False)
+            os.utime(tmp_path, (created, created))
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            self._remove(tmp_path)
+            return
+        self.evict()
+
+    def invalidate(self, key):
+        """Drops one entry (used when forcing regeneration)."""
+        self._remove(self._path(key))
+
+    def clear(self):
+        """Removes every cached entry."""
+        for path, _, _, _ in self._entries():
+            self._remove(path)
+
+    def _entries(self):
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_mtime, max(stat.st_atime, stat.st_mtime), stat.st_size))
+        return entries
+
+    def evict(self):
+        """Removes expired entries, then least recently used ones until within limits."""
+        now = time.time()
+        entries = []
+        for path, created, used, size in self._entries():
+            if now - created > self.ttl_seconds:  # Cùng mốc thời gian với get()
+                self._remove(path)
+            else:
+                entries.append((path, used, size))
+        entries.sort(key=lambda item: item[1])  # Lâu không dùng nhất trước
+        total_bytes = sum(size for _, _, size in entries)
+        while entries and (len(entries) > self.max_entries or total_bytes > self.max_bytes):
+            path, _, size = entries.pop(0)
+            self._remove(path)
+            total_bytes -= size
+
+    def stats(self):
+        """Returns (entry count, total bytes) for display."""
+        entries = self._entries()
+        return len(entries), sum(size for _, _, _, size in entries)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
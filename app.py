@@ -2,69 +2,208 @@
 import streamlit as st
 import pandas as pd
 import io  # Required for reading string data as file
-import google.generativeai as genai
 import yaml
-from datetime import datetime, timedelta
+from datetime import datetime
 # from config import GOOGLE_API_KEY # <<< REMOVED IMPORT
-import re
 import json
-import sys  # Required for checking xlsxwriter
+import importlib.util  # Required for checking xlsxwriter
 import numpy as np  # Needed for date calculations
 import time  # For potential delays if needed, though st.toast handles its own timing
+import os
+import sqlite3
+from ai_cache import ResponseCache  # On-disk cache for AI responses
+from solver import solve_schedule, warm_start_assignments  # Local deterministic scheduling engine
+from validation import ScheduleValidator  # Incremental constraint checks for manual edits
+from ranking import CandidateRanker  # Best-first replacement suggestions per slot
+from availability import build_availability_index
+from employee_registry import EmployeeRegistry  # Roster IDs; maps AI name variants back to the roster
+from instrumentation import RunTrace, TraceLog, span_or_null  # Per-stage timings and token counts
+from call_policy import BreakerRegistry, CallPolicy, ModelCallError
+from batch import RateLimiter, build_batch_workbook, run_concurrently, split_into_groups
+from schedule_table import IncrementalScheduleParser, build_assignment_index
+from shifts import DEFAULT_SHIFTS_DEFINITION, ShiftConfigError, ShiftModel, shift_model  # Configurable shifts
+from schedule_store import KIND_EDITED, KIND_GENERATED, ScheduleStore, shifts_key, week_key  # Schedule history
+from roster_files import UPLOAD_EXTENSIONS, file_hash, read_registration_file  # XLSX/CSV uploads
+from session_data import SessionDataManager  # Per-session / global memory budget for large session artifacts
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import scheduler  # Headless API (parsing, prompts, generation); the functions below add the UI around it
+from scheduler import (FALLBACK_MODEL_NAMES, MODEL_NAME, OUTPUT_JSON, OUTPUT_MARKDOWN, RosterFormatError,
+                       ScheduleParseError, StreamInterruptedError, generation_config)
 
 # ------------------------------------------------------------------------------
-# Page Configuration (Set Title and Icon)
-st.set_page_config(page_title="AI Schedule Manager", page_icon="📅", layout="wide")
-
-# Check for xlsxwriter (optional but good for Excel export)
-try:
-    import xlsxwriter
-except ImportError:
-    # Using toast for non-critical warnings
-    st.toast("Module 'xlsxwriter' được khuyến nghị để xuất Excel. Cài đặt bằng: pip install xlsxwriter", icon="⚠️")
-
-# --- UPDATED: Check and configure Google API Key using Streamlit Secrets ---
-GOOGLE_API_KEY = st.secrets.get("GOOGLE_API_KEY")
-
-if not GOOGLE_API_KEY:
-    st.error("Lỗi: Google API Key chưa được cấu hình trong Streamlit Secrets!")
-    st.info(
-        "Vui lòng thêm GOOGLE_API_KEY vào mục Secrets trong cài đặt ứng dụng của bạn trên Streamlit Community Cloud.")
-    st.stop()  # Stop execution if no API key
-
-# Configure Google Generative AI
-try:
-    genai.configure(api_key=GOOGLE_API_KEY)
-except Exception as e:
-    st.error(f"Lỗi cấu hình Google API: {e}");
-    st.stop()
-
-# Generation config for Google Generative AI
-generation_config = {"temperature": 0.7, "top_p": 1, "top_k": 1, "max_output_tokens": 4096}
-
-# Initialize the Generative Model
-MODEL_NAME = "gemini-1.5-flash"
-try:
-    model = genai.GenerativeModel(model_name=MODEL_NAME, generation_config=generation_config)
-    st.sidebar.caption(f"Sử dụng model: {MODEL_NAME}")
-except Exception as e:
-    st.error(f"Lỗi khởi tạo mô hình AI ({MODEL_NAME}): {e}");
-    st.error("Kiểm tra API Key, tên model và kết nối mạng.");
-    st.stop()
-
-# --- Define Predefined Column Names ---
-PREDEFINED_COLUMNS = [
-    "Tên nhân viên:",
-    "Đăng kí ca cho tuần:",
-    "bạn có thể làm việc thời gian nào? [Thứ 2]",
-    "bạn có thể làm việc thời gian nào? [Thứ 3]",
-    "bạn có thể làm việc thời gian nào? [Thứ 4]",
-    "bạn có thể làm việc thời gian nào? [Thứ 5]",
-    "bạn có thể làm việc thời gian nào? [Thứ 6]",
-    "bạn có thể làm việc thời gian nào? [Thứ 7]",
-    "bạn có thể làm việc thời gian nào? [Chủ nhật]",
-    "Ghi chú (nếu có)"
-]
+# Page configuration is applied in main() (first Streamlit command of every run). Heavy resources
+# (google.generativeai, the Gemini client, the Excel engine check) are created lazily, only when needed.
+
+# generation_config, MODEL_NAME and the output formats live in scheduler.py (shared with the CLI)
+
+
+def get_secret(key, default=None):
+    """Reads a Streamlit secret without failing when no secrets file is configured."""
+    try:
+        return st.secrets.get(key, default)
+    except Exception:  # StreamlitSecretNotFoundError khi chưa có secrets.toml
+        return default
+
+
+@st.cache_resource(show_spinner=False)
+def get_generative_model(model_name):
+    """Configures the Gemini client and builds the model once per process, on the first generation request."""
+    import google.generativeai as genai  # Import nặng (~1s): chỉ khi thực sự cần gọi AI
+    api_key = get_secret("GOOGLE_API_KEY")
+    if not api_key:
+        raise RuntimeError("Google API Key chưa được cấu hình trong Streamlit Secrets!")
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name=model_name, generation_config=generation_config)
+
+
+def load_ai_model():
+    """Returns the primary Gemini model, or None (with the error shown) if it cannot be created."""
+    try:
+        return get_generative_model(MODEL_NAME)
+    except Exception as e:
+        st.error(f"Lỗi khởi tạo mô hình AI ({MODEL_NAME}): {e}")
+        st.info("Kiểm tra GOOGLE_API_KEY trong mục Secrets, tên model và kết nối mạng. "
+                "Bạn vẫn có thể dùng 'Bộ giải cục bộ' để tạo lịch không cần AI.")
+        return None
+
+
+@st.cache_resource(show_spinner=False)
+def get_excel_engine():
+    """'xlsxwriter' if installed (recommended), otherwise 'openpyxl'."""
+    return 'xlsxwriter' if importlib.util.find_spec('xlsxwriter') is not None else 'openpyxl'
+
+
+# Persistent cache of AI responses (keyed by prompt + model + generation_config)
+AI_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".ai_cache")
+response_cache = ResponseCache(AI_CACHE_DIR, max_entries=200, max_bytes=20 * 1024 * 1024, ttl_seconds=7 * 24 * 3600)
+
+# Batch mode (several weeks / stores in one paste): bounded concurrency + request rate limit
+BATCH_MAX_WORKERS = 4
+BATCH_REQUESTS_PER_MINUTE = 15
+
+# Prompt size report: warn when the estimated prompt exceeds this many tokens
+PROMPT_TOKEN_WARNING = 30000
+
+# Run diagnostics: stage timings + token counts, one JSON line per run (SCHEDULE_TRACE_LOG overrides the path)
+TRACE_LOG_PATH = os.environ.get("SCHEDULE_TRACE_LOG") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".run_logs", "runs.jsonl")
+trace_log = TraceLog(TRACE_LOG_PATH)
+DIAGNOSTICS_HISTORY = 20  # Số lần chạy gần nhất giữ trong phiên cho bảng chẩn đoán
+
+# Schedule history: pasted rosters, lookups and every generated/edited version (SCHEDULE_DB overrides the path)
+SCHEDULE_DB_PATH = os.environ.get("SCHEDULE_DB") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".schedule_store", "schedules.db")
+SCHEDULE_HISTORY_LIMIT = 30  # Số phiên bản gần nhất hiển thị trong mục 'Lịch đã lưu'
+
+# Session memory budget (MB): over it, large artifacts are spilled to disk or dropped and rebuilt on the next run
+SESSION_MEMORY_MB = float(os.environ.get("SESSION_MEMORY_MB") or 64)
+SESSIONS_MEMORY_MB = float(os.environ.get("SESSIONS_MEMORY_MB") or 512)  # Tổng mọi phiên của tiến trình
+SESSION_SPILL_DIR = os.environ.get("SESSION_SPILL_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".session_spill")
+
+# Scheduling engines selectable in the sidebar
+ENGINE_AI = "AI (Gemini)"
+ENGINE_LOCAL = "Bộ giải cục bộ (nhanh)"
+
+# Schedule editors: one st.data_editor grid, or the original one-selectbox-per-cell layout
+EDITOR_GRID = "Bảng lưới (nhanh)"
+EDITOR_SELECTBOX = "Danh sách chọn từng ô"
+
+# Shift table in the sidebar (one row per shift; empty staffing = double-day rule)
+SHIFT_EDITOR_COLUMNS = ["Ca", "Bắt đầu", "Kết thúc", "Số người", "Từ khóa"]
+
+# Call policy: per-call timeout + overall deadline, jittered backoff on 429/5xx, ordered fallback models
+AI_CALL_POLICY = CallPolicy([MODEL_NAME] + FALLBACK_MODEL_NAMES, deadline_seconds=90, call_timeout_seconds=60,
+                            max_attempts_per_model=3, base_delay_seconds=1.0, max_delay_seconds=16.0, jitter=0.5,
+                            breaker_failure_threshold=3, breaker_reset_seconds=60)
+
+
+@st.cache_resource(show_spinner=False)
+def get_schedule_store():
+    """SQLite schedule history shared by all sessions (opened once per process)."""
+    return ScheduleStore(SCHEDULE_DB_PATH)
+
+
+@st.cache_resource(show_spinner=False)
+def get_session_data():
+    """Memory budget manager shared by all sessions (one per process)."""
+    return SessionDataManager(SESSION_SPILL_DIR, session_budget=int(SESSION_MEMORY_MB * 1024 * 1024),
+                              global_budget=int(SESSIONS_MEMORY_MB * 1024 * 1024), alive=session_alive)
+
+
+def session_alive(session_id):
+    """False once Streamlit has closed the session (its spill files can be removed)."""
+    return not Runtime.exists() or Runtime.instance().is_active_session(session_id)
+
+
+def session_context():
+    """(session id, this session's state object) for the memory budget, or None outside a Streamlit run."""
+    ctx = get_script_run_ctx()
+    return None if ctx is None else (ctx.session_id, ctx.session_state)
+
+
+def begin_session_data():
+    """Loads this session's spilled artifacts back; returns the keys dropped at the end of the last run."""
+    context = session_context()
+    return get_session_data().begin(*context) if context else set()
+
+
+def end_session_data():
+    """Measures this session's artifacts and applies the memory budgets (spill / drop)."""
+    context = session_context()
+    if context:
+        get_session_data().end(*context)
+
+
+def rebuild_dropped_artifacts(dropped, requirements):
+    """Rebuilds the lookup table (and its indexes, lazily) and the copy text dropped to stay within budget."""
+    if 'availability_lookup_df' in dropped or st.session_state.availability_lookup_df is None:
+        lookup_df = None
+        if st.session_state.df_from_paste is not None:
+            lookup_df = preprocess_pasted_data_for_lookup(st.session_state.df_from_paste, requirements)
+        if lookup_df is None or lookup_df.empty:
+            lookup_df = pd.DataFrame(columns=['Date', 'Employee', 'Shift', 'Can_Work', 'Note'])
+        st.session_state.availability_lookup_df = lookup_df  # Chỉ mục, bộ kiểm tra... tự tạo lại khi cần
+    if 'copyable_text' in dropped and st.session_state.edited_schedule_table is not None:
+        st.session_state.copyable_text = st.session_state.edited_schedule_table.to_csv(sep='\t', index=False,
+                                                                                        header=True)
+    lost = sorted(dropped - {'availability_lookup_df', 'copyable_text'})
+    if lost:
+        st.toast(f"⚠️ Không đọc lại được dữ liệu phiên đã lưu tạm ({', '.join(lost)}).", icon="⚠️")
+
+
+def open_schedule_store():
+    """The schedule store, or None (with a warning) when the database cannot be opened."""
+    try:
+        return get_schedule_store()
+    except (sqlite3.Error, OSError) as e:
+        if not st.session_state.get('schedule_store_warned'):
+            st.session_state.schedule_store_warned = True  # Cảnh báo một lần mỗi phiên
+            st.toast(f"⚠️ Không mở được kho lịch ({e}); lịch sẽ không được lưu.", icon="⚠️")
+        return None
+
+
+@st.cache_resource
+def get_breaker_registry():
+    """Circuit breakers shared across reruns and sessions (one per model name)."""
+    return BreakerRegistry(AI_CALL_POLICY.breaker_failure_threshold, AI_CALL_POLICY.breaker_reset_seconds)
+
+
+def make_model_getter(primary_model):
+    """Returns name -> model: the configured model for MODEL_NAME, lazily built fallbacks otherwise."""
+    fallback_models = {}
+
+    def get_model(model_name):
+        if model_name == MODEL_NAME:
+            return primary_model
+        if model_name not in fallback_models:
+            import google.generativeai as genai  # Client đã được cấu hình khi tạo model chính
+            fallback_models[model_name] = genai.GenerativeModel(model_name=model_name,
+                                                                generation_config=generation_config)
+        return fallback_models[model_name]
+
+    return get_model
 
 
 # --- Custom CSS for Styling (Keep as is) ---
@@ -149,7 +288,7 @@ def load_css():
 # --- Credential Loading and Login Logic ---
 def load_credentials():
     """Loads credentials from Streamlit secrets or local file."""
-    credentials_dict = st.secrets.get("credentials", {})
+    credentials_dict = get_secret("credentials", {})
     if not credentials_dict:
         st.toast("Không tìm thấy credentials trong Secrets. Thử đọc file credentials.yaml...", icon="⚠️")
         try:
@@ -192,8 +331,11 @@ def get_scheduling_requirements():
     """Gets scheduling constraints from the sidebar."""
     st.sidebar.header("⚙️ Điều Kiện Lập Lịch")
     st.sidebar.divider()
+    shifts_definition = get_shifts_definition()
+    if shifts_definition is None:
+        return None  # Sidebar error already shown
     requirements = {
-        "shifts_definition": {"Ca 1": {"start": "09:00", "end": "15:00"}, "Ca 2": {"start": "14:00", "end": "20:00"}},
+        "shifts_definition": shifts_definition,
         "max_shifts_per_day": 1,
         "shifts_per_week_target": 4,  # Mục tiêu số ca mỗi tuần
         "min_rest_hours": st.sidebar.number_input("Giờ nghỉ tối thiểu (>1 ca/ngày)", min_value=1, value=8, step=1),
@@ -203,12 +345,16 @@ def get_scheduling_requirements():
     }
     st.sidebar.divider();
     st.sidebar.markdown("**ℹ️ Quy tắc:**")
-    st.sidebar.markdown(
-        f"- **Ca 1:** {requirements['shifts_definition']['Ca 1']['start']} - {requirements['shifts_definition']['Ca 1']['end']}")
-    st.sidebar.markdown(
-        f"- **Ca 2:** {requirements['shifts_definition']['Ca 2']['start']} - {requirements['shifts_definition']['Ca 2']['end']}")
+    model = shift_model(requirements)
+    for name, spec in shifts_definition.items():
+        st.sidebar.markdown(f"- **{name}:** {spec['start']} - {spec['end']}")
     # --- CHANGE 1: Updated the staffing rule text in the sidebar ---
-    st.sidebar.markdown(f"- **Số người/ca:** **1** (ngày thường), **2** (ngày event VD: 3/3, 5/5...)")
+    if model.default_staffing:
+        st.sidebar.markdown(f"- **Số người/ca:** **1** (ngày thường), **2** (ngày event VD: 3/3, 5/5...)")
+    else:
+        st.sidebar.markdown("- **Số người/ca (T2→CN):** " + "; ".join(
+            f"{name} **{'/'.join(map(str, model.staff_curve(name)))}**" if model.staff_curve(name)
+            else f"{name} **1**/**2** (ngày event)" for name in model.names))
     st.sidebar.markdown(f"- **Tối đa:** **{requirements['max_shifts_per_day']}** ca/người/ngày")
     st.sidebar.markdown(
         f"- **Tổng số ca/tuần (Mục tiêu):** **{requirements['shifts_per_week_target']}** ca/người")  # Hiển thị mục tiêu
@@ -216,380 +362,525 @@ def get_scheduling_requirements():
     if not requirements["min_rest_hours"] > 0 or not requirements["max_consecutive_days"] > 0:
         st.sidebar.error("Giờ nghỉ và ngày làm liên tiếp phải lớn hơn 0.");
         return None  # Critical for sidebar config
+    st.session_state.shift_layout = (model.names, model.slot_counts())  # Cột của bảng chỉnh sửa / xuất file
     return requirements
 
 
+def get_shifts_definition():
+    """Shift table in the sidebar -> ``shifts_definition`` (see shifts.py), or None with an error when invalid."""
+    default_rows = pd.DataFrame([[name, spec["start"], spec["end"], ", ".join(map(str, spec.get("staff") or []))
+                                  if isinstance(spec.get("staff"), (list, tuple)) else str(spec.get("staff") or ""),
+                                  ", ".join(spec.get("keywords") or [])]
+                                 for name, spec in DEFAULT_SHIFTS_DEFINITION.items()], columns=SHIFT_EDITOR_COLUMNS)
+    with st.sidebar.expander("🕘 Ca làm việc"):
+        st.caption("Số người: để trống = 2 người ngày trùng tháng, 1 người ngày thường; hoặc 1 số cho mọi ngày, "
+                   "hoặc 7 số (Thứ 2 → Chủ Nhật) cách nhau bằng dấu phẩy. Từ khóa (cách nhau bằng dấu phẩy): chữ "
+                   "trong ô đăng ký chỉ ca này, để trống = từ khóa mặc định.")
+        edited = st.data_editor(default_rows, num_rows="dynamic", hide_index=True, use_container_width=True,
+                                key="shift_config_editor",
+                                column_config={column: st.column_config.TextColumn(column) for column in SHIFT_EDITOR_COLUMNS})
+    shifts_definition = {}
+    try:
+        for row in edited.fillna("").astype(str).itertuples(index=False):
+            name, start, end, staff, keywords = (value.strip() for value in row)
+            if not (name or start or end):
+                continue  # Dòng trống vừa thêm
+            if not name or name in shifts_definition:
+                raise ShiftConfigError(f"Tên ca trống hoặc bị trùng: '{name}'")
+            spec = {"start": start, "end": end}
+            if staff:
+                spec["staff"] = staff
+            if keywords:
+                spec["keywords"] = [keyword.strip() for keyword in keywords.split(",") if keyword.strip()]
+            shifts_definition[name] = spec
+        ShiftModel(shifts_definition)  # Kiểm tra giờ, số người...
+    except ShiftConfigError as e:
+        st.sidebar.error(f"Cấu hình ca không hợp lệ: {e}")
+        return None
+    return shifts_definition
+
+
+def current_shift_layout():
+    """(shift names, {shift: editor slots}) of the configured shifts (Ca 1 / Ca 2 x 3 before the sidebar runs)."""
+    return st.session_state.get('shift_layout') or scheduler.display_layout()
+
+
+def notify_toast(message, icon=None):
+    """``notify`` callback for the scheduler API: shows progress messages as toasts."""
+    st.toast(message, icon=icon)
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def read_uploaded_roster(content_hash, file_name, _data):
+    """Parsed registration file and its progress messages, cached by content hash (re-uploads are free)."""
+    messages = []
+    df_input = read_registration_file(_data, file_name, lambda message, icon=None: messages.append((message, icon)))
+    return df_input, messages
+
+
+def read_uploaded_file(uploaded_file):
+    """Reads an st.file_uploader XLSX/CSV file like a paste (see roster_files.py)."""
+    data = uploaded_file.getvalue()
+    df_input, messages = read_uploaded_roster(file_hash(data), uploaded_file.name, data)
+    for message, icon in messages:
+        notify_toast(message, icon)
+    return df_input
+
+
 # --- Helper Function to Find Start Date (Keep updated date parsing) ---
 def find_start_date(df_input):
     """Finds the start date (Monday) from the input DataFrame."""
-    week_start_col = next((col for col in df_input.columns if 'tuần' in col.lower() or 'week' in col.lower()), None)
-    start_date = None
-    if week_start_col and not df_input[week_start_col].empty:
-        date_val_str = str(df_input[week_start_col].dropna().iloc[0])  # Get value as string
-        try:
-            # Thử định dạng DD/MM/YYYY trước
-            start_date = pd.to_datetime(date_val_str, format='%d/%m/%Y', errors='coerce')
-            if pd.isna(start_date):  # Nếu thất bại, thử định dạng MM/DD/YYYY
-                start_date = pd.to_datetime(date_val_str, format='%m/%d/%Y', errors='coerce')
-            if pd.isna(start_date):  # Nếu vẫn thất bại, thử định dạng YYYY-MM-DD
-                start_date = pd.to_datetime(date_val_str, format='%Y-%m-%d', errors='coerce')
-            if pd.isna(start_date):  # Nếu vẫn thất bại, để pandas tự động phát hiện
-                start_date = pd.to_datetime(date_val_str, errors='coerce')
-
-            if pd.notna(start_date):
-                start_date = start_date - timedelta(days=start_date.weekday())  # Lùi về thứ 2 đầu tuần
-        except Exception as e:
-            st.toast(f"Lỗi phân tích ngày tháng từ cột '{week_start_col}': {e}. Giá trị: '{date_val_str}'", icon="⚠️");
-            pass
-    return start_date
+    return scheduler.find_start_date(df_input, notify_toast)
 
 
 # --- RE-ADD: Preprocess Pasted Data for Availability Lookup ---
-def preprocess_pasted_data_for_lookup(df_input):
+def preprocess_pasted_data_for_lookup(df_input, requirements=None):
     """Processes the raw pasted DataFrame to create a structured availability lookup table."""
     st.toast("⚙️ Đang xử lý dữ liệu đăng ký gốc để tra cứu...", icon="⚙️")
-    processed_rows = []
-    start_date = find_start_date(df_input)
-    if start_date is None:
-        st.toast("⚠️ Không xác định được ngày bắt đầu tuần. Chức năng tìm thay thế sẽ không hoạt động.", icon="⚠️")
-        return pd.DataFrame(columns=['Date', 'Employee', 'Shift', 'Can_Work', 'Note'])  # Return empty DF
-
-    employee_col = next((col for col in df_input.columns if 'tên' in col.lower()), None)
-    note_col = next((col for col in df_input.columns if 'ghi chú' in col.lower()), None)
-    day_mapping = {};
-    day_keywords_map = {
-        0: ['thứ 2', 'mon'], 1: ['thứ 3', 'tue'], 2: ['thứ 4', 'wed'], 3: ['thứ 5', 'thu'],
-        4: ['thứ 6', 'fri'], 5: ['thứ 7', 'sat'], 6: ['chủ nhật', 'sun', 'cn']  # Thêm 'cn'
-    }
-    found_day_cols = False
-    for day_index, keywords in day_keywords_map.items():
-        for col in df_input.columns:
-            col_lower = str(col).lower()
-            # --- More specific check for day columns, allowing for variations ---
-            if any(f'[{keyword}]' in col_lower for keyword in keywords) or \
-                    any(f' {keyword}' in col_lower for keyword in keywords) or \
-                    any(keyword == col_lower.replace("bạn có thể làm việc thời gian nào?", "").strip().replace("[",
-                                                                                                               "").replace(
-                        "]", "") for keyword in keywords):
-                day_mapping[day_index] = col;
-                found_day_cols = True;
-                break
-    if not found_day_cols: st.error(
-        "❌ Không tìm thấy các cột ngày (VD: '... [Thứ 2]'). Kiểm tra lại tên cột."); return None  # Critical
-    if not employee_col: st.error("❌ Không tìm thấy cột tên nhân viên."); return None  # Critical
-
-    for index, row in df_input.iterrows():
-        employee = row.get(employee_col);
-        note = row.get(note_col, '') if note_col else ''
-        if not employee or pd.isna(employee): continue
-        employee_name = str(employee).strip()  # Đảm bảo tên nhân viên là string và đã strip
-
-        for day_index, day_col in day_mapping.items():
-            current_date = start_date + timedelta(days=day_index)
-            availability_text = str(row.get(day_col, '')).lower()
-            can_do_ca1 = False;
-            can_do_ca2 = False
-            if 'nghỉ' in availability_text or 'off' in availability_text or 'bận' in availability_text:
-                pass  # Both remain False
-            else:
-                if 'ca 1' in availability_text or 'sáng' in availability_text or '9h' in availability_text or '9:00' in availability_text: can_do_ca1 = True
-                if 'ca 2' in availability_text or 'chiều' in availability_text or '14h' in availability_text or '2h' in availability_text or '14:00' in availability_text: can_do_ca2 = True
-                # If text exists but doesn't specify shift, assume both possible unless explicitly 'nghi'
-                if not can_do_ca1 and not can_do_ca2 and availability_text.strip() != '' and not any(
-                        x in availability_text for x in ['nghỉ', 'off', 'bận']):
-                    can_do_ca1 = True;
-                    can_do_ca2 = True
-            processed_rows.append(
-                {'Date': current_date.date(), 'Employee': employee_name, 'Shift': 'Ca 1', 'Can_Work': can_do_ca1,
-                 'Note': note})
-            processed_rows.append(
-                {'Date': current_date.date(), 'Employee': employee_name, 'Shift': 'Ca 2', 'Can_Work': can_do_ca2,
-                 'Note': note})
-    if not processed_rows: st.toast("⚠️ Không có dữ liệu đăng ký hợp lệ.", icon="⚠️"); return pd.DataFrame(
-        columns=['Date', 'Employee', 'Shift', 'Can_Work', 'Note'])
-    lookup_df = pd.DataFrame(processed_rows)
-    lookup_df['Date'] = pd.to_datetime(lookup_df['Date']).dt.date  # Ensure Date is date object
+    try:
+        lookup_df = scheduler.preprocess_pasted_data_for_lookup(df_input, notify_toast, requirements)
+    except RosterFormatError as e:
+        st.error(str(e)); return None  # Critical
+    if lookup_df.empty: st.toast("⚠️ Không có dữ liệu đăng ký hợp lệ.", icon="⚠️"); return lookup_df
     st.toast("✅ Đã xử lý xong dữ liệu đăng ký gốc.", icon="✅");
     return lookup_df
 
 
-# --- AI Schedule Generation Function (UPDATED PROMPT with reinforced Double Day rule) ---
-def generate_schedule_with_ai(df_input, requirements, model):
-    """Constructs a prompt and calls the AI model to generate the schedule."""
-    st.toast(" Chuẩn bị dữ liệu và tạo prompt cho AI...", icon="⚙️")
-    data_prompt_list = [];
-    data_prompt_list.append("Dữ liệu đăng ký của nhân viên:")
-    employee_col = next((col for col in df_input.columns if 'tên' in col.lower()), None)
-    note_col = next((col for col in df_input.columns if 'ghi chú' in col.lower()), None)
-    day_keywords = ['thứ 2', 'thứ 3', 'thứ 4', 'thứ 5', 'thứ 6', 'thứ 7', 'chủ nhật', 'mon', 'tue', 'wed', 'thu', 'fri',
-                    'sat', 'sun', 'cn']
-    day_cols_map = {}  # Sử dụng map để giữ đúng thứ tự ngày
-    days_order = ["thứ 2", "thứ 3", "thứ 4", "thứ 5", "thứ 6", "thứ 7", "chủ nhật"]  # hoặc "cn"
-
-    # Tìm cột cho từng ngày
-    for day_name_vn in days_order:
-        for col in df_input.columns:
-            col_lower = str(col).lower()
-            # Kiểm tra chính xác hơn, ví dụ: "[thứ 2]" hoặc "thứ 2" ở cuối
-            if f"[{day_name_vn}]" in col_lower or col_lower.endswith(day_name_vn) or day_name_vn in col_lower:
-                day_cols_map[day_name_vn] = col
-                break
-    day_cols = [day_cols_map[d] for d in days_order if d in day_cols_map]  # Lấy các cột theo đúng thứ tự
-
-    start_date = find_start_date(df_input);
-    start_date_str_for_prompt = start_date.strftime('%Y-%m-%d') if start_date else "Không xác định"
-    if not employee_col: st.error("Lỗi: Không thể xác định cột 'Tên nhân viên'."); return None  # Critical
-    if not day_cols: st.toast("Không tìm thấy đủ các cột ngày (Thứ 2-CN). Kiểm tra lại tên cột trong file Excel.",
-                              icon="⚠️")
-    if start_date is None: st.toast("Không xác định được ngày bắt đầu tuần.", icon="⚠️")
-
-    data_prompt_list.append(f"(Dữ liệu cho tuần bắt đầu Thứ 2 khoảng: {start_date_str_for_prompt})")
-    unique_employee_names = df_input[employee_col].astype(
-        str).str.strip().unique()  # Lấy danh sách tên nhân viên duy nhất
-    data_prompt_list.append(
-        f"**LƯU Ý QUAN TRỌNG VỀ TÊN NHÂN VIÊN:** Danh sách nhân viên bao gồm: {', '.join(unique_employee_names)}. Mỗi tên là một người riêng biệt. Ví dụ, 'Nguyên' và 'Nguyên Đào' là HAI NGƯỜI KHÁC NHAU. Tuyệt đối không được nhầm lẫn họ.")
-
-    for index, row in df_input.iterrows():  # Format data for prompt
-        emp_name = str(row[employee_col]).strip();
-        data_prompt_list.append(f"Nhân viên: {emp_name}")
-        availability_info = []
-        if day_cols:
-            for day_col_name in day_cols:  # Duyệt theo thứ tự đã sắp xếp
-                cell_value = row.get(day_col_name)
-                # Lấy tên ngày từ tên cột để hiển thị (ví dụ: "Thứ 2" từ "bạn có thể làm việc thời gian nào? [Thứ 2]")
-                clean_day_name = day_col_name
-                match = re.search(r'\[(.*?)\]', day_col_name)
-                if match:
-                    clean_day_name = match.group(1)
-                elif any(d in day_col_name.lower() for d in days_order):
-                    for d_keyword in days_order:
-                        if d_keyword in day_col_name.lower():
-                            clean_day_name = d_keyword.capitalize()
-                            break
-
-                if pd.notna(cell_value):
-                    availability_info.append(f"- {clean_day_name}: {cell_value}")
-                else:
-                    availability_info.append(f"- {clean_day_name}: (Trống)")
-        else:
-            availability_info.append(f"  (Thông tin chi tiết: {row.to_dict()})")
-        data_prompt_list.extend(availability_info)
-        if note_col and pd.notna(row.get(note_col)):
-            data_prompt_list.append(f"- Ghi chú: {row[note_col]}")
-        else:
-            data_prompt_list.append(f"- Ghi chú: Không có")
-        data_prompt_list.append("---")
-    data_prompt = "\n".join(data_prompt_list)
-
-    daily_staffing_prompt = "- **Yêu cầu số lượng nhân viên (Part-time) mỗi ca:**\n"
-    if start_date:
-        for i in range(7):
-            current_day = start_date + timedelta(days=i)
-            # --- CHANGE 2: Updated the staffing logic (2 for sale days, 1 for normal days) ---
-            staff_count = 2 if current_day.day == current_day.month else 1
-            day_name_vn = ["Thứ 2", "Thứ 3", "Thứ 4", "Thứ 5", "Thứ 6", "Thứ 7", "Chủ Nhật"][i]
-            daily_staffing_prompt += f"  + Ngày {current_day.strftime('%Y-%m-%d')} ({day_name_vn}): **{staff_count} người/ca** (Ca 1 và Ca 2).\n"
-    else:
-        # --- CHANGE 3: Updated the fallback staffing number ---
-        daily_staffing_prompt += "  + **1 người/ca** cho tất cả các ngày.\n"
-
-    req_prompt_list = []  # Format requirements for prompt
-    req_prompt_list.append("\nRàng buộc và Quy tắc xếp lịch:")
-    # --- ADDED RULE: Treat employee names as distinct ---
-    req_prompt_list.append(
-        f"- **QUY TẮC XỬ LÝ TÊN NHÂN VIÊN (CỰC KỲ QUAN TRỌNG):** Mỗi tên nhân viên được cung cấp trong dữ liệu (ví dụ: {', '.join(unique_employee_names[:3])}...) phải được coi là một cá nhân HOÀN TOÀN RIÊNG BIỆT. KHÔNG được phép gộp hoặc nhầm lẫn các tên tương tự nhau (ví dụ: 'Nguyên' và 'Nguyên Đào' là hai người khác nhau và phải được xếp lịch độc lập). Hãy xử lý từng dòng dữ liệu nhân viên một cách riêng rẽ.")
-    req_prompt_list.append(
-        f"- Ca làm việc: Ca 1 ({requirements['shifts_definition']['Ca 1']['start']} - {requirements['shifts_definition']['Ca 1']['end']}), Ca 2 ({requirements['shifts_definition']['Ca 2']['start']} - {requirements['shifts_definition']['Ca 2']['end']}).")
-    req_prompt_list.append(f"- Mỗi nhân viên làm tối đa {requirements['max_shifts_per_day']} ca/ngày.")
-    # --- MODIFIED LINE (Rule for 4 shifts per week) ---
-    req_prompt_list.append(
-        f"- **MỤC TIÊU QUAN TRỌNG NHẤT (BẮT BUỘC TUÂN THỦ):** Phân bổ chính xác **{requirements['shifts_per_week_target']} ca làm việc cho MỖI nhân viên** (trừ FM/Sup, hoặc những người có ghi chú 'nghỉ cả tuần' / 'xin nghỉ nguyên tuần' trong cột Ghi Chú, hoặc những người không đăng ký đủ số buổi khả dụng để đạt {requirements['shifts_per_week_target']} ca). Việc này phải được ưu tiên HÀNG ĐẦU, chỉ sau việc tôn trọng các ngày đăng ký 'Nghỉ' cụ thể của nhân viên (ví dụ: 'Nghỉ' trong cột của Thứ 2 thì không xếp lịch cho Thứ 2). Nếu không thể đạt được mục tiêu {requirements['shifts_per_week_target']} ca cho một nhân viên nào đó (mà họ đủ điều kiện), AI PHẢI giải thích rõ ràng lý do cụ thể cho từng trường hợp không đạt được trong phần phản hồi của mình, ngay bên dưới bảng lịch.")
-    req_prompt_list.append(f"- Ít nhất {requirements['min_rest_hours']} giờ nghỉ giữa các ca (nếu có thể >1 ca/ngày).")
-    req_prompt_list.append(f"- Tối đa {requirements['max_consecutive_days']} ngày làm việc liên tiếp.")
-    req_prompt_list.append(daily_staffing_prompt[:-1])  # Remove last newline
-    # --- CHANGE 4: Updated the summary note for staffing ---
-    req_prompt_list.append(
-        "  + **LƯU Ý:** Ngày trùng tháng (ví dụ 3/3, 5/5) cần 2 người/ca, các ngày khác cần 1 người/ca.")
-    req_prompt_list.append(f"- Xử lý 'Ghi chú' của nhân viên (trong cột 'Ghi chú (nếu có)'):")
-    req_prompt_list.append(
-        f"  + **Ưu tiên 1 (Bắt buộc):** Nếu cột 'Ghi chú' chứa 'nghỉ cả tuần', 'xin nghỉ nguyên tuần', 'nghỉ', 'bận', 'không thể', 'xin off' -> TUYỆT ĐỐI KHÔNG xếp lịch cho nhân viên đó trong cả tuần (trừ khi ghi chú chỉ rõ phạm vi ngày cụ thể).")
-    req_prompt_list.append(
-        f"  + **Ưu tiên 2 (Mong muốn):** Nếu cột 'Ghi chú' chứa 'muốn làm', 'ưu tiên', 'có thể làm' -> CỐ GẮNG xếp nếu không vi phạm ràng buộc khác (mức độ ưu tiên gợi ý: {requirements['preferences_weight_hint']}).")
-    req_prompt_list.append(
-        f"  + **Ưu tiên 3 (Giờ làm không trọn vẹn trong cột Ghi chú):** Nếu cột 'Ghi chú' có giờ cụ thể (VD: 'chỉ làm 9h-12h', 'làm từ 16h'), hãy làm theo các bước sau:")
-    req_prompt_list.append(
-        f"      1. Ưu tiên xếp đủ số người có thể làm **trọn vẹn** ca đó trước (dựa trên đăng ký các cột ngày).")
-    req_prompt_list.append(
-        f"      2. **CHỈ KHI** ca đó vẫn còn thiếu người theo yêu cầu số lượng, thì MỚI xem xét xếp nhân viên có giờ làm không trọn vẹn (theo cột Ghi chú) vào để đáp ứng nguyện vọng của họ (dù họ không làm đủ giờ).")
-    req_prompt_list.append(
-        f"      3. Nếu ca đã đủ người làm trọn vẹn, thì KHÔNG xếp thêm người chỉ làm được một phần giờ (theo cột Ghi chú).")
-    req_prompt_list.append(
-        "- Chỉ xếp lịch vào ca nhân viên đăng ký/có thể làm (dựa trên dữ liệu các cột ngày Thứ 2 - Chủ Nhật).")
-    req_prompt_list.append("- Bỏ qua nhân viên 'FM/Sup'.")
-    req_prompt = "\n".join(req_prompt_list)
-
-    full_prompt = f"""
-Bạn là một trợ lý quản lý lịch làm việc siêu hạng. Dựa vào dữ liệu đăng ký của nhân viên (chủ yếu là Part-time) và các quy tắc ràng buộc dưới đây, hãy tạo ra một lịch làm việc tối ưu cho tuần, **bắt đầu từ ngày Thứ Hai là {start_date_str_for_prompt} (YYYY-MM-DD)**.
-
-{data_prompt}
-
-{req_prompt}
-
-**Yêu cầu đầu ra:**
-Hãy trình bày lịch làm việc dưới dạng một bảng MARKDOWN rõ ràng.
-**Cột đầu tiên PHẢI là "Ngày" và chứa ngày tháng cụ thể (theo định dạng YYYY-MM-DD)** cho từng ngày trong tuần (Thứ 2 đến Chủ Nhật), tính toán dựa trên ngày bắt đầu tuần đã cho ({start_date_str_for_prompt}).
-Các cột tiếp theo là "Ca" và "Nhân viên được phân công". Sắp xếp theo ngày. **Trong cột "Nhân viên được phân công", liệt kê TẤT CẢ tên nhân viên được xếp vào ca đó, cách nhau bằng dấu phẩy.**
-
-**--- CHANGE 5: Updated the example Markdown table in the prompt ---**
-Ví dụ định dạng bảng MARKDOWN mong muốn (với ngày bắt đầu là 2025-05-05, là ngày Double Day):
-
-| Ngày       | Ca    | Nhân viên được phân công |
-|------------|-------|--------------------------|
-| 2025-05-05 | Ca 1  | NV A, NV B               | <--- 2 người vì là ngày 5/5
-| 2025-05-05 | Ca 2  | NV C, NV D               | <--- 2 người vì là ngày 5/5
-| 2025-05-06 | Ca 1  | NV E                     | <--- 1 người vì là ngày thường
-| ... (cho đến 2025-05-11) ... | ...   | ...                      |
-
-**QUAN TRỌNG:** Chỉ trả về BẢNG MARKDOWN lịch làm việc, không thêm bất kỳ lời giải thích hay bình luận nào khác trước hoặc sau bảng. Đảm bảo cột "Ngày" chứa ngày YYYY-MM-DD chính xác cho cả tuần. **Đảm bảo xử lý các 'Ghi chú' theo hướng dẫn đã nêu, đặc biệt là logic ưu tiên cho giờ làm không trọn vẹn.** Đảm bảo mọi ràng buộc khác được đáp ứng (đặc biệt là **số người/ca theo từng ngày** như đã nêu ở trên, **MỤC TIÊU {requirements['shifts_per_week_target']} ca/người/tuần PHẢI ĐƯỢC ƯU TIÊN TỐI ĐA**, và {requirements['max_shifts_per_day']} ca/người/ngày).
-Nếu không thể tạo lịch đáp ứng tất cả ràng buộc (ví dụ: thiếu người cho một ca nào đó, hoặc không thể đảm bảo {requirements['shifts_per_week_target']} ca/tuần cho mọi người), hãy ghi rõ điều đó trong bảng hoặc nêu lý do ngắn gọn ngay dưới bảng. **Đặc biệt, nếu một ca không đủ số người yêu cầu (ví dụ, cần 2 người nhưng chỉ xếp được 1), hãy ghi chú trong cột 'Nhân viên được phân công' là 'Tên NV được xếp, (Thiếu 1 người)' hoặc nếu không có ai thì ghi '(Thiếu 2 người)' hoặc tương tự.**
-"""
+# --- AI Schedule Generation Function (prompt text in scheduler.build_schedule_prompt) ---
+def build_schedule_prompt(df_input, requirements, output_format=OUTPUT_MARKDOWN, compact=False):
+    """Constructs the scheduling prompt for one week of registration data (None if it cannot be built)."""
+    try:
+        return scheduler.build_schedule_prompt(df_input, requirements, output_format, compact, notify_toast)
+    except RosterFormatError as e:
+        st.error(str(e)); return None  # Critical
+
+
+def show_prompt_report(full_prompt, model=None, compact=False):
+    """Token/size report shown next to the 'Xem Prompt' expander (model.count_tokens when a model is available)."""
+    prompt_tokens, exact = scheduler.count_prompt_tokens(full_prompt, model)
+    count = f"{prompt_tokens:,} token (model.count_tokens)" if exact else f"~{prompt_tokens:,} token (ước tính cục bộ)"
+    st.caption(f"🧮 Prompt: {count} · {len(full_prompt):,} ký tự")
+    if prompt_tokens > PROMPT_TOKEN_WARNING:
+        advice = "" if compact else " Bật 'Prompt rút gọn' để giảm chi phí và thời gian chờ."
+        st.warning(f"⚠️ Prompt khá lớn ({'' if exact else '~'}{prompt_tokens:,} token).{advice}")
+
+
+def call_model_cached(full_prompt, get_model, breakers, output_format=OUTPUT_MARKDOWN):
+    """Thread-safe model call used by batch workers: no Streamlit calls, responses go through the disk cache."""
+    response_text, _, _ = scheduler.request_ai_schedule(full_prompt, get_model, AI_CALL_POLICY, breakers, output_format,
+                                                        cache=response_cache)
+    return response_text
+
+
+def show_call_attempts(attempts):
+    """Per-attempt latency / outcome log of the last AI call."""
+    if not attempts:
+        return
+    with st.expander(f"⏱️ Chi tiết các lần gọi AI ({len(attempts)} lần)"):
+        st.dataframe(pd.DataFrame([{
+            "Model": a["model"], "Lần": a["attempt"], "Thời gian (ms)": round(a["latency"] * 1000),
+            "Kết quả": a["outcome"], "Lỗi": a["error"] or ""} for a in attempts]),
+            use_container_width=True, hide_index=True)
+
+
+def finish_trace(trace):
+    """Writes a finished run to the JSON-lines log and keeps it for the diagnostics panel."""
+    record = trace.to_record()
+    trace_log.write(record)
+    history = st.session_state.setdefault('run_traces', [])
+    history.append(record)
+    del history[:-DIAGNOSTICS_HISTORY]
+
+
+def show_diagnostics_panel():
+    """Collapsible table of the last runs (stage timings, tokens) of this session."""
+    history = st.session_state.get('run_traces') or []
+    with st.expander(f"🩺 Chẩn đoán hiệu năng ({len(history)} lần chạy gần nhất)"):
+        if not history:
+            st.caption("Chưa có lần chạy nào được ghi lại.")
+            return
+        runs = list(reversed(history))  # Mới nhất trước
+        st.dataframe(pd.DataFrame([{
+            "Thời điểm": r["ts"], "Loại": r["kind"], "Tổng (ms)": r["total_ms"],
+            "Bước chậm nhất": max(r["spans"], key=lambda s: s["ms"])["name"] if r["spans"] else "",
+            "Token prompt": r["tokens"].get("prompt_tokens"), "Token phản hồi": r["tokens"].get("response_tokens"),
+            "Nguồn token": r["tokens"].get("source", ""), "Mã": r["run_id"]} for r in runs]),
+            use_container_width=True, hide_index=True)
+        selected = st.selectbox("Chi tiết lần chạy", range(len(runs)), key="diagnostics_run",
+                                format_func=lambda i: f"{runs[i]['ts']} · {runs[i]['kind']} · {runs[i]['run_id']}")
+        run = runs[selected]
+        st.dataframe(pd.DataFrame([{
+            "Bước": s["name"], "Bắt đầu (ms)": s["start_ms"], "Thời gian (ms)": s["ms"],
+            "Chi tiết": ", ".join(f"{k}={v}" for k, v in s.items() if k not in ("name", "start_ms", "ms"))}
+            for s in run["spans"]]), use_container_width=True, hide_index=True)
+        st.caption(f"Nhật ký JSON lines: `{TRACE_LOG_PATH}`")
+        context = session_context()
+        footprint = get_session_data().footprint(context[0]) if context else None
+        if footprint is not None:
+            st.caption(f"Bộ nhớ phiên (lần chạy trước): {footprint.memory_bytes / 2 ** 20:.1f} MB, "
+                       f"ghi tạm ra đĩa {footprint.spilled_bytes / 2 ** 20:.1f} MB"
+                       f"{' · đã bỏ để tạo lại: ' + ', '.join(footprint.dropped) if footprint.dropped else ''} · "
+                       f"mọi phiên: {get_session_data().total_bytes() / 2 ** 20:.1f}/{SESSIONS_MEMORY_MB:g} MB")
+
+
+def request_schedule(full_prompt, model, output_format, force_refresh=False, trace=None, on_chunk=None):
+    """scheduler.request_ai_schedule with the app's call policy, breakers, disk cache and toasts."""
+    response_text, served_model, attempts = scheduler.request_ai_schedule(
+        full_prompt, make_model_getter(model), AI_CALL_POLICY, get_breaker_registry(), output_format,
+        cache=response_cache, force_refresh=force_refresh, trace=trace, on_chunk=on_chunk, notify=notify_toast)
+    st.session_state.ai_response_from_cache = served_model is None
+    return response_text, attempts
+
+
+def generate_schedule_with_ai(df_input, requirements, model, force_refresh=False, stream=False,
+                              output_format=OUTPUT_MARKDOWN, compact_prompt=False, trace=None):
+    """Builds the prompt and gets the schedule through scheduler.request_ai_schedule (cache, call policy)."""
+    with span_or_null(trace, "prompt_build", compact=compact_prompt):
+        full_prompt = build_schedule_prompt(df_input, requirements, output_format, compact=compact_prompt)
+    if full_prompt is None: return None
     with st.expander("Xem Prompt gửi đến AI (để tham khảo)"):
         st.text(full_prompt)
-    try:  # Call AI Model
+    show_prompt_report(full_prompt, model, compact_prompt)
+    st.session_state.ai_response_from_cache = False
+    if stream and output_format == OUTPUT_MARKDOWN:  # Streaming chỉ áp dụng cho bảng Markdown
+        return stream_schedule_from_ai(full_prompt, model, force_refresh, trace)
+    try:  # Call AI Model (timeout, retry with backoff, fallback models)
         # Spinner is better for long operations than a toast
         with st.spinner(f"⏳ Đang gọi AI ({MODEL_NAME}) để tạo lịch... Xin vui lòng chờ trong giây lát."):
-            response = model.generate_content(full_prompt)
-        st.toast(f"✅ AI ({MODEL_NAME}) đã phản hồi.", icon="✅");
-        return response.text
+            response_text, attempts = request_schedule(full_prompt, model, output_format, force_refresh, trace)
+    except ModelCallError as e:
+        show_call_attempts(e.attempts)
+        st.error(f"Lỗi khi gọi AI ({', '.join(AI_CALL_POLICY.models)}): {e}"); return None  # Critical
+    except Exception as e:
+        st.error(f"Lỗi khi gọi AI ({MODEL_NAME}): {e}"); return None  # Critical
+    show_call_attempts(attempts)
+    return response_text
+
+
+# --- Streaming AI Call: show schedule rows day by day as they arrive ---
+def stream_schedule_from_ai(full_prompt, model, force_refresh=False, trace=None):
+    """Streams the AI response through the call policy, rendering complete table rows as soon as they are received.
+
+    Rows parsed so far are kept in st.session_state.streamed_schedule_df so a truncated
+    stream still yields a (partial) schedule. Only complete responses are cached.
+    """
+    parser = IncrementalScheduleParser()
+    status_placeholder = st.empty()
+    table_placeholder = st.empty()
+    status_placeholder.info(f"📡 Đang nhận lịch từ AI ({MODEL_NAME})...")
+
+    def show_rows(chunk_text):
+        if parser.feed(chunk_text):
+            table_placeholder.dataframe(create_8_column_df(parser.to_dataframe()), use_container_width=True)
+
+    try:
+        response_text, attempts = request_schedule(full_prompt, model, OUTPUT_MARKDOWN, force_refresh, trace,
+                                                   on_chunk=show_rows)
+        parser.finish()
+    except StreamInterruptedError as e:
+        show_call_attempts(e.attempts)
+        if not parser.rows:
+            status_placeholder.empty()
+            st.error(f"Lỗi khi gọi AI ({e.model_name}): {e}"); return None  # Critical
+        st.warning(f"⚠️ {e} Giữ lại {len(parser.rows)} dòng lịch đã nhận.")
+        response_text, attempts = e.text, []
+    except ModelCallError as e:
+        status_placeholder.empty()
+        show_call_attempts(e.attempts)
+        st.error(f"Lỗi khi gọi AI ({', '.join(AI_CALL_POLICY.models)}): {e}"); return None  # Critical
     except Exception as e:
+        status_placeholder.empty()
         st.error(f"Lỗi khi gọi AI ({MODEL_NAME}): {e}"); return None  # Critical
+    status_placeholder.empty()
+    table_placeholder.empty()
+    st.session_state.streamed_schedule_df = parser.to_dataframe() if parser.rows else None
+    show_call_attempts(attempts)
+    return response_text
 
 
-# --- Function to Parse AI Response (Keep Improved Column Handling) ---
-def parse_ai_schedule(ai_response_text):
-    """Attempts to parse the AI's Markdown table response into a DataFrame."""
+# --- Parse AI Response (scheduler.parse_ai_response: structured JSON first, Markdown table as fallback) ---
+def parse_ai_response(ai_response_text, output_format):
+    """Parses the AI response according to the requested output format, showing the raw text and any error."""
     st.toast("🔎 Đang phân tích phản hồi từ AI...", icon="🔎")
     with st.expander("Xem phản hồi thô từ AI"):
-        st.text(ai_response_text)
-    # Cố gắng tìm bảng Markdown, kể cả khi có text thừa xung quanh
-    table_match = re.search(r"(\n?\|.*?\n(?:\|.*?\n)+)", ai_response_text, re.DOTALL)
-    if not table_match:
-        # Nếu không tìm thấy bảng hoàn chỉnh, thử tìm các dòng bắt đầu bằng '|'
-        lines = [line.strip() for line in ai_response_text.strip().split('\n') if line.strip().startswith('|')]
-        if len(lines) > 1:
-            st.toast("Không tìm thấy cấu trúc Markdown chuẩn, thử phân tích các dòng bắt đầu bằng '|'.", icon="⚠️")
-            table_content = "\n".join(lines)
-            # Kiểm tra xem có dòng header hợp lệ không (chứa ít nhất 2 dấu gạch nối)
-            if not re.search(r"\|.*-.*-.*\|", lines[1]):
-                st.toast("Dòng header Markdown có vẻ không hợp lệ, sẽ cố gắng thêm header mặc định.", icon="⚠️")
-                # Thêm header giả định nếu dòng thứ hai không phải là dòng phân cách header
-                table_content = "| Ngày | Ca | Nhân viên được phân công |\n|---|---|---|\n" + table_content
+        if output_format == OUTPUT_JSON:
+            st.code(ai_response_text, language="json")
         else:
-            st.error("Không tìm thấy định dạng bảng Markdown trong phản hồi của AI.")  # Critical
-            return None
+            st.text(ai_response_text)
+    try:
+        df_schedule = scheduler.parse_ai_response(ai_response_text, output_format, notify_toast)
+    except ScheduleParseError as e:
+        st.error(str(e))  # Critical
+        if e.table is not None:
+            st.dataframe(e.table)
+        st.info("Vui lòng kiểm tra 'Phản hồi thô từ AI' ở trên để xem định dạng AI trả về.")
+        return None
+    if df_schedule is not None and df_schedule.attrs.get("notes"):
+        st.info(f"Ghi chú từ AI: {df_schedule.attrs['notes']}")
+    return df_schedule
+
+
+# --- Editor Index: built once per (schedule, availability) pair and kept in session state ---
+def get_editor_index(parsed_schedule_df, availability_df):
+    """Returns the precomputed dates / assignments / option lists used by the schedule editor."""
+    shift_names, _ = current_shift_layout()
+    cached = st.session_state.get('editor_index')
+    if cached and cached['schedule'] is parsed_schedule_df and cached['availability'] is availability_df and \
+            cached['shifts'] == shift_names:
+        return cached
+
+    availability_index = st.session_state.get('availability_index')
+    if not availability_index or availability_index.get('source') is not availability_df:
+        availability_index = build_availability_index(availability_df)
+        availability_index['source'] = availability_df
+        st.session_state.availability_index = availability_index
+
+    assignments = build_assignment_index(parsed_schedule_df)
+    dates = sorted({day for day, _ in assignments})
+    all_available_employees = ("",) + availability_index['employees']  # Danh sách chung (fallback)
+    registry = availability_index['registry']
+    initial_staff, options = {}, {}
+    for slot in ((day, shift) for day in dates for shift in shift_names):
+        # Bỏ qua ghi chú thiếu người; tên AI viết khác (dấu, hoa thường) quy về tên trong danh sách
+        initial_staff[slot] = [registry.canonical(name) for name in assignments.get(slot, ()) if "(Thiếu" not in name]
+        # Gộp danh sách đăng ký và danh sách đã được xếp, sắp xếp và đảm bảo duy nhất
+        slot_options = tuple(sorted(set(("",) + availability_index['slots'].get(slot, ()) + tuple(initial_staff[slot]))))
+        if slot_options == ("",):  # Nếu chỉ có lựa chọn rỗng
+            slot_options = all_available_employees  # Fallback nếu không ai đăng ký/được xếp ca này
+        options[slot] = (slot_options, {name: i for i, name in enumerate(slot_options)})
+    # Lưới st.data_editor chỉ hỗ trợ danh sách chọn theo cột: gộp lựa chọn của mọi ngày cho từng ca
+    column_options = {shift: sorted(set().union(*(options[(day, shift)][0] for day in dates)) or {""})
+                      for shift in shift_names}
+
+    editor_index = {
+        'schedule': parsed_schedule_df, 'availability': availability_df, 'shifts': list(shift_names),
+        'dates': dates,
+        'initial_staff': initial_staff, 'options': options, 'column_options': column_options,
+        'fallback_options': (all_available_employees, {name: i for i, name in enumerate(all_available_employees)}),
+    }
+    st.session_state.editor_index = editor_index
+    return editor_index
+
+
+def match_roster_names(parsed_df, availability_df):
+    """Schedule with AI name variants rewritten to the roster spelling (registry of the current paste)."""
+    availability_index = st.session_state.get('availability_index')
+    if availability_index and availability_index.get('source') is availability_df:
+        registry = availability_index['registry']
     else:
-        table_content = table_match.group(1).strip()
-        # Kiểm tra lại header sau khi trích xuất
-        lines = table_content.split('\n')
-        if len(lines) > 1 and not re.search(r"\|.*-.*-.*\|", lines[1]):  # Kiểm tra dòng thứ 2 (index 1)
-            st.toast("Dòng header Markdown sau khi trích xuất có vẻ không hợp lệ, sẽ cố gắng thêm header mặc định.",
-                     icon="⚠️")
-            # Giả định dòng đầu là header data, chèn dòng phân cách
-            table_content = lines[0] + "\n|---|---|---|\n" + "\n".join(lines[1:])
+        registry = EmployeeRegistry.from_lookup(availability_df)
+    return scheduler.match_roster_names(parsed_df, registry, notify_toast)
+
 
+def current_week():
+    """Monday ('YYYY-MM-DD') of the pasted roster, or None before a paste."""
+    lookup_df = st.session_state.get('availability_lookup_df')
+    return None if lookup_df is None or lookup_df.empty else week_key(lookup_df['Date'].min())
+
+
+def remember_roster(requirements):
+    """Saves the pasted roster and its lookup to the schedule store (sets session 'roster_id')."""
+    st.session_state.roster_id = None
+    store, lookup_df = open_schedule_store(), st.session_state.availability_lookup_df
+    if store is None or st.session_state.df_from_paste is None or lookup_df is None or lookup_df.empty:
+        return
     try:
-        data_io = io.StringIO(table_content)
-        # Đọc CSV, bỏ qua các dòng trống và dòng không phải là bảng
-        df_schedule = pd.read_csv(data_io, sep='|', skipinitialspace=True, on_bad_lines='skip')
-
-        # Loại bỏ các cột và hàng trống hoặc không hợp lệ
-        df_schedule = df_schedule.dropna(axis=1, how='all')  # Bỏ cột toàn NaN
-        if df_schedule.shape[1] > 0 and df_schedule.iloc[:,
-                                        0].isnull().all():  # Nếu cột đầu tiên toàn NaN (thường do dấu | ở đầu)
-            df_schedule = df_schedule.iloc[:, 1:]
-        if df_schedule.shape[1] > 0 and df_schedule.iloc[:,
-                                        -1].isnull().all():  # Nếu cột cuối cùng toàn NaN (thường do dấu | ở cuối)
-            df_schedule = df_schedule.iloc[:, :-1]
-
-        df_schedule.columns = [col.strip() for col in df_schedule.columns]
-        # Loại bỏ dòng phân cách của Markdown (ví dụ: |---|---|---|)
-        df_schedule = df_schedule[~df_schedule.iloc[:, 0].astype(str).str.contains(r'--\s*--', na=False)]
-        df_schedule = df_schedule.dropna(axis=0, how='all')  # Bỏ hàng toàn NaN
-
-        # Đổi tên cột nếu cần
-        expected_cols = ["Ngày", "Ca", "Nhân viên được phân công"]
-        if len(df_schedule.columns) >= 3:
-            current_cols = df_schedule.columns.tolist()
-            # Kiểm tra xem tên cột hiện tại có vẻ hợp lý không
-            # Chỉ đổi tên nếu tên cột hiện tại không chứa các từ khóa mong đợi
-            if not (expected_cols[0].lower() in current_cols[0].lower() and \
-                    expected_cols[1].lower() in current_cols[1].lower() and \
-                    expected_cols[2].lower() in current_cols[2].lower()):
-                st.toast(f"Tên cột từ AI không khớp hoàn toàn: {current_cols}. Sử dụng tên cột mặc định.", icon="⚠️")
-                df_schedule = df_schedule.iloc[:, :len(expected_cols)]  # Chỉ lấy đủ số cột mong đợi
-                df_schedule.columns = expected_cols[:len(df_schedule.columns)]
-            else:  # Nếu tên cột có vẻ ổn, chỉ chuẩn hóa và lấy 3 cột chính
-                df_schedule = df_schedule.iloc[:, :3]
-                df_schedule.columns = expected_cols
-
-        elif len(df_schedule.columns) == 2 and expected_cols[0].lower() in df_schedule.columns[0].lower() and \
-                expected_cols[1].lower() in df_schedule.columns[1].lower():
-            st.toast("Bảng từ AI thiếu cột 'Nhân viên được phân công'. Sẽ hiển thị với cột đó trống.", icon="⚠️")
-            df_schedule["Nhân viên được phân công"] = ""
-            df_schedule.columns = expected_cols
-        else:
-            st.error(
-                f"Lỗi phân tích: Bảng chỉ có {len(df_schedule.columns)} cột, cần ít nhất 3 cột ('Ngày', 'Ca', 'Nhân viên').")  # Critical
-            st.dataframe(df_schedule)
-            return None
+        st.session_state.roster_id = store.save_roster(st.session_state.df_from_paste, week=current_week())
+        store.save_lookup(st.session_state.roster_id, shifts_key(requirements), lookup_df)
+    except sqlite3.Error as e:
+        st.toast(f"⚠️ Không lưu được dữ liệu đăng ký: {e}", icon="⚠️")
 
-        # Làm sạch dữ liệu trong các ô
-        for col in df_schedule.columns:
-            if df_schedule[col].dtype == 'object':
-                df_schedule[col] = df_schedule[col].str.strip()
 
-        # Chuyển đổi cột 'Ngày'
-        if "Ngày" in df_schedule.columns:
-            try:
-                df_schedule['Ngày_str_backup'] = df_schedule['Ngày']  # Giữ lại giá trị string gốc
-                df_schedule['Ngày'] = pd.to_datetime(df_schedule['Ngày'], errors='coerce')
-                if df_schedule['Ngày'].isnull().any():
-                    st.toast("Cảnh báo: Một số giá trị 'Ngày' từ AI không hợp lệ. Đang thử chuyển đổi lại...",
-                             icon="⚠️")
-                    for idx, row_data in df_schedule.iterrows():
-                        if pd.isna(row_data['Ngày']):
-                            try_formats = ['%d/%m/%Y', '%m/%d/%Y', '%Y/%m/%d', '%d-%m-%Y', '%m-%d-%Y']
-                            for fmt in try_formats:
-                                try:
-                                    converted_date = pd.to_datetime(row_data['Ngày_str_backup'], format=fmt,
-                                                                    errors='raise')
-                                    df_schedule.loc[idx, 'Ngày'] = converted_date
-                                    break  # Chuyển đổi thành công
-                                except (ValueError, TypeError):
-                                    continue  # Thử định dạng tiếp theo
-                df_schedule = df_schedule.dropna(subset=['Ngày'])
-                df_schedule.drop(columns=['Ngày_str_backup'], inplace=True, errors='ignore')
-            except Exception as date_err:
-                st.toast(f"Lỗi chuyển đổi cột 'Ngày' từ AI: {date_err}. Kiểm tra định dạng ngày.", icon="⚠️")
-                df_schedule.drop(columns=['Ngày_str_backup'], inplace=True, errors='ignore')
-        else:
-            st.error("Lỗi nghiêm trọng: Không tìm thấy cột 'Ngày' trong bảng phân tích.")  # Critical
-            return None
+def remember_schedule(schedule_df, table_df, kind, engine=None):
+    """Stores a new version of the current week's schedule; returns its version number (None if not saved)."""
+    store = open_schedule_store()
+    if store is None or schedule_df is None or schedule_df.empty:
+        return None
+    try:
+        _, version = store.save_schedule(pd.to_datetime(schedule_df['Ngày']).min(), schedule_df, table_df,
+                                         roster_id=st.session_state.get('roster_id'), kind=kind, engine=engine)
+    except sqlite3.Error as e:
+        st.toast(f"⚠️ Không lưu được lịch: {e}", icon="⚠️")
+        return None
+    return version
 
-        if df_schedule.empty:
-            st.toast("Không có dữ liệu hợp lệ sau khi phân tích phản hồi từ AI.", icon="⚠️")
-            return None
 
-        st.toast("✅ Phân tích lịch trình từ AI thành công.", icon="✅");
-        return df_schedule
-    except Exception as e:
-        st.error(f"Lỗi nghiêm trọng khi phân tích bảng Markdown từ AI: {e}")  # Critical
-        st.info("Vui lòng kiểm tra 'Phản hồi thô từ AI' ở trên để xem định dạng AI trả về.")
+def previous_saved_week():
+    """Monday of the latest stored week before the pasted one (None if there is none)."""
+    store, week = open_schedule_store(), current_week()
+    if store is None or week is None:
+        return None
+    try:
+        return store.previous_week_start(week)
+    except sqlite3.Error:
+        return None
+
+
+def warm_start_schedule(requirements, trace=None):
+    """Reuses last stored week's assignments for unchanged days and solves the rest locally.
+
+    Returns (schedule_df, kept slots, changed dates), or None when no earlier
+    week with a lookup for the current shifts is stored.
+    """
+    store, lookup_df = open_schedule_store(), st.session_state.availability_lookup_df
+    if store is None or lookup_df is None or lookup_df.empty:
         return None
+    with span_or_null(trace, "warm_start") as span:
+        previous = store.previous_week(current_week(), shifts_key(requirements))
+        if previous is None:
+            return None
+        record, previous_lookup = previous
+        fixed, changed = warm_start_assignments(previous_lookup, record['schedule'], lookup_df, requirements)
+        span["kept_slots"], span["changed_days"] = len(fixed), len(changed)
+        return solve_schedule(lookup_df, requirements, fixed=fixed), fixed, changed
+
+
+def load_saved_schedule(schedule_id, requirements):
+    """Restores a stored version (roster, lookup, schedule and edited table) into the session."""
+    store = open_schedule_store()
+    try:
+        record = store.load_schedule(schedule_id) if store is not None else None
+        roster_id = record and record['roster_id']
+        df_input = store.load_roster(roster_id) if roster_id else None
+        lookup_df = store.load_lookup(roster_id, shifts_key(requirements)) if roster_id else None
+    except sqlite3.Error as e:
+        st.toast(f"❌ Không đọc được lịch đã lưu: {e}", icon="❌")
+        return
+    if record is None:
+        st.toast("❌ Không tìm thấy phiên bản lịch này.", icon="❌")
+        return
+    if lookup_df is None and df_input is not None:  # Lịch lưu với cấu hình ca khác: phân loại lại đăng ký
+        lookup_df = preprocess_pasted_data_for_lookup(df_input, requirements)
+        if lookup_df is not None and not lookup_df.empty:
+            store.save_lookup(roster_id, shifts_key(requirements), lookup_df)
+    if lookup_df is None or lookup_df.empty:
+        lookup_df = pd.DataFrame(columns=['Date', 'Employee', 'Shift', 'Can_Work', 'Note'])
+    st.session_state.df_from_paste = df_input
+    st.session_state.roster_id = roster_id
+    st.session_state.availability_lookup_df = lookup_df
+    st.session_state.availability_index = build_availability_index(lookup_df)
+    st.session_state.availability_index['source'] = lookup_df
+    st.session_state.lookup_shift_key = shifts_key(requirements)
+    st.session_state.schedule_df = record['schedule']
+    st.session_state.edited_schedule_table = record['table'] if record['table'] is not None else create_8_column_df(
+        record['schedule'])
+    st.session_state.ai_response_text = None
+    st.session_state.ai_response_from_cache = False
+    st.session_state.current_schedule_selections = {}
+    st.session_state.pop('schedule_grid_editor', None)
+    st.session_state.copyable_text = None
+    st.session_state.editor_index = None
+    st.session_state.schedule_validator = None
+    st.session_state.candidate_ranker = None
+    st.session_state.batch_groups = []
+    st.session_state.batch_results = None
+    st.session_state.batch_errors = {}
+    st.toast(f"📂 Đã mở lịch tuần {pd.Timestamp(record['week']).strftime('%d/%m/%Y')} (phiên bản {record['version']}).",
+             icon="📂")
+
+
+def show_schedule_history(requirements):
+    """Sidebar list of stored schedule versions; opening one restores it without another AI run."""
+    store = open_schedule_store()
+    if store is None:
+        return
+    try:
+        history = store.history(limit=SCHEDULE_HISTORY_LIMIT)
+    except sqlite3.Error:
+        return
+    with st.sidebar.expander(f"🗂️ Lịch đã lưu ({len(history)})"):
+        if history.empty:
+            st.caption("Chưa có lịch nào. Lịch được lưu tự động sau mỗi lần tạo.")
+            return
+        labels = {row.id: f"Tuần {pd.Timestamp(row.week).strftime('%d/%m/%Y')} · v{row.version} · "
+                          f"{'đã sửa' if row.kind == KIND_EDITED else row.engine or 'tạo mới'} · "
+                          f"{datetime.fromtimestamp(row.created).strftime('%H:%M %d/%m')}"
+                  for row in history.itertuples(index=False)}
+        schedule_id = st.selectbox("Phiên bản", list(labels), format_func=labels.get, key="saved_schedule_choice")
+        if st.button("📂 Mở lịch này", key="open_saved_schedule_button", use_container_width=True):
+            load_saved_schedule(schedule_id, requirements)
+
+
+def editor_cell_key(shift_pos, position, day):
+    """Key of one editor cell in current_schedule_selections (shared by both editors)."""
+    return f"ca{shift_pos + 1}_nv{position + 1}_{day.strftime('%d/%m/%Y')}_{day.year}"
+
+
+def get_schedule_validator(editor_index, requirements):
+    """Returns the incremental validator for the schedule being edited, built once per schedule/requirements."""
+    cached = st.session_state.get('schedule_validator')
+    if cached and cached['editor_index'] is editor_index and cached['requirements'] == requirements:
+        return cached['validator']
+    selections = st.session_state.get('current_schedule_selections') or {}
+    shift_names, slot_counts = current_shift_layout()
+    cells = []
+    for day in editor_index['dates']:
+        for shift_pos, shift in enumerate(shift_names):
+            initial_staff = editor_index['initial_staff'].get((day, shift), [])
+            for i in range(slot_counts[shift]):
+                initial = initial_staff[i] if i < len(initial_staff) else ""
+                cells.append(((day, shift, i), selections.get(editor_cell_key(shift_pos, i, day), initial)))
+    validator = ScheduleValidator.from_cells(requirements, editor_index['dates'], shift_names, cells)
+    st.session_state.schedule_validator = {'editor_index': editor_index, 'requirements': dict(requirements),
+                                           'validator': validator}
+    return validator
+
+
+def on_schedule_cell_change(validator, day, shift, position, widget_key):
+    """Selectbox callback: applies one edit to the validator before the rerun renders the table."""
+    validator.set_cell(day, shift, position, st.session_state.get(widget_key, ""))
+
+
+def get_candidate_ranker(validator, availability_df, requirements):
+    """Returns the replacement ranker following ``validator``, rebuilt when the validator or the weight changes."""
+    weight = requirements.get("preferences_weight_hint", 0.7)
+    cached = st.session_state.get('candidate_ranker')
+    if cached and cached['validator'] is validator and cached['weight'] == weight:
+        return cached['ranker']
+    if cached:
+        cached['ranker'].detach()
+    notes = availability_df.drop_duplicates('Employee')
+    ranker = CandidateRanker(validator, st.session_state.availability_index,
+                             dict(zip(notes['Employee'].astype(str).str.strip(), notes['Note'])), weight)
+    st.session_state.candidate_ranker = {'validator': validator, 'weight': weight, 'ranker': ranker}
+    return ranker
+
+
+def ranked_slot_options(ranker, day, shift, options_list):
+    """Editor options with registered candidates best-first, then the remaining names alphabetically."""
+    ranked = ranker.ranked_names(day, shift)
+    ranked_set = set(ranked)
+    ordered = ("",) + ranked + tuple(name for name in options_list if name and name not in ranked_set)
+    return ordered, {name: i for i, name in enumerate(ordered)}
+
+
+def show_replacement_suggestions(ranker, dates):
+    """Top candidates for one chosen slot, with the reasons behind their score."""
+    with st.expander("🔎 Gợi ý người thay thế"):
+        col_date, col_shift = st.columns(2)
+        day = col_date.selectbox("Ngày", dates, format_func=lambda d: d.strftime('%d/%m/%Y'), key="suggest_date")
+        shift = col_shift.selectbox("Ca", current_shift_layout()[0], key="suggest_shift")
+        ranked = ranker.rank(day, shift)
+        if not ranked:
+            st.info("Không có nhân viên nào đăng ký ca này.")
+            return
+        st.dataframe(pd.DataFrame([{'Nhân viên': name, 'Điểm': round(score, 1), 'Lý do': ", ".join(reasons)}
+                                   for name, score, reasons in ranked[:10]]), hide_index=True, use_container_width=True)
+
+
+def show_schedule_violations(validator):
+    """Lists the current constraint violations of the edited schedule."""
+    messages = validator.messages()
+    if messages:
+        with st.expander(f"⚠️ {len(messages)} vi phạm ràng buộc", expanded=True):
+            for message in messages:
+                st.markdown(f"- {message}")
+    else:
+        st.success("✅ Lịch hiện tại thỏa mãn mọi ràng buộc.")
 
 
 # --- Function to Display Formatted Schedule (Keep using Selectbox) ---
-def display_editable_schedule_with_dropdowns(parsed_schedule_df, availability_df):
+def display_editable_schedule_with_dropdowns(parsed_schedule_df, availability_df, requirements=None):
     """Displays the schedule using columns and selectboxes for editing."""
     st.subheader("📅 Lịch Làm Việc Tuần (Chỉnh sửa / Thay thế)")
     if parsed_schedule_df is None or parsed_schedule_df.empty: st.toast("Không có dữ liệu lịch để hiển thị.",
@@ -601,29 +892,18 @@ def display_editable_schedule_with_dropdowns(parsed_schedule_df, availability_df
         return create_8_column_df(parsed_schedule_df)  # Trả về bảng 8 cột không chỉnh sửa được
 
     try:
-        # Ensure 'Ngày' is datetime
-        if 'Ngày' in parsed_schedule_df.columns and not pd.api.types.is_datetime64_any_dtype(
-                parsed_schedule_df['Ngày']):
-            parsed_schedule_df['Ngày'] = pd.to_datetime(parsed_schedule_df['Ngày'], errors='coerce')
-        # Loại bỏ các dòng có giá trị NaN trong các cột quan trọng
-        parsed_schedule_df = parsed_schedule_df.dropna(subset=['Ngày', 'Ca'])
-        # Đảm bảo cột 'Nhân viên được phân công' là string, thay NaN bằng chuỗi rỗng
-        if 'Nhân viên được phân công' in parsed_schedule_df.columns:
-            parsed_schedule_df['Nhân viên được phân công'] = parsed_schedule_df['Nhân viên được phân công'].fillna(
-                '').astype(str)
-        else:
-            parsed_schedule_df['Nhân viên được phân công'] = ""
-
-        if parsed_schedule_df.empty: st.toast("Không còn dữ liệu hợp lệ sau khi lọc.",
-                                              icon="ℹ️"); return None  # Trả về None nếu không có lịch
-
-        # Get unique sorted dates
-        unique_dates = sorted(parsed_schedule_df['Ngày'].dt.date.unique())
+        # Tra cứu O(1) theo (ngày, ca) thay vì lọc toàn bộ bảng cho từng ô ở mỗi lần rerun
+        editor_index = get_editor_index(parsed_schedule_df, availability_df)
+        unique_dates = editor_index['dates']
         if not unique_dates: st.toast("Không có ngày hợp lệ nào trong dữ liệu.",
                                       icon="ℹ️"); return None  # Trả về None nếu không có lịch
+        validator = get_schedule_validator(editor_index, requirements) if requirements else None
+        ranker = get_candidate_ranker(validator, availability_df, requirements) if validator else None
+        violations_by_date = validator.violations_by_date() if validator else {}
 
-        col_names = ['Thứ', 'Ngày', 'Ca 1 (NV1)', 'Ca 1 (NV2)', 'Ca 1 (NV3)', 'Ca 2 (NV1)', 'Ca 2 (NV2)', 'Ca 2 (NV3)']
-        col_widths = [0.6, 0.9, 2.0, 2.0, 2.0, 2.0, 2.0, 2.0]
+        shift_names, slot_counts = current_shift_layout()
+        col_names = scheduler.display_columns(shift_names, slot_counts)
+        col_widths = [0.6, 0.9] + [2.0] * (len(col_names) - 2)
         header_cols = st.columns(col_widths)
         for col, name in zip(header_cols, col_names):
             col.markdown(f"<div style='text-align: center; font-weight: bold;'>{name}</div>",
@@ -636,9 +916,6 @@ def display_editable_schedule_with_dropdowns(parsed_schedule_df, availability_df
         vietnamese_days = ["Thứ 2", "Thứ 3", "Thứ 4", "Thứ 5", "Thứ 6", "Thứ 7", "Chủ Nhật"]
         edited_data = []
 
-        all_available_employees = [""] + sorted(list(set(availability_df['Employee'].astype(
-            str).str.strip().unique().tolist())))  # Danh sách chung, đảm bảo duy nhất và là string
-
         for current_date_obj in unique_dates:  # Đổi tên biến để rõ ràng hơn
             row_cols = st.columns(col_widths)
             day_name = vietnamese_days[current_date_obj.weekday()]
@@ -650,100 +927,42 @@ def display_editable_schedule_with_dropdowns(parsed_schedule_df, availability_df
                 f"<div style='text-align: center; height: 100%; display: flex; align-items: center; justify-content: center;'>{date_str}</div>",
                 unsafe_allow_html=True)
 
-            # --- Process Ca 1 ---
-            ca1_data = parsed_schedule_df[
-                (parsed_schedule_df['Ngày'].dt.date == current_date_obj) & (parsed_schedule_df['Ca'] == 'Ca 1')]
-            staff_ca1_str = ca1_data['Nhân viên được phân công'].iloc[0] if not ca1_data.empty else ""
-            initial_staff_ca1 = [name.strip() for name in staff_ca1_str.split(',') if
-                                 name.strip() and not "(Thiếu" in name]  # Bỏ qua ghi chú thiếu người
-
-            available_ca1_df = availability_df[
-                (availability_df['Date'] == current_date_obj) & (availability_df['Shift'] == 'Ca 1') & (
-                            availability_df['Can_Work'] == True)]
-            available_ca1_list_specific = [""] + sorted(
-                list(set(available_ca1_df['Employee'].astype(str).str.strip().unique().tolist())))
-
-            options_list_c1 = list(
-                set(available_ca1_list_specific + initial_staff_ca1))  # Gộp danh sách đăng ký và danh sách đã được xếp
-            if "" not in options_list_c1: options_list_c1.insert(0, "")  # Đảm bảo có lựa chọn rỗng
-            options_list_c1 = sorted(list(set(options_list_c1)))  # Sắp xếp lại và đảm bảo duy nhất
-
-            if len(options_list_c1) == 1 and options_list_c1[0] == "":  # Nếu chỉ có lựa chọn rỗng
-                options_list_c1 = all_available_employees  # Fallback nếu không ai đăng ký/được xếp ca này
-
-            selected_ca1 = []
-            for i in range(3):  # NV1, NV2, NV3 for Ca 1
-                col_index = i + 2
-                selectbox_key = f"ca1_nv{i + 1}_{date_str}_{current_date_obj.year}"
-                initial_selection = initial_staff_ca1[i] if i < len(initial_staff_ca1) else ""
-                current_selection_val = st.session_state.current_schedule_selections.get(selectbox_key,
-                                                                                         initial_selection)
-
-                if current_selection_val not in options_list_c1:
-                    current_selection_val = options_list_c1[0] if options_list_c1 else ""
-
-                try:
-                    selected_index_c1 = options_list_c1.index(current_selection_val)
-                except ValueError:
-                    selected_index_c1 = 0
-
-                selected_emp_c1 = row_cols[col_index].selectbox(f"Ca 1 NV{i + 1} {date_str}", options=options_list_c1,
-                                                                index=selected_index_c1, key=selectbox_key,
-                                                                label_visibility="collapsed")
-                selected_ca1.append(selected_emp_c1)
-                st.session_state.current_schedule_selections[selectbox_key] = selected_emp_c1
-
-            # --- Process Ca 2 ---
-            ca2_data = parsed_schedule_df[
-                (parsed_schedule_df['Ngày'].dt.date == current_date_obj) & (parsed_schedule_df['Ca'] == 'Ca 2')]
-            staff_ca2_str = ca2_data['Nhân viên được phân công'].iloc[0] if not ca2_data.empty else ""
-            initial_staff_ca2 = [name.strip() for name in staff_ca2_str.split(',') if
-                                 name.strip() and not "(Thiếu" in name]
-
-            available_ca2_df = availability_df[
-                (availability_df['Date'] == current_date_obj) & (availability_df['Shift'] == 'Ca 2') & (
-                            availability_df['Can_Work'] == True)]
-            available_ca2_list_specific = [""] + sorted(
-                list(set(available_ca2_df['Employee'].astype(str).str.strip().unique().tolist())))
-
-            options_list_c2 = list(set(available_ca2_list_specific + initial_staff_ca2))
-            if "" not in options_list_c2: options_list_c2.insert(0, "")
-            options_list_c2 = sorted(list(set(options_list_c2)))
-
-            if len(options_list_c2) == 1 and options_list_c2[0] == "":
-                options_list_c2 = all_available_employees
-
-            selected_ca2 = []
-            for i in range(3):  # NV1, NV2, NV3 for Ca 2
-                col_index = i + 5
-                selectbox_key = f"ca2_nv{i + 1}_{date_str}_{current_date_obj.year}"
-                initial_selection = initial_staff_ca2[i] if i < len(initial_staff_ca2) else ""
-                current_selection_val = st.session_state.current_schedule_selections.get(selectbox_key,
-                                                                                         initial_selection)
-
-                if current_selection_val not in options_list_c2:
-                    current_selection_val = options_list_c2[0] if options_list_c2 else ""
-
-                try:
-                    selected_index_c2 = options_list_c2.index(current_selection_val)
-                except ValueError:
-                    selected_index_c2 = 0
-
-                selected_emp_c2 = row_cols[col_index].selectbox(f"Ca 2 NV{i + 1} {date_str}", options=options_list_c2,
-                                                                index=selected_index_c2, key=selectbox_key,
-                                                                label_visibility="collapsed")
-                selected_ca2.append(selected_emp_c2)
-                st.session_state.current_schedule_selections[selectbox_key] = selected_emp_c2
-
-            edited_row = {
-                'Thứ': day_name, 'Ngày': date_str,
-                'Ca 1 (NV1)': selected_ca1[0], 'Ca 1 (NV2)': selected_ca1[1], 'Ca 1 (NV3)': selected_ca1[2],
-                'Ca 2 (NV1)': selected_ca2[0], 'Ca 2 (NV2)': selected_ca2[1], 'Ca 2 (NV3)': selected_ca2[2],
-            }
+            edited_row = {'Thứ': day_name, 'Ngày': date_str}
+            col_index = 2
+            for shift_pos, shift in enumerate(shift_names):
+                slot = (current_date_obj, shift)
+                initial_staff = editor_index['initial_staff'].get(slot, [])
+                options_list, option_positions = editor_index['options'].get(slot, editor_index['fallback_options'])
+                labels = {}
+                if ranker:  # Người phù hợp nhất lên đầu danh sách
+                    options_list, option_positions = ranked_slot_options(ranker, current_date_obj, shift, options_list)
+                    labels = ranker.labels(current_date_obj, shift)
+                for i in range(slot_counts[shift]):  # NV1, NV2, NV3...
+                    selectbox_key = f"ca{shift_pos + 1}_nv{i + 1}_{date_str}_{current_date_obj.year}"
+                    initial_selection = initial_staff[i] if i < len(initial_staff) else ""
+                    current_selection_val = st.session_state.current_schedule_selections.get(selectbox_key,
+                                                                                             initial_selection)
+                    selected_index = option_positions.get(current_selection_val, 0)
+
+                    selected_emp = row_cols[col_index].selectbox(f"{shift} NV{i + 1} {date_str}", options=options_list,
+                                                                 index=selected_index, key=selectbox_key,
+                                                                 label_visibility="collapsed",
+                                                                 format_func=lambda name, labels=labels: labels.get(name, name),
+                                                                 on_change=on_schedule_cell_change if validator else None,
+                                                                 args=(validator, current_date_obj, shift, i, selectbox_key))
+                    edited_row[f'{shift} (NV{i + 1})'] = selected_emp
+                    st.session_state.current_schedule_selections[selectbox_key] = selected_emp
+                    if validator: validator.set_cell(current_date_obj, shift, i, selected_emp)  # No-op nếu không đổi
+                    col_index += 1
+
             edited_data.append(edited_row)
+            if violations_by_date.get(current_date_obj):
+                st.caption("⚠️ " + "; ".join(violations_by_date[current_date_obj]))
             st.divider()
 
-        return pd.DataFrame(edited_data)
+        if validator: show_schedule_violations(validator)
+        if ranker: show_replacement_suggestions(ranker, unique_dates)
+        return pd.DataFrame(edited_data, columns=col_names)
 
     except Exception as e:
         st.error(f"Lỗi khi tạo/hiển thị bảng chỉnh sửa: {e}")  # Critical
@@ -755,63 +974,162 @@ def display_editable_schedule_with_dropdowns(parsed_schedule_df, availability_df
         return create_8_column_df(parsed_schedule_df)  # Trả về bảng 8 cột không chỉnh sửa được nếu lỗi
 
 
-# --- Function to Create 8-Column DataFrame (Helper Function) ---
-def create_8_column_df(df_schedule):
-    """Creates the 8-column display DataFrame from the parsed 3-column schedule."""
-    if df_schedule is None or df_schedule.empty: return pd.DataFrame(
-        columns=['Thứ', 'Ngày', 'Ca 1 (NV1)', 'Ca 1 (NV2)', 'Ca 1 (NV3)', 'Ca 2 (NV1)', 'Ca 2 (NV2)', 'Ca 2 (NV3)'])
-    try:
-        if 'Ngày' in df_schedule.columns and not pd.api.types.is_datetime64_any_dtype(df_schedule['Ngày']):
-            df_schedule['Ngày'] = pd.to_datetime(df_schedule['Ngày'], errors='coerce')
-        df_schedule = df_schedule.dropna(subset=['Ngày', 'Ca'])
-        if 'Nhân viên được phân công' in df_schedule.columns:
-            df_schedule['Nhân viên được phân công'] = df_schedule['Nhân viên được phân công'].fillna('').astype(str)
-        else:
-            df_schedule['Nhân viên được phân công'] = ""
+# --- Grid editor: one st.data_editor instead of one selectbox per cell ---
+def display_schedule_grid_editor(parsed_schedule_df, availability_df, requirements=None):
+    """Displays the schedule as a single editable grid and applies edits as diffs to current_schedule_selections."""
+    st.subheader("📅 Lịch Làm Việc Tuần (Chỉnh sửa / Thay thế)")
+    if parsed_schedule_df is None or parsed_schedule_df.empty: st.toast("Không có dữ liệu lịch để hiển thị.",
+                                                                        icon="ℹ️"); return None
+    if availability_df is None or availability_df.empty:
+        st.toast("Thiếu dữ liệu tra cứu người thay thế. Không thể tạo danh sách chọn động.", icon="⚠️")
+        st.dataframe(create_8_column_df(parsed_schedule_df))
+        return create_8_column_df(parsed_schedule_df)
 
-        if df_schedule.empty: return pd.DataFrame(
-            columns=['Thứ', 'Ngày', 'Ca 1 (NV1)', 'Ca 1 (NV2)', 'Ca 1 (NV3)', 'Ca 2 (NV1)', 'Ca 2 (NV2)', 'Ca 2 (NV3)'])
-        unique_dates = sorted(df_schedule['Ngày'].dt.date.unique())
-        if not unique_dates: return pd.DataFrame(
-            columns=['Thứ', 'Ngày', 'Ca 1 (NV1)', 'Ca 1 (NV2)', 'Ca 1 (NV3)', 'Ca 2 (NV1)', 'Ca 2 (NV2)', 'Ca 2 (NV3)'])
+    try:
+        editor_index = get_editor_index(parsed_schedule_df, availability_df)
+        unique_dates = editor_index['dates']
+        if not unique_dates: st.toast("Không có ngày hợp lệ nào trong dữ liệu.", icon="ℹ️"); return None
 
-        output_rows = []
+        if 'current_schedule_selections' not in st.session_state:
+            st.session_state.current_schedule_selections = {}
+        selections = st.session_state.current_schedule_selections
+        validator = get_schedule_validator(editor_index, requirements) if requirements else None
+        shift_names, slot_counts = current_shift_layout()
+
+        # Ghi lại trước khi vẽ bảng các ô vừa đổi (widget state giữ các chỉnh sửa dạng {hàng: {cột: giá trị}})
+        edited_rows = st.session_state.get('schedule_grid_editor', {}).get('edited_rows', {})
+        for row_pos, changes in edited_rows.items():
+            current_date_obj = unique_dates[int(row_pos)]
+            for column, value in changes.items():
+                shift, slot = column.rsplit(' (NV', 1)  # 'Ca 1 (NV2)' -> ('Ca 1', '2)')
+                position = int(slot[:-1]) - 1
+                key = editor_cell_key(shift_names.index(shift), position, current_date_obj)
+                if selections.get(key) != (value or ""):
+                    selections[key] = value or ""
+                    if validator: validator.set_cell(current_date_obj, shift, position, value or "")
+
+        col_names = scheduler.display_columns(shift_names, slot_counts)
         vietnamese_days = ["Thứ 2", "Thứ 3", "Thứ 4", "Thứ 5", "Thứ 6", "Thứ 7", "Chủ Nhật"]
-        for current_date_obj in unique_dates:  # Đổi tên biến
-            day_name = vietnamese_days[current_date_obj.weekday()]
-            date_str = current_date_obj.strftime('%d/%m/%Y')
+        violations_by_date = validator.violations_by_date() if validator else {}
+        rows = []
+        for current_date_obj in unique_dates:
+            row = {'Thứ': vietnamese_days[current_date_obj.weekday()], 'Ngày': current_date_obj.strftime('%d/%m/%Y')}
+            for shift_pos, shift in enumerate(shift_names):
+                initial_staff = editor_index['initial_staff'].get((current_date_obj, shift), [])
+                for i in range(slot_counts[shift]):
+                    row[f'{shift} (NV{i + 1})'] = selections.get(editor_cell_key(shift_pos, i, current_date_obj),
+                                                                 initial_staff[i] if i < len(initial_staff) else "")
+            row['Kiểm tra'] = "⚠️ " + "; ".join(violations_by_date[current_date_obj]) \
+                if violations_by_date.get(current_date_obj) else "✅"
+            rows.append(row)
+        grid_df = pd.DataFrame(rows, columns=col_names + ['Kiểm tra'])
+
+        column_config = {'Thứ': st.column_config.TextColumn('Thứ', width="small"),
+                         'Ngày': st.column_config.TextColumn('Ngày', width="small"),
+                         'Kiểm tra': st.column_config.TextColumn('Kiểm tra', width="large")}
+        for shift in shift_names:
+            for i in range(slot_counts[shift]):
+                column = f'{shift} (NV{i + 1})'
+                column_config[column] = st.column_config.SelectboxColumn(column, options=editor_index['column_options'][shift])
+        edited_df = st.data_editor(grid_df, column_config=column_config, disabled=['Thứ', 'Ngày', 'Kiểm tra'],
+                                   hide_index=True, num_rows="fixed", use_container_width=True,
+                                   key="schedule_grid_editor")
+        edited_df = edited_df[col_names].fillna("")
+
+        # Danh sách chọn theo cột rộng hơn theo ô: cảnh báo người không đăng ký đúng ngày/ca
+        unregistered = []
+        for row_pos, current_date_obj in enumerate(unique_dates):
+            for shift in shift_names:
+                _, option_positions = editor_index['options'].get((current_date_obj, shift), editor_index['fallback_options'])
+                for i in range(slot_counts[shift]):
+                    name = edited_df.iat[row_pos, col_names.index(f'{shift} (NV{i + 1})')]
+                    if name and name not in option_positions:
+                        unregistered.append(f"{name} ({shift}, {current_date_obj.strftime('%d/%m/%Y')})")
+        if unregistered:
+            st.warning("Nhân viên không đăng ký ca này: " + "; ".join(unregistered))
+        if validator:
+            show_schedule_violations(validator)
+            show_replacement_suggestions(get_candidate_ranker(validator, availability_df, requirements), unique_dates)
+        return edited_df
 
-            ca1_data = df_schedule[(df_schedule['Ngày'].dt.date == current_date_obj) & (df_schedule['Ca'] == 'Ca 1')]
-            staff_ca1_str = ca1_data['Nhân viên được phân công'].iloc[0] if not ca1_data.empty else ""
-            staff_ca1_list = [name.strip() for name in staff_ca1_str.split(',') if name.strip()]
-
-            ca2_data = df_schedule[(df_schedule['Ngày'].dt.date == current_date_obj) & (df_schedule['Ca'] == 'Ca 2')]
-            staff_ca2_str = ca2_data['Nhân viên được phân công'].iloc[0] if not ca2_data.empty else ""
-            staff_ca2_list = [name.strip() for name in staff_ca2_str.split(',') if name.strip()]
-
-            row_data = {
-                'Thứ': day_name, 'Ngày': date_str,
-                'Ca 1 (NV1)': staff_ca1_list[0] if len(staff_ca1_list) > 0 else '',
-                'Ca 1 (NV2)': staff_ca1_list[1] if len(staff_ca1_list) > 1 else '',
-                'Ca 1 (NV3)': staff_ca1_list[2] if len(staff_ca1_list) > 2 else '',
-                'Ca 2 (NV1)': staff_ca2_list[0] if len(staff_ca2_list) > 0 else '',
-                'Ca 2 (NV2)': staff_ca2_list[1] if len(staff_ca2_list) > 1 else '',
-                'Ca 2 (NV3)': staff_ca2_list[2] if len(staff_ca2_list) > 2 else '',
-            }
-            output_rows.append(row_data)
-        df_display = pd.DataFrame(output_rows)
-        column_order = ['Thứ', 'Ngày', 'Ca 1 (NV1)', 'Ca 1 (NV2)', 'Ca 1 (NV3)', 'Ca 2 (NV1)', 'Ca 2 (NV2)',
-                        'Ca 2 (NV3)']
-        # Đảm bảo tất cả các cột đều tồn tại, nếu không thì tạo cột trống
-        for col in column_order:
-            if col not in df_display.columns:
-                df_display[col] = ''
-        df_display = df_display[column_order]
-        return df_display
+    except Exception as e:
+        st.error(f"Lỗi khi tạo/hiển thị bảng chỉnh sửa: {e}")
+        st.exception(e)
+        return create_8_column_df(parsed_schedule_df)
+
+
+# --- Function to Create 8-Column DataFrame (Helper Function) ---
+def create_8_column_df(df_schedule):
+    """Creates the display table (8 columns for the usual 2 shifts x 3 staff) from the parsed 3-column schedule.
+
+    Columns follow the shifts configured in the sidebar (see current_shift_layout).
+    """
+    shift_names, slot_counts = current_shift_layout()
+    try:
+        return scheduler.create_8_column_df(df_schedule, shift_names, slot_counts)
     except Exception as e:
         st.error(f"Lỗi khi tạo bảng 8 cột (helper): {e}")  # Critical
-        return pd.DataFrame(
-            columns=['Thứ', 'Ngày', 'Ca 1 (NV1)', 'Ca 1 (NV2)', 'Ca 1 (NV3)', 'Ca 2 (NV1)', 'Ca 2 (NV2)', 'Ca 2 (NV3)'])
+        return pd.DataFrame(columns=scheduler.display_columns(shift_names, slot_counts))
+
+
+# --- Batch Mode: one schedule per (store, week) group from a single paste ---
+def run_batch_generation(groups, requirements, schedule_engine, output_format=OUTPUT_MARKDOWN, compact_prompt=False):
+    """Generates a schedule for every group; AI calls run concurrently through a bounded, rate-limited pool."""
+    results, errors = {}, {}
+    if schedule_engine == ENGINE_LOCAL:
+        for label, sub_df in groups:
+            lookup_df = preprocess_pasted_data_for_lookup(sub_df, requirements)
+            if lookup_df is None or lookup_df.empty:
+                errors[label] = "Không có dữ liệu đăng ký hợp lệ."
+                continue
+            results[label] = create_8_column_df(solve_schedule(lookup_df, requirements))
+        return results, errors
+
+    ai_model = load_ai_model()
+    if ai_model is None:
+        return results, {label: "Không khởi tạo được mô hình AI." for label, _ in groups}
+    tasks = []
+    for label, sub_df in groups:  # Prompt được tạo ở luồng chính (có toast/lỗi UI)
+        full_prompt = build_schedule_prompt(sub_df, requirements, output_format, compact=compact_prompt)
+        if full_prompt is None:
+            errors[label] = "Không tạo được prompt."
+        else:
+            tasks.append((label, full_prompt))
+    with st.spinner(f"⏳ Đang gọi AI ({MODEL_NAME}) cho {len(tasks)} nhóm (tối đa {BATCH_MAX_WORKERS} yêu cầu song song)..."):
+        get_model, breakers = make_model_getter(ai_model), get_breaker_registry()  # Tạo ở luồng chính
+        outcomes = run_concurrently(tasks,
+                                    lambda full_prompt: call_model_cached(full_prompt, get_model, breakers, output_format),
+                                    max_workers=BATCH_MAX_WORKERS,
+                                    rate_limiter=RateLimiter(BATCH_REQUESTS_PER_MINUTE))
+    rosters = dict(groups)
+    for label, (response_text, error) in outcomes.items():
+        if error is not None:
+            errors[label] = f"Lỗi khi gọi AI: {error}"
+            continue
+        parsed_df = parse_ai_response(response_text, output_format)
+        if parsed_df is None or parsed_df.empty:
+            errors[label] = "Không phân tích được lịch từ AI."
+            continue
+        parsed_df = scheduler.match_roster_names(parsed_df, scheduler.roster_registry(rosters[label]), notify_toast)
+        results[label] = create_8_column_df(parsed_df)
+    return results, errors
+
+
+def display_batch_results(results, errors):
+    """Shows each group's schedule in a tab and offers one workbook with a sheet per group."""
+    st.subheader("📦 Kết Quả Lập Lịch Hàng Loạt")
+    for label, message in errors.items():
+        st.warning(f"{label}: {message}")
+    if not results:
+        return
+    for tab, (label, df_group) in zip(st.tabs(list(results.keys())), results.items()):
+        with tab:
+            st.dataframe(df_group, use_container_width=True, hide_index=True)
+    try:
+        st.download_button("Tải Excel (Tất cả nhóm)", build_batch_workbook(results, get_excel_engine()), "batch_schedules.xlsx",
+                           "application/vnd.ms-excel", use_container_width=True, key="dl_excel_batch")
+    except Exception as e:
+        st.error(f"Lỗi Excel hàng loạt: {e}")
 
 
 # --- Main Application Logic (UPDATED State Management and Display Logic) ---
@@ -822,6 +1140,7 @@ def main_app():
     st.caption("Dán dữ liệu đăng ký từ Excel và để AI tạo lịch làm việc tối ưu.")
     st.divider()
 
+    dropped_artifacts = begin_session_data()  # Đọc lại dữ liệu đã ghi tạm ra đĩa trước khi trang dùng tới
     # Initialize session state
     if 'df_from_paste' not in st.session_state: st.session_state.df_from_paste = None
     if 'schedule_df' not in st.session_state: st.session_state.schedule_df = None  # Parsed 3-column AI result
@@ -831,111 +1150,249 @@ def main_app():
         columns=['Date', 'Employee', 'Shift', 'Can_Work', 'Note'])
     if 'copyable_text' not in st.session_state: st.session_state.copyable_text = None
     if 'current_schedule_selections' not in st.session_state: st.session_state.current_schedule_selections = {}
+    if 'ai_response_from_cache' not in st.session_state: st.session_state.ai_response_from_cache = False
+    if 'availability_index' not in st.session_state: st.session_state.availability_index = None
+    if 'editor_index' not in st.session_state: st.session_state.editor_index = None
+    if 'schedule_validator' not in st.session_state: st.session_state.schedule_validator = None
+    if 'candidate_ranker' not in st.session_state: st.session_state.candidate_ranker = None
+    if 'streamed_schedule_df' not in st.session_state: st.session_state.streamed_schedule_df = None
+    if 'batch_groups' not in st.session_state: st.session_state.batch_groups = []
+    if 'batch_results' not in st.session_state: st.session_state.batch_results = None
+    if 'batch_errors' not in st.session_state: st.session_state.batch_errors = {}
+    if 'run_traces' not in st.session_state: st.session_state.run_traces = []  # Lịch sử cho bảng chẩn đoán
 
     requirements = get_scheduling_requirements()
     if requirements is None: st.stop()  # Sidebar error already shown
+    rebuild_dropped_artifacts(dropped_artifacts, requirements)
+    schedule_engine = st.sidebar.radio("🧠 Chế độ tạo lịch", [ENGINE_AI, ENGINE_LOCAL], key="schedule_engine",
+                                       help="Bộ giải cục bộ tạo lịch tức thì từ dữ liệu đăng ký, không cần gọi AI.")
+    output_format = OUTPUT_MARKDOWN
+    if schedule_engine == ENGINE_AI:
+        st.sidebar.caption(f"Sử dụng model: {MODEL_NAME}")
+        output_format = st.sidebar.radio("📄 Định dạng phản hồi AI", [OUTPUT_JSON, OUTPUT_MARKDOWN], key="ai_output_format",
+                                         help="JSON có cấu trúc được phân tích trực tiếp; bảng Markdown là phương án dự phòng.")
+    compact_prompt = schedule_engine == ENGINE_AI and st.sidebar.checkbox(
+        "✂️ Prompt rút gọn (ít token hơn)", value=True, key="compact_prompt",
+        help="Gửi ma trận đăng ký đã chuẩn hóa và chỉ các ghi chú có nội dung, thay vì mô tả dài cho từng nhân viên.")
+    stream_ai = output_format == OUTPUT_MARKDOWN and schedule_engine == ENGINE_AI and st.sidebar.checkbox(
+        "📡 Hiển thị lịch dần khi AI trả lời (streaming)", value=True, key="stream_ai_response")
+    show_schedule_history(requirements)
     input_container = st.container(border=True)
     with input_container:
         st.subheader("📋 Bước 1: Dán Dữ Liệu Đăng Ký")
         col1, col2 = st.columns([3, 1])
-        with col1: pasted_data = st.text_area("Dán dữ liệu từ bảng Excel (sao chép trực tiếp từ Excel):", height=250,
-                                              key="pasted_data_area", label_visibility="collapsed")
+        with col1:
+            pasted_data = st.text_area("Dán dữ liệu từ bảng Excel (sao chép trực tiếp từ Excel):", height=250,
+                                       key="pasted_data_area", label_visibility="collapsed")
+            uploaded_file = st.file_uploader("Hoặc tải lên tệp XLSX/CSV xuất từ form đăng ký",
+                                             type=[extension.lstrip('.') for extension in UPLOAD_EXTENSIONS],
+                                             key="roster_upload")
         with col2:
             st.markdown("<div style='margin-top: 30px;'></div>", unsafe_allow_html=True)
             process_button = st.button("⚙️ Xử lý dữ liệu", key="process_paste_button", use_container_width=True)
             st.markdown("<div style='margin-top: 10px;'></div>", unsafe_allow_html=True)
             generate_button_placeholder = st.empty()
+    # Tệp mới tải lên được xử lý ngay; nút 'Xử lý dữ liệu' ưu tiên dữ liệu dán nếu có
+    new_upload = uploaded_file is not None and uploaded_file.file_id != st.session_state.get('processed_upload_id')
+    process_button = process_button or new_upload
+
+    # Phân loại ô đăng ký phụ thuộc cấu hình ca: đổi ca sau khi dán thì tạo lại bảng tra cứu
+    shift_config_key = shifts_key(requirements)
+    if not process_button and st.session_state.df_from_paste is not None and \
+            st.session_state.get('lookup_shift_key') != shift_config_key:
+        trace = RunTrace("paste", reason="shift_config")
+        with trace.span("preprocess"):
+            lookup_df = preprocess_pasted_data_for_lookup(st.session_state.df_from_paste, requirements)
+        if lookup_df is None or lookup_df.empty:
+            lookup_df = pd.DataFrame(columns=['Date', 'Employee', 'Shift', 'Can_Work', 'Note'])
+        st.session_state.availability_lookup_df = lookup_df
+        with trace.span("availability_index"):
+            st.session_state.availability_index = build_availability_index(lookup_df)
+        st.session_state.availability_index['source'] = lookup_df
+        st.session_state.lookup_shift_key = shift_config_key
+        remember_roster(requirements)
+        st.session_state.current_schedule_selections = {}  # Vị trí ô theo ca cũ không còn đúng
+        st.session_state.pop('schedule_grid_editor', None)
+        finish_trace(trace)
 
     if process_button:
         st.session_state.df_from_paste = None;
         st.session_state.schedule_df = None;
         st.session_state.edited_schedule_table = None;
         st.session_state.ai_response_text = None;
+        st.session_state.ai_response_from_cache = False
         st.session_state.availability_lookup_df = pd.DataFrame(
             columns=['Date', 'Employee', 'Shift', 'Can_Work', 'Note'])  # Reset
         st.session_state.current_schedule_selections = {}
+        st.session_state.pop('schedule_grid_editor', None)  # Bỏ các chỉnh sửa lưới của lịch cũ
         st.session_state.copyable_text = None
-        if pasted_data:
+        st.session_state.availability_index = None
+        st.session_state.editor_index = None
+        st.session_state.schedule_validator = None
+        st.session_state.candidate_ranker = None
+        st.session_state.batch_groups = []
+        st.session_state.batch_results = None
+        st.session_state.batch_errors = {}
+        use_file = uploaded_file is not None and (new_upload or not pasted_data)
+        if use_file or pasted_data:
+            if use_file:
+                st.session_state.processed_upload_id = uploaded_file.file_id  # Không đọc lại ở các lần chạy sau
+                trace = RunTrace("paste", file=uploaded_file.name, bytes=uploaded_file.size)
+            else:
+                trace = RunTrace("paste", chars=len(pasted_data))
             try:
-                data_io = io.StringIO(pasted_data)
-                # Cố gắng đọc với header, nếu lỗi thì đọc không header
-                try:
-                    temp_df = pd.read_csv(data_io, sep='\t', header=0, skipinitialspace=True)
-                    # Kiểm tra xem header có hợp lệ không (ví dụ: chứa từ khóa)
-                    header_keywords = ["tên", "thứ", "ghi chú", "tuần", "ngày"]
-                    if not any(keyword in str(col).lower() for col in temp_df.columns for keyword in header_keywords):
-                        st.toast("Tiêu đề không khớp với từ khóa mong đợi, thử đọc lại không có tiêu đề.", icon="ℹ️")
-                        data_io.seek(0)  # Reset lại con trỏ file
-                        temp_df = pd.read_csv(data_io, sep='\t', header=None, names=PREDEFINED_COLUMNS,
-                                              skipinitialspace=True)
-                        st.toast("Đã sử dụng tên cột mặc định.", icon="ℹ️")
-                    else:
-                        st.toast("Đã đọc dữ liệu với tiêu đề từ người dùng.", icon="ℹ️")
-                except pd.errors.ParserError:  # Xảy ra khi số cột không khớp header
-                    st.toast("Lỗi khi đọc với tiêu đề (số cột không khớp). Thử đọc không có tiêu đề.", icon="⚠️")
-                    data_io.seek(0)
-                    temp_df = pd.read_csv(data_io, sep='\t', header=None, names=PREDEFINED_COLUMNS,
-                                          skipinitialspace=True)
-                    st.toast("Đã sử dụng tên cột mặc định.", icon="ℹ️")
-                except Exception:  # Các lỗi khác khi đọc với header
-                    st.toast("Lỗi khi đọc với tiêu đề. Thử đọc không có tiêu đề.", icon="⚠️")
-                    data_io.seek(0)
-                    temp_df = pd.read_csv(data_io, sep='\t', header=None, names=PREDEFINED_COLUMNS,
-                                          skipinitialspace=True)
-                    st.toast("Đã sử dụng tên cột mặc định.", icon="ℹ️")
-
-                temp_df.dropna(axis=0, how='all', inplace=True);
-                temp_df.dropna(axis=1, how='all', inplace=True)
+                # Tự nhận diện dòng tiêu đề, dùng tên cột mặc định nếu không có
+                with trace.span("read_upload" if use_file else "read_paste") as span:
+                    temp_df = read_uploaded_file(uploaded_file) if use_file else \
+                        scheduler.read_registration_table(pasted_data, notify_toast)
+                    span["rows"] = len(temp_df)
                 if not temp_df.empty:
                     st.session_state.df_from_paste = temp_df;
                     st.toast("✅ Đã xử lý dữ liệu dán thành công.", icon="✅")
+                    # Nhiều tuần / nhiều cửa hàng trong cùng một lần dán -> chế độ hàng loạt
+                    with trace.span("split_groups") as span:
+                        batch_groups, unparsed_rows = split_into_groups(temp_df)
+                        span["groups"] = len(batch_groups)
+                    st.session_state.batch_groups = batch_groups
+                    if len(batch_groups) > 1 and not unparsed_rows.empty:
+                        st.toast(f"⚠️ {len(unparsed_rows)} dòng không xác định được tuần, bỏ qua khi lập lịch hàng loạt.",
+                                 icon="⚠️")
                     # Tạo bảng tra cứu availability_lookup_df
-                    st.session_state.availability_lookup_df = preprocess_pasted_data_for_lookup(
-                        st.session_state.df_from_paste)
+                    with trace.span("preprocess"):
+                        st.session_state.availability_lookup_df = preprocess_pasted_data_for_lookup(
+                            st.session_state.df_from_paste, requirements)
+                    st.session_state.lookup_shift_key = shift_config_key
                     if st.session_state.availability_lookup_df is None or st.session_state.availability_lookup_df.empty:
                         st.toast("⚠️ Không thể tạo bảng tra cứu lịch đăng ký. Chức năng chỉnh sửa có thể bị hạn chế.",
                                  icon="⚠️")
                         st.session_state.availability_lookup_df = pd.DataFrame(
                             columns=['Date', 'Employee', 'Shift', 'Can_Work', 'Note'])  # Khởi tạo lại để tránh lỗi
+                    # Chỉ mục (ngày, ca) -> nhân viên rảnh, tạo một lần cho mỗi lần dán dữ liệu
+                    with trace.span("availability_index"):
+                        st.session_state.availability_index = build_availability_index(
+                            st.session_state.availability_lookup_df)
+                    st.session_state.availability_index['source'] = st.session_state.availability_lookup_df
+                    with trace.span("store_roster"):
+                        remember_roster(requirements)
                 else:
                     st.toast("⚠️ Dữ liệu sau khi xử lý bị rỗng.", icon="⚠️")
             except pd.errors.EmptyDataError:
                 st.toast("⚠️ Dữ liệu dán vào trống.", icon="⚠️")
+            except RosterFormatError as e:
+                st.error(f"❌ {e}")
             except Exception as e:
                 st.error(f"❌ Lỗi khi đọc dữ liệu: {e}"); st.error(
                     "Mẹo: Đảm bảo copy đúng vùng BẢNG (tab-separated)."); st.exception(e)  # Critical
+            finish_trace(trace)
         else:
-            st.toast("⚠️ Chưa có dữ liệu nào được dán vào.", icon="⚠️")
+            st.toast("⚠️ Chưa có dữ liệu nào được dán hoặc tải lên.", icon="⚠️")
 
     if st.session_state.df_from_paste is not None:
         with st.container(border=True):
             st.subheader("📄 Bước 2: Kiểm Tra Dữ Liệu Gốc")
             st.dataframe(st.session_state.df_from_paste, use_container_width=True, height=300)  # Giới hạn chiều cao
+            force_regenerate = False
+            if schedule_engine == ENGINE_AI:
+                force_regenerate = st.checkbox("🔄 Bỏ qua cache, gọi lại AI", key="force_regenerate",
+                                               help="Mặc định, dữ liệu và điều kiện không đổi sẽ dùng lại phản hồi AI đã lưu.")
+            previous_week = previous_saved_week()
+            warm_start = previous_week is not None and st.checkbox(
+                f"♻️ Dùng lại lịch tuần {pd.Timestamp(previous_week).strftime('%d/%m/%Y')} cho các ngày không đổi",
+                key="warm_start",
+                help="Giữ nguyên phân công của những ngày có đăng ký giống tuần trước; chỉ các ngày thay đổi "
+                     "được xếp lại bằng bộ giải cục bộ (không gọi AI).")
             if not st.session_state.df_from_paste.empty:
-                if generate_button_placeholder.button("✨ Tạo Lịch với AI", key="generate_ai_button",
+                generate_label = "⚡ Tạo Lịch Nhanh" if schedule_engine == ENGINE_LOCAL else "✨ Tạo Lịch với AI"
+                if generate_button_placeholder.button(generate_label, key="generate_ai_button",
                                                       use_container_width=True):
-                    # Spinner is handled by generate_schedule_with_ai
-                    ai_response = generate_schedule_with_ai(st.session_state.df_from_paste, requirements, model)
-                    st.session_state.ai_response_text = ai_response;
+                    st.session_state.ai_response_text = None;
+                    st.session_state.ai_response_from_cache = False
+                    st.session_state.streamed_schedule_df = None
                     st.session_state.schedule_df = None;
                     st.session_state.edited_schedule_table = None
                     st.session_state.current_schedule_selections = {}
+                    st.session_state.pop('schedule_grid_editor', None)
                     st.session_state.copyable_text = None
-                    if ai_response:
-                        parsed_df = parse_ai_schedule(ai_response)
-                        if parsed_df is not None and not parsed_df.empty:
-                            st.session_state.schedule_df = parsed_df
-                            # Tạo bảng 8 cột ban đầu từ kết quả AI
-                            st.session_state.edited_schedule_table = create_8_column_df(st.session_state.schedule_df)
-                        else:
-                            st.toast("❌ Không phân tích được lịch từ AI hoặc lịch trống.", icon="❌")
-                            st.session_state.schedule_df = None  # Đảm bảo là None nếu lỗi
+                    trace = RunTrace("generate", engine=schedule_engine, output_format=output_format,
+                                     compact_prompt=compact_prompt, stream=stream_ai, warm_start=warm_start,
+                                     rows=len(st.session_state.df_from_paste))
+                    warm_result = warm_start_schedule(requirements, trace) if warm_start else None
+                    if warm_result is not None:
+                        solved_df, fixed, changed = warm_result
+                        st.session_state.schedule_df = solved_df
+                        with trace.span("create_8_column_df"):
+                            st.session_state.edited_schedule_table = create_8_column_df(solved_df)
+                        remember_schedule(solved_df, st.session_state.edited_schedule_table, KIND_GENERATED,
+                                          "warm_start")
+                        st.toast(f"♻️ Giữ {len(fixed)} ca của tuần trước, xếp lại {len(changed)} ngày có thay đổi.",
+                                 icon="♻️")
+                    elif schedule_engine == ENGINE_LOCAL:
+                        if st.session_state.availability_lookup_df.empty:
+                            st.toast("❌ Không có dữ liệu tra cứu đăng ký để xếp lịch.", icon="❌")
                             st.session_state.edited_schedule_table = create_8_column_df(None)  # Tạo bảng trống
+                        else:
+                            with trace.span("solve_local"):
+                                solved_df = solve_schedule(st.session_state.availability_lookup_df, requirements)
+                            st.session_state.schedule_df = solved_df
+                            with trace.span("create_8_column_df"):
+                                st.session_state.edited_schedule_table = create_8_column_df(solved_df)
+                            remember_schedule(solved_df, st.session_state.edited_schedule_table, KIND_GENERATED,
+                                              schedule_engine)
+                            st.toast("✅ Đã tạo lịch bằng bộ giải cục bộ.", icon="✅")
                     else:
-                        st.toast(f"❌ Không nhận được phản hồi từ AI ({MODEL_NAME}).", icon="❌")
-                        st.session_state.edited_schedule_table = create_8_column_df(None)  # Tạo bảng trống
+                        # Spinner is handled by generate_schedule_with_ai
+                        ai_model = load_ai_model()  # Chỉ khởi tạo Gemini khi người dùng yêu cầu tạo lịch bằng AI
+                        ai_response = None
+                        if ai_model is not None:
+                            ai_response = generate_schedule_with_ai(st.session_state.df_from_paste, requirements,
+                                                                    ai_model, force_refresh=force_regenerate,
+                                                                    stream=stream_ai, output_format=output_format,
+                                                                    compact_prompt=compact_prompt, trace=trace)
+                        st.session_state.ai_response_text = ai_response
+                        if ai_response:
+                            with trace.span("parse", output_format=output_format) as span:
+                                parsed_df = parse_ai_response(ai_response, output_format)
+                                span["rows"] = 0 if parsed_df is None else len(parsed_df)
+                            if (parsed_df is None or parsed_df.empty) and st.session_state.streamed_schedule_df is not None:
+                                st.toast("Dùng các dòng lịch đã nhận được trong lúc streaming.", icon="ℹ️")
+                                parsed_df = st.session_state.streamed_schedule_df
+                            if parsed_df is not None and not parsed_df.empty:
+                                parsed_df = match_roster_names(parsed_df, st.session_state.availability_lookup_df)
+                                st.session_state.schedule_df = parsed_df
+                                # Tạo bảng 8 cột ban đầu từ kết quả AI
+                                with trace.span("create_8_column_df"):
+                                    st.session_state.edited_schedule_table = create_8_column_df(
+                                        st.session_state.schedule_df)
+                                remember_schedule(parsed_df, st.session_state.edited_schedule_table, KIND_GENERATED,
+                                                  schedule_engine)
+                            else:
+                                st.toast("❌ Không phân tích được lịch từ AI hoặc lịch trống.", icon="❌")
+                                st.session_state.schedule_df = None  # Đảm bảo là None nếu lỗi
+                                st.session_state.edited_schedule_table = create_8_column_df(None)  # Tạo bảng trống
+                        else:
+                            st.toast(f"❌ Không nhận được phản hồi từ AI ({MODEL_NAME}).", icon="❌")
+                            st.session_state.edited_schedule_table = create_8_column_df(None)  # Tạo bảng trống
+                    finish_trace(trace)
             else:
                 st.toast("Dữ liệu đã xử lý trống, không thể tạo lịch.", icon="ℹ️")
+            if st.session_state.ai_response_from_cache and st.session_state.schedule_df is not None:
+                st.caption("⚡ **Cached** — lịch được lấy từ phản hồi AI đã lưu. Chọn 'Bỏ qua cache' để tạo lại.")
+            if len(st.session_state.batch_groups) > 1:
+                st.info(f"📦 Dữ liệu gồm {len(st.session_state.batch_groups)} nhóm (tuần/cửa hàng): "
+                        f"{', '.join(label for label, _ in st.session_state.batch_groups)}.")
+                if st.button("📦 Tạo lịch hàng loạt cho tất cả nhóm", key="generate_batch_button",
+                             use_container_width=True):
+                    trace = RunTrace("batch", engine=schedule_engine, output_format=output_format,
+                                     groups=len(st.session_state.batch_groups))
+                    with trace.span("batch_generation") as span:
+                        st.session_state.batch_results, st.session_state.batch_errors = run_batch_generation(
+                            st.session_state.batch_groups, requirements, schedule_engine, output_format, compact_prompt)
+                        span["failed_groups"] = len(st.session_state.batch_errors)
+                    finish_trace(trace)
+
+    if st.session_state.batch_results is not None:
+        with st.container(border=True):
+            display_batch_results(st.session_state.batch_results, st.session_state.batch_errors)
 
     # --- Display Result Section ---
     # Luôn hiển thị khu vực này nếu edited_schedule_table đã được khởi tạo (kể cả khi nó rỗng)
@@ -944,12 +1401,29 @@ def main_app():
             # Hiển thị bảng chỉnh sửa, truyền cả schedule_df (kết quả gốc từ AI) và availability_lookup_df
             # Hàm display_editable_schedule_with_dropdowns sẽ cập nhật st.session_state.edited_schedule_table
             # nếu có sự thay đổi từ người dùng thông qua st.session_state.current_schedule_selections
-            current_edited_df = display_editable_schedule_with_dropdowns(
-                st.session_state.schedule_df,  # Dữ liệu gốc từ AI để khởi tạo
-                st.session_state.availability_lookup_df
-            )
+            editor_mode = st.radio("Kiểu bảng chỉnh sửa", [EDITOR_GRID, EDITOR_SELECTBOX], key="schedule_editor_mode",
+                                   horizontal=True, help="Bảng lưới chỉ là một widget nên mỗi lần sửa nhanh hơn nhiều.",
+                                   # Chỉnh sửa cũ của lưới không được ghi đè lựa chọn làm ở bảng kia
+                                   on_change=lambda: st.session_state.pop('schedule_grid_editor', None))
+            display_editor = display_schedule_grid_editor if editor_mode == EDITOR_GRID else display_editable_schedule_with_dropdowns
+            trace = RunTrace("render", editor=editor_mode)
+            with trace.span("editor_render"):
+                current_edited_df = display_editor(
+                    st.session_state.schedule_df,  # Dữ liệu gốc từ AI để khởi tạo
+                    st.session_state.availability_lookup_df,
+                    requirements
+                )
+            finish_trace(trace)
             if current_edited_df is not None:
                 st.session_state.edited_schedule_table = current_edited_df
+            if st.button("💾 Lưu bản chỉnh sửa", key="save_edited_schedule_button",
+                         help="Lưu lịch đang chỉnh sửa thành một phiên bản mới trong 'Lịch đã lưu'."):
+                version = remember_schedule(scheduler.schedule_from_display(st.session_state.edited_schedule_table),
+                                            st.session_state.edited_schedule_table, KIND_EDITED)
+                if version is not None:
+                    st.toast(f"💾 Đã lưu phiên bản {version}.", icon="💾")
+                else:
+                    st.toast("⚠️ Không có lịch để lưu.", icon="⚠️")
 
         st.divider()
         with st.container(border=True):
@@ -992,7 +1466,11 @@ def main_app():
                 col_dl1.error(f"Lỗi CSV 8 cột: {e}")  # Keep error for download specific issues
             try:
                 buffer_excel_8col = io.BytesIO()
-                engine = 'xlsxwriter' if 'xlsxwriter' in sys.modules else 'openpyxl'
+                engine = get_excel_engine()
+                if engine != 'xlsxwriter' and not st.session_state.get('xlsxwriter_warned'):
+                    st.session_state.xlsxwriter_warned = True  # Cảnh báo một lần mỗi phiên
+                    st.toast("Module 'xlsxwriter' được khuyến nghị để xuất Excel. Cài đặt bằng: pip install xlsxwriter",
+                             icon="⚠️")
                 with pd.ExcelWriter(buffer_excel_8col, engine=engine) as writer:
                     df_to_download_final.to_excel(writer, index=False, sheet_name='Edited_Schedule_8Col')
                 col_dl2.download_button("Tải Excel (Đã sửa)", buffer_excel_8col.getvalue(), "edited_schedule_8col.xlsx",
@@ -1003,6 +1481,7 @@ def main_app():
             col_dl1.toast("Không có dữ liệu lịch đã sửa để tải hoặc lịch trống.", icon="⚠️")
             col_dl2.toast("Không có dữ liệu lịch đã sửa để tải hoặc lịch trống.", icon="⚠️")
 
+    show_diagnostics_panel()
     st.sidebar.divider()
     st.sidebar.markdown("<p class='footer-copyright'>Copyright ©LeQuyPhat</p>", unsafe_allow_html=True)
 
@@ -1010,12 +1489,17 @@ def main_app():
 # --- Entry Point ---
 def main():
     """Main function to handle login state."""
+    # Page Configuration (Set Title and Icon) - must be the first Streamlit command of the run
+    st.set_page_config(page_title="AI Schedule Manager", page_icon="📅", layout="wide")
     if 'logged_in' not in st.session_state: st.session_state.logged_in = False
     load_css()
     if not st.session_state.logged_in:
         login()
     else:
-        main_app()
+        try:
+            main_app()
+        finally:
+            end_session_data()  # Cả khi st.stop()/st.rerun() kết thúc lần chạy sớm
 
 
 if __name__ == "__main__":
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""Columnar parsing of pasted registration data into the availability lookup table.
+
+Streamlit-free so it can be reused (and benchmarked) outside the app. The output
+has one row per employee x day x shift with columns Date / Employee / Shift /
+Can_Work / Note, in the same order the original row-by-row loop produced. The
+table is compact: Employee, Shift and Note are categorical (each name and note
+is stored once), Date is datetime64 and Can_Work bool. ``AvailabilityMatrix``
+holds the same data as a dense [employee, day, shift] boolean array.
+"""
+import numpy as np
+import pandas as pd
+
+from employee_registry import EmployeeRegistry
+from shifts import shift_model as get_shift_model
+
+LOOKUP_COLUMNS = ['Date', 'Employee', 'Shift', 'Can_Work', 'Note']
+
+DAY_KEYWORDS_MAP = {
+    0: ['thứ 2', 'mon'], 1: ['thứ 3', 'tue'], 2: ['thứ 4', 'wed'], 3: ['thứ 5', 'thu'],
+    4: ['thứ 6', 'fri'], 5: ['thứ 7', 'sat'], 6: ['chủ nhật', 'sun', 'cn']
+}
+DAY_COLUMN_PREFIX = "bạn có thể làm việc thời gian nào?"
+
+
+def empty_lookup():
+    """Empty availability lookup with the expected columns."""
+    return pd.DataFrame(columns=LOOKUP_COLUMNS)
+
+
+def find_employee_column(df_input):
+    return next((col for col in df_input.columns if 'tên' in col.lower()), None)
+
+
+def find_note_column(df_input):
+    return next((col for col in df_input.columns if 'ghi chú' in col.lower()), None)
+
+
+def find_day_columns(df_input):
+    """Maps weekday index (0 = Thứ 2) to the matching column of the pasted table."""
+    day_mapping = {}
+    for day_index, keywords in DAY_KEYWORDS_MAP.items():
+        for col in df_input.columns:
+            col_lower = str(col).lower()
+            bare = col_lower.replace(DAY_COLUMN_PREFIX, "").strip().replace("[", "").replace("]", "")
+            if any(f'[{keyword}]' in col_lower for keyword in keywords) or \
+                    any(f' {keyword}' in col_lower for keyword in keywords) or \
+                    any(keyword == bare for keyword in keywords):
+                day_mapping[day_index] = col
+                break
+    return day_mapping
+
+
+def classify_availability_text(texts, shift_model=None):
+    """Shift classification of availability cells (case and diacritics are ignored).
+
+    Returns one boolean array per shift of ``shift_model`` (default: Ca 1, Ca 2).
+    'nghỉ'/'off'/'bận' means none; time ranges pick the shifts they cover;
+    text that names no shift means all of them. See shifts.ShiftModel.
+    """
+    model = shift_model or get_shift_model()
+    matrix = model.classify(texts)
+    return tuple(matrix[:, i] for i in range(len(model.names)))
+
+
+def availability_hours(texts, shift_model=None):
+    """Free minutes per shift of each cell: [{shift: ((start, end), ...)}], partial for '9h-12h' or 'từ 16h'."""
+    model = shift_model or get_shift_model()
+    codes, uniques = pd.factorize(pd.Series(texts, dtype=object), use_na_sentinel=False)
+    hours = [model.available_hours(text) for text in uniques]
+    return [hours[code] for code in codes]
+
+
+def build_availability_lookup(df_input, start_date, employee_col, note_col, day_mapping, shift_model=None):
+    """Melts the day columns and classifies every distinct cell once for all shifts."""
+    model = shift_model or get_shift_model()
+    employees = df_input[employee_col].to_numpy(dtype=object)
+    valid = ~pd.isna(employees) & (employees != '')
+    if not valid.any() or not day_mapping:
+        return empty_lookup()
+
+    day_indexes = list(day_mapping.keys())
+    day_cols = [day_mapping[i] for i in day_indexes]
+    n_employees = int(valid.sum())
+
+    # Ô trống được đọc như chuỗi 'nan' (giống str(NaN) của cách xử lý cũ)
+    cells = df_input[day_cols].to_numpy(dtype=object)[valid].ravel()
+    cells[pd.isna(cells)] = 'nan'
+    texts = pd.Series(cells, dtype=object).astype(str).str.lower()
+    can_work = model.classify(texts)
+
+    names = pd.Series(employees[valid], dtype=object).astype(str).str.strip().to_numpy(dtype=object)
+    notes = df_input[note_col].to_numpy(dtype=object)[valid] if note_col else np.full(n_employees, '', dtype=object)
+    day_dates = pd.DatetimeIndex([pd.Timestamp(start_date).normalize() + pd.Timedelta(days=i) for i in day_indexes])
+    return _lookup_frame(day_dates, names, model.names, can_work.ravel(), notes)
+
+
+def _categorical_rows(values, repeat):
+    """Categorical of ``values`` (categories in first-seen order), each value repeated ``repeat`` times."""
+    codes, categories = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+    return pd.Categorical.from_codes(np.repeat(codes, repeat), categories=categories)
+
+
+def _lookup_frame(dates, employees, shifts, can_work, notes):
+    """Lookup rows employee x day x shift; ``employees`` / ``notes`` hold one value per employee row."""
+    n_employees, n_days, n_shifts = len(employees), len(dates), len(shifts)
+    return pd.DataFrame({
+        'Date': np.tile(np.repeat(np.asarray(dates, dtype='datetime64[ns]'), n_shifts), n_employees),
+        'Employee': _categorical_rows(employees, n_days * n_shifts),
+        'Shift': pd.Categorical.from_codes(np.tile(np.arange(n_shifts), n_employees * n_days),
+                                           categories=pd.Index(list(shifts), dtype=object)),
+        'Can_Work': np.asarray(can_work, dtype=bool),
+        'Note': _categorical_rows(notes, n_days * n_shifts),
+    })
+
+
+def _categorical(column):
+    values = column.astype(object)
+    return pd.Categorical(values, categories=pd.Index(pd.unique(values.dropna()), dtype=object))
+
+
+def compact_lookup(lookup_df):
+    """The lookup with compact dtypes (categorical Employee / Shift / Note, datetime64 Date, bool Can_Work)."""
+    if lookup_df is None or lookup_df.empty:
+        return empty_lookup()
+    return pd.DataFrame({
+        'Date': pd.to_datetime(lookup_df['Date']).dt.normalize().to_numpy(dtype='datetime64[ns]'),
+        'Employee': _categorical(lookup_df['Employee']),
+        'Shift': _categorical(lookup_df['Shift']),
+        'Can_Work': (lookup_df['Can_Work'] == True).to_numpy(dtype=bool),
+        'Note': _categorical(lookup_df['Note']),
+    })
+
+
+class AvailabilityMatrix:
+    """Dense availability ``can_work[employee, day, shift]`` with names, dates and notes stored once.
+
+    ``employees`` are the distinct names in roster order, ``dates`` a sorted
+    datetime64 array, ``shifts`` the shift names in lookup order and ``notes``
+    the first note of each employee. ``to_lookup`` is the adapter for code that
+    reads the Date / Employee / Shift / Can_Work / Note table.
+    """
+
+    def __init__(self, employees, dates, shifts, can_work, notes):
+        self.employees = np.asarray(employees, dtype=object)
+        self.dates = np.asarray(dates, dtype='datetime64[ns]')
+        self.shifts = list(shifts)
+        self.can_work = np.asarray(can_work, dtype=bool).reshape(len(self.employees), len(self.dates), len(self.shifts))
+        self.notes = np.asarray(notes, dtype=object)
+
+    @classmethod
+    def from_lookup(cls, lookup_df):
+        """Matrix of a lookup table (any dtypes); duplicated rows of a name are merged with 'or'."""
+        if lookup_df is None or lookup_df.empty:
+            return cls([], [], [], np.zeros((0, 0, 0), dtype=bool), [])
+        employee_codes, employees = pd.factorize(lookup_df['Employee'].astype(str).to_numpy(dtype=object))
+        date_codes, dates = pd.factorize(pd.to_datetime(lookup_df['Date']).dt.normalize(), sort=True)
+        shift_codes, shifts = pd.factorize(lookup_df['Shift'].astype(str).to_numpy(dtype=object))
+        can_work = np.zeros((len(employees), len(dates), len(shifts)), dtype=bool)
+        rows = (lookup_df['Can_Work'] == True).to_numpy(dtype=bool)
+        can_work[employee_codes[rows], date_codes[rows], shift_codes[rows]] = True
+        first_rows = np.unique(employee_codes, return_index=True)[1]
+        notes = (lookup_df['Note'].to_numpy(dtype=object)[first_rows] if 'Note' in lookup_df.columns
+                 else np.full(len(employees), '', dtype=object))
+        return cls(employees, dates, shifts, can_work, notes)
+
+    @property
+    def nbytes(self):
+        return int(self.can_work.nbytes + self.dates.nbytes + self.employees.nbytes + self.notes.nbytes)
+
+    def day_dates(self):
+        """``dates`` as datetime.date objects (the keys of the editor's slots)."""
+        return list(pd.DatetimeIndex(self.dates).date)
+
+    def to_lookup(self):
+        """The Date / Employee / Shift / Can_Work / Note table (compact dtypes, one row per employee x day x shift)."""
+        if not len(self.employees):
+            return empty_lookup()
+        return _lookup_frame(self.dates, self.employees, self.shifts, self.can_work.ravel(), self.notes)
+
+
+def build_availability_index(availability_df, registry=None):
+    """Indexes the lookup table once per paste for the schedule editor.
+
+    Returns {'slots': {(date, shift): sorted tuple of employees who can work},
+    'employees': sorted tuple of every employee, 'registry': EmployeeRegistry,
+    'matrix': AvailabilityMatrix}. Employees are named in roster spelling through
+    the registry, so the editor can map differently spelled names back to the
+    same person.
+    """
+    registry = registry or EmployeeRegistry.from_lookup(availability_df)
+    matrix = AvailabilityMatrix.from_lookup(availability_df)
+    names = np.array([registry.canonical(name) for name in matrix.employees], dtype=object)
+    slots = {}
+    for day_index, day in enumerate(matrix.day_dates()):
+        for shift_index, shift in enumerate(matrix.shifts):
+            rows = np.flatnonzero(matrix.can_work[:, day_index, shift_index])
+            if rows.size:
+                slots[(day, shift)] = tuple(sorted(set(names[rows])))
+    return {'slots': slots, 'employees': tuple(sorted(registry.names)), 'registry': registry, 'matrix': matrix}
+
+
+WEEK_DATE_FORMATS = ['%d/%m/%Y', '%m/%d/%Y', '%Y-%m-%d']
+
+
+def find_week_column(df_input):
+    return next((col for col in df_input.columns if 'tuần' in str(col).lower() or 'week' in str(col).lower()), None)
+
+
+def parse_week_start(value):
+    """Parses a week cell (DD/MM/YYYY first) and returns the Monday of that week, or None."""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    date_val_str = str(value)
+    start_date = pd.NaT
+    for fmt in WEEK_DATE_FORMATS:
+        start_date = pd.to_datetime(date_val_str, format=fmt, errors='coerce')
+        if pd.notna(start_date):
+            break
+    if pd.isna(start_date):  # Để pandas tự động phát hiện
+        start_date = pd.to_datetime(date_val_str, errors='coerce')
+    if pd.isna(start_date):
+        return None
+    return start_date - pd.Timedelta(days=start_date.weekday())  # Lùi về thứ 2 đầu tuần
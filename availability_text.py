@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Tokenizer for availability cells and notes ('Ca 1', 'sáng', '9h-12h', 'từ 16h', 'nghỉ'...).
+
+Text is normalized first (lower case, Vietnamese diacritics removed, 'đ' -> 'd',
+whitespace collapsed), so 'Nghỉ', 'nghi' and 'NGHỈ' are the same phrase. One
+compiled pattern then reads the tokens, left to right:
+
+* off: 'nghi', 'off', 'busy'... (the cell means no shift), plus 'bận', which is
+  matched on the text with diacritics since 'ban' is also 'bạn' / 'ban ngày';
+* range: '9h-12h', '9:30 - 12h', 'từ 14h đến 20h', '2pm-8pm', '9-15h';
+* from / until: 'từ 16h', 'sau 2pm' (to midnight) and 'đến 14h', 'trước 2pm' (from midnight);
+* time: a lone '9h', '14:00', '2h chiều'.
+
+A time needs 'h' / 'giờ' / ':' or am/pm/sáng/chiều/tối/trưa and is never read
+from inside a longer number, so '2h' no longer matches '12h'. Whatever is not a
+time stays in ``rest`` for shift keywords ('ca 1', 'sang'...). Results are
+memoized per normalized string, so each distinct phrasing is parsed once per
+process; ``shifts.ShiftModel`` maps the tokens to shifts.
+"""
+import re
+import unicodedata
+from collections import namedtuple
+from functools import lru_cache
+
+DAY_MINUTES = 24 * 60
+HALF_DAY = 12 * 60
+MEMO_SIZE = 4096
+
+OFF_WORDS = ('nghi', 'off', 'busy', 'unavailable')
+RAW_OFF_WORDS = ('bận',)  # So trên chữ có dấu: 'ban' không dấu trùng với 'bạn', 'ban ngày'
+FROM_WORDS = ('tu', 'sau', 'from', 'after', 'since')
+UNTIL_WORDS = ('den', 'toi', 'truoc', 'until', 'before')
+RANGE_SEPARATORS = ('-', '–', '~', 'den', 'toi', 'to')
+AFTERNOON_SUFFIXES = ('pm', 'chieu', 'toi')
+
+_HOUR = r"(?<![\d:])\d{1,2}"
+_MARK = r"(?:\s*(?:h|gio|g)(?![a-z])\s*(?:\d{2}(?!\d))?|:\d{2}(?!\d))?"
+_SUFFIX = r"(?:\s*(?:am|pm|sang|chieu|toi|trua)(?![a-z]))?"
+TIME_PARTS = re.compile(r"(\d{1,2})(?:\s*(h|gio|g)\s*(\d{2})?|:(\d{2}))?(?:\s*(am|pm|sang|chieu|toi|trua))?")
+
+AvailabilityText = namedtuple('AvailabilityText', 'off intervals times rest')
+AvailabilityText.__doc__ = """Tokens of one cell: ``off`` flag, (start, end) minute ``intervals`` from
+ranges / from / until, lone ``times`` (minutes) and the ``rest`` of the text."""
+
+
+def normalize_text(text):
+    """Lower case without Vietnamese diacritics, single spaces: 'Từ 2h  Chiều' -> 'tu 2h chieu'."""
+    decomposed = unicodedata.normalize('NFD', str(text).lower().replace('đ', 'd'))
+    return ' '.join(''.join(char for char in decomposed if not unicodedata.combining(char)).split())
+
+
+def _words(words):
+    return '|'.join(map(re.escape, sorted(words, key=len, reverse=True)))
+
+
+def _clock(hour, minute, suffix):
+    hour, minute = int(hour), int(minute or 0)
+    if suffix in AFTERNOON_SUFFIXES and hour < 12:
+        hour += 12
+    elif suffix == 'trua' and hour < 11:
+        hour += 12  # '1h trưa' = 13:00
+    elif suffix == 'am' and hour == 12:
+        hour = 0
+    return hour * 60 + minute
+
+
+def _time_parts(text):
+    """(hour, minute, suffix, explicit) of one time token; ``explicit`` = it had a mark or a suffix."""
+    hour, mark, minute_after_mark, minute_after_colon, suffix = TIME_PARTS.fullmatch(text.strip()).groups()
+    minute = minute_after_mark or minute_after_colon
+    return hour, minute, suffix, bool(mark or minute_after_colon or suffix)
+
+
+def _valid(hour, minute):
+    return int(hour) <= 24 and int(minute or 0) <= 59
+
+
+class Tokenizer:
+    """Compiled availability grammar; the word lists are pluggable (e.g. other languages)."""
+
+    def __init__(self, off_words=OFF_WORDS, from_words=FROM_WORDS, until_words=UNTIL_WORDS,
+                 range_separators=RANGE_SEPARATORS, memo_size=MEMO_SIZE, raw_off_words=RAW_OFF_WORDS):
+        time = _HOUR + _MARK + _SUFFIX
+        separator = rf"\s*(?:{_words(range_separators)})\s*"
+        self.pattern = re.compile(
+            rf"(?P<range>(?:(?<![a-z])(?:{_words(from_words)})\s+)?(?P<r1>{time}){separator}(?P<r2>{time}))"
+            rf"|(?<![a-z])(?:{_words(from_words)})\s+(?P<from>{time})"
+            rf"|(?<![a-z])(?:{_words(until_words)})\s+(?P<until>{time})"
+            rf"|(?P<time>{time})"
+            rf"|(?<![a-z])(?P<off>{_words(off_words)})(?![a-z])")
+        self.raw_off_pattern = re.compile(rf"(?<!\w)(?:{_words(raw_off_words)})(?!\w)") if raw_off_words else None
+        self.tokenize_normalized = lru_cache(maxsize=memo_size)(self._scan)
+
+    def tokenize(self, text):
+        """AvailabilityText of a raw cell (normalized first; parsed once per normalized string)."""
+        tokens = self.tokenize_normalized(normalize_text(text))
+        return tokens._replace(off=True) if not tokens.off and self.raw_off(text) else tokens
+
+    def raw_off(self, text):
+        """Whether the text with diacritics has an off word that normalizing would blur ('bận')."""
+        if self.raw_off_pattern is None:
+            return False
+        return self.raw_off_pattern.search(unicodedata.normalize('NFC', str(text).lower())) is not None
+
+    def _scan(self, text):
+        off, intervals, times, rest, position = False, [], [], [], 0
+        for match in self.pattern.finditer(text):
+            token = match.lastgroup if match.lastgroup not in ('r1', 'r2') else 'range'
+            if token == 'off':
+                off = True
+                continue  # Giữ chữ trong phần còn lại như trước
+            if token == 'range':
+                parsed = self._range(match.group('r1'), match.group('r2'))
+            elif token in ('from', 'until'):
+                hour, minute, suffix, explicit = _time_parts(match.group(token))
+                parsed = None
+                if explicit and _valid(hour, minute):
+                    moment = _clock(hour, minute, suffix)
+                    parsed = (moment, DAY_MINUTES) if token == 'from' else (0, moment)
+            else:
+                hour, minute, suffix, explicit = _time_parts(match.group('time'))
+                parsed = _clock(hour, minute, suffix) if explicit and _valid(hour, minute) else None
+            if parsed is None:
+                continue  # '1-2', 'ca 1'... không phải giờ: để lại cho từ khóa
+            (intervals if token != 'time' else times).append(parsed)
+            rest.append(text[position:match.start()])
+            position = match.end()
+        rest.append(text[position:])
+        return AvailabilityText(off, tuple(intervals), tuple(times), ' '.join(' '.join(rest).split()))
+
+    @staticmethod
+    def _range(first, second):
+        h1, m1, suffix1, explicit1 = _time_parts(first)
+        h2, m2, suffix2, explicit2 = _time_parts(second)
+        if not (explicit1 or explicit2) or not (_valid(h1, m1) and _valid(h2, m2)):
+            return None
+        if suffix1 is None and suffix2 is not None and int(h1) <= int(h2):
+            suffix1 = suffix2  # '2-8pm', '2-5 chiều'
+        start, end = _clock(h1, m1, suffix1), _clock(h2, m2, suffix2)
+        if end <= start:
+            end += HALF_DAY if end < HALF_DAY and end + HALF_DAY > start else DAY_MINUTES
+        return start, end
+
+
+DEFAULT_TOKENIZER = Tokenizer()
+
+
+def tokenize(text):
+    """AvailabilityText of ``text`` with the default word lists."""
+    return DEFAULT_TOKENIZER.tokenize(text)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Batch scheduling: several weeks and/or stores from one paste.
+
+The pasted table is split by week (and an optional store column); each group is
+generated independently, AI calls run concurrently through a bounded thread pool
+with a shared rate limiter, and the results are merged into one workbook with a
+sheet per group. Nothing here touches Streamlit, so worker threads stay UI-free.
+"""
+import io
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from availability import find_week_column, parse_week_start
+
+STORE_KEYWORDS = ['cửa hàng', 'chi nhánh', 'store', 'branch']
+INVALID_SHEET_CHARS = re.compile(r'[\[\]:*?/\\]')
+
+
+def find_store_column(df_input):
+    """Optional store/branch column used to split a multi-store paste."""
+    return next((col for col in df_input.columns if any(k in str(col).lower() for k in STORE_KEYWORDS)), None)
+
+
+def split_into_groups(df_input):
+    """Splits the pasted roster into [(label, sub_df)] by week start and store.
+
+    Rows whose week cannot be parsed are returned separately as the second value.
+    Groups are ordered by store, then week.
+    """
+    week_col = find_week_column(df_input)
+    if week_col is None:
+        return [("Tuần", df_input)], df_input.iloc[0:0]
+    store_col = find_store_column(df_input)
+    week_by_value = {value: parse_week_start(value) for value in df_input[week_col].dropna().unique()}
+    weeks = df_input[week_col].map(week_by_value)
+    unparsed = df_input[weeks.isna()]
+    parsed = df_input[weeks.notna()]
+    keys = [weeks[weeks.notna()].rename('_week')]
+    if store_col is not None:
+        keys.insert(0, parsed[store_col].fillna('').astype(str).str.strip().rename('_store'))
+    groups = []
+    for key, sub_df in parsed.groupby(keys, sort=True):
+        key = key if isinstance(key, tuple) else (key,)
+        week_label = key[-1].strftime('%Y-%m-%d')
+        label = f"{key[0]} - {week_label}" if store_col is not None and key[0] else week_label
+        # Mỗi nhóm chỉ có một tuần: chuẩn hóa cột tuần để find_start_date đọc đúng
+        sub_df = sub_df.copy()
+        sub_df[week_col] = key[-1].strftime('%d/%m/%Y')
+        groups.append((label, sub_df))
+    return groups, unparsed
+
+
+class RateLimiter:
+    """Thread-safe limiter spacing calls at least 60 / requests_per_minute seconds apart."""
+
+    def __init__(self, requests_per_minute):
+        self.min_interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def run_concurrently(tasks, call_fn, max_workers=4, rate_limiter=None):
+    """Runs ``call_fn(payload)`` for every (label, payload) in ``tasks``.
+
+    Returns {label: (result, error)}; one failing group never aborts the others.
+    """
+    def run_one(payload):
+        if rate_limiter is not None:
+            rate_limiter.wait()
+        try:
+            return call_fn(payload), None
+        except Exception as e:
+            return None, e
+
+    if not tasks:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tasks)))) as executor:
+        futures = {label: executor.submit(run_one, payload) for label, payload in tasks}
+        return {label: future.result() for label, future in futures.items()}
+
+
+def sheet_name(label, used):
+    """Excel sheet names: max 31 chars, no []:*?/\\ and unique within the workbook."""
+    base = INVALID_SHEET_CHARS.sub('-', str(label)).strip() or "Sheet"
+    name, suffix = base[:31], 2
+    while name.lower() in used:
+        tail = f" ({suffix})"
+        name, suffix = base[:31 - len(tail)] + tail, suffix + 1
+    used.add(name.lower())
+    return name
+
+
+def build_batch_workbook(schedules_by_label, engine):
+    """Writes {label: schedule DataFrame} into one workbook (a sheet per group) and returns its bytes."""
+    buffer = io.BytesIO()
+    used = set()
+    with pd.ExcelWriter(buffer, engine=engine) as writer:
+        for label, df_schedule in schedules_by_label.items():
+            df_schedule.to_excel(writer, index=False, sheet_name=sheet_name(label, used))
+    return buffer.getvalue()
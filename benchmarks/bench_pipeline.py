@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""Benchmark: every stage from pasted text to exported schedule, with stored baselines.
+
+Run from the repository root:
+
+    python benchmarks/bench_pipeline.py                    # compare against benchmarks/baselines.json
+    python benchmarks/bench_pipeline.py --save-baseline    # record a new baseline
+    python benchmarks/bench_pipeline.py --sizes 10 100 --language en --note-density 0.8
+
+Each stage runs on synthetic rosters (see synthetic.py) through the headless
+API in scheduler.py; the model call goes through the real call policy against
+a stub model, so no network or API key is needed. Reported per stage: median
+wall time over ``--repeat`` runs and peak traced memory of one extra run.
+Exits with 1 when a stage is slower or bigger than the baseline by more than
+``--tolerance`` (ratio), so the script can gate a change.
+"""
+import argparse
+import importlib.util
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+import warnings
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import scheduler  # noqa: E402
+from batch import build_batch_workbook  # noqa: E402
+from call_policy import BreakerRegistry, CallPolicy  # noqa: E402
+from roster_files import read_registration_file  # noqa: E402
+from solver import solve_schedule  # noqa: E402
+from synthetic import (LANGUAGES, StubModel, canned_json_response, canned_markdown_response,  # noqa: E402
+                       make_roster, roster_to_paste)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+DEFAULT_SIZES = (10, 100, 1000)
+# Thời gian dưới ngưỡng này quá nhiễu để so sánh tỉ lệ
+MIN_COMPARABLE_MS = 1.0
+MIN_COMPARABLE_KIB = 64.0
+
+
+def build_stages(n_employees, note_density, language, excel_engine):
+    """Prepares the inputs once and returns [(stage name, zero-argument callable)] in pipeline order."""
+    requirements = scheduler.DEFAULT_REQUIREMENTS
+    df_roster = make_roster(n_employees, note_density=note_density, language=language)
+    pasted = roster_to_paste(df_roster)
+    csv_bytes = df_roster.to_csv(index=False).encode('utf-8-sig')
+    xlsx_bytes = build_batch_workbook({"Roster": df_roster}, excel_engine)
+    df_input = scheduler.read_registration_table(pasted)
+    lookup = scheduler.preprocess_pasted_data_for_lookup(df_input)
+    df_schedule = solve_schedule(lookup, requirements)
+    markdown_text = canned_markdown_response(df_schedule)
+    markdown_day_first = canned_markdown_response(df_schedule, day_first=True)
+    json_text = canned_json_response(df_schedule)
+    model = StubModel(markdown_text, json_text)
+    policy = CallPolicy([scheduler.MODEL_NAME])
+    breakers = BreakerRegistry()
+    df_parsed = scheduler.parse_ai_response(json_text, scheduler.OUTPUT_JSON)
+    df_8col = scheduler.create_8_column_df(df_parsed.copy())
+    prompt = scheduler.build_schedule_prompt(df_input, requirements, scheduler.OUTPUT_JSON, compact=True)
+
+    def export_xlsx():
+        return build_batch_workbook({"Schedule": df_8col}, excel_engine)
+
+    return [
+        ("read_paste", lambda: scheduler.read_registration_table(pasted)),
+        ("read_upload_csv", lambda: read_registration_file(csv_bytes, "roster.csv")),
+        ("read_upload_xlsx", lambda: read_registration_file(xlsx_bytes, "roster.xlsx")),
+        ("preprocess", lambda: scheduler.preprocess_pasted_data_for_lookup(df_input)),
+        ("prompt_full", lambda: scheduler.build_schedule_prompt(df_input, requirements, scheduler.OUTPUT_JSON)),
+        ("prompt_compact", lambda: scheduler.build_schedule_prompt(df_input, requirements, scheduler.OUTPUT_JSON,
+                                                                   compact=True)),
+        ("model_call_stub", lambda: scheduler.request_ai_schedule(prompt, lambda name: model, policy, breakers,
+                                                                  scheduler.OUTPUT_JSON)),
+        ("solve_local", lambda: solve_schedule(lookup, requirements)),
+        ("parse_json", lambda: scheduler.parse_ai_response(json_text, scheduler.OUTPUT_JSON)),
+        ("parse_markdown", lambda: scheduler.parse_ai_schedule(markdown_text)),
+        ("parse_markdown_ddmm", lambda: scheduler.parse_ai_schedule(markdown_day_first)),
+        ("create_8_column_df", lambda: scheduler.create_8_column_df(df_parsed.copy())),
+        ("export_csv", lambda: df_8col.to_csv(index=False).encode('utf-8-sig')),
+        ("export_xlsx", export_xlsx),
+    ]
+
+
+def measure(func, repeat):
+    """(median wall time in ms, peak traced memory in KiB) of ``func``."""
+    func()  # Khởi động: import lười, cache regex...
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return statistics.median(timings), peak / 1024
+
+
+def run(sizes, repeat, note_density, language, excel_engine):
+    """{case label: {stage: {"ms": ..., "peak_kib": ...}}}."""
+    results = {}
+    for n_employees in sizes:
+        label = f"{n_employees}_{language}_{note_density:g}"
+        results[label] = {}
+        for stage, func in build_stages(n_employees, note_density, language, excel_engine):
+            ms, peak_kib = measure(func, repeat if n_employees < 1000 else max(1, repeat // 2))
+            results[label][stage] = {"ms": round(ms, 3), "peak_kib": round(peak_kib, 1)}
+    return results
+
+
+def environment(excel_engine):
+    return {"python": platform.python_version(), "pandas": pd.__version__, "platform": platform.platform(),
+            "excel_engine": excel_engine}
+
+
+def compare(results, baseline, tolerance):
+    """Prints the result table next to the baseline; returns the list of regressed (case, stage, metric)."""
+    regressions = []
+    base_results = (baseline or {}).get("results", {})
+    out = io.StringIO()
+    out.write(f"{'case':<18} {'stage':<22} {'ms':>10} {'base ms':>10} {'peak KiB':>10} {'base KiB':>10}\n")
+    for label, stages in results.items():
+        for stage, metrics in stages.items():
+            base = base_results.get(label, {}).get(stage)
+            flags = []
+            if base:
+                if metrics["ms"] >= MIN_COMPARABLE_MS and metrics["ms"] > base["ms"] * tolerance:
+                    flags.append("time")
+                if metrics["peak_kib"] >= MIN_COMPARABLE_KIB and metrics["peak_kib"] > base["peak_kib"] * tolerance:
+                    flags.append("memory")
+            regressions.extend((label, stage, flag) for flag in flags)
+            base_ms = f"{base['ms']:.2f}" if base else "-"
+            base_kib = f"{base['peak_kib']:.1f}" if base else "-"
+            out.write(f"{label:<18} {stage:<22} {metrics['ms']:>10.2f} {base_ms:>10} {metrics['peak_kib']:>10.1f} "
+                      f"{base_kib:>10}{'  ⚠️ ' + '+'.join(flags) if flags else ''}\n")
+    print(out.getvalue(), end="")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the paste -> export pipeline stages.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="Employee counts")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per stage (halved at 1000+ employees)")
+    parser.add_argument("--note-density", type=float, default=0.3, help="Share of employees with a note")
+    parser.add_argument("--language", choices=LANGUAGES, default="mixed", help="Language of the free text")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Overwrite the baseline with this run")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="Allowed slowdown/growth ratio")
+    args = parser.parse_args(argv)
+    warnings.simplefilter("ignore", UserWarning)  # Cảnh báo suy luận định dạng ngày của pandas (nhánh DD/MM)
+
+    excel_engine = 'xlsxwriter' if importlib.util.find_spec('xlsxwriter') is not None else 'openpyxl'
+    results = run(args.sizes, args.repeat, args.note_density, args.language, excel_engine)
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if baseline.get("environment", {}).get("excel_engine") not in (None, excel_engine):
+            print(f"Lưu ý: baseline dùng engine Excel '{baseline['environment']['excel_engine']}'.")
+    regressions = compare(results, None if args.save_baseline else baseline, args.tolerance)
+
+    if args.save_baseline:
+        merged = dict((baseline or {}).get("results", {}))
+        merged.update(results)  # Giữ các case khác đã lưu trước đó
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump({"environment": environment(excel_engine), "results": merged}, file, indent=1,
+                      ensure_ascii=False)
+            file.write("\n")
+        print(f"Đã lưu baseline vào {args.baseline}")
+        return 0
+    if regressions:
+        print(f"{len(regressions)} chỉ số vượt baseline quá {args.tolerance:g} lần.", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Benchmark: columnar availability parsing vs. the original row-by-row loop.
+
+Run from the repository root:  python benchmarks/bench_preprocess.py
+Checks that both implementations return the same table (the legacy one
+converted to the compact dtypes), then prints the
+median wall time at 10, 100 and 1000 employees.
+"""
+import os
+import random
+import sys
+import timeit
+from datetime import timedelta
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from availability import (build_availability_lookup, compact_lookup, find_day_columns,  # noqa: E402
+                          find_employee_column, find_note_column)
+
+COLUMNS = ["Tên nhân viên:", "Đăng kí ca cho tuần:"] + [
+    f"bạn có thể làm việc thời gian nào? [{day}]"
+    for day in ["Thứ 2", "Thứ 3", "Thứ 4", "Thứ 5", "Thứ 6", "Thứ 7", "Chủ nhật"]] + ["Ghi chú (nếu có)"]
+CELL_VALUES = ["Ca 1", "Ca 2", "Ca 1, Ca 2", "Nghỉ", "off", "Bận", "Sáng", "Chiều", "9h-15h", "14h-20h",
+               "12h-18h", "", "Có thể", None, "Ca 1 (9:00)", "từ 2h chiều"]
+NOTES = [None, None, None, "Muốn làm Ca 1", "Chỉ làm 9h-12h Thứ 2", "Xin off Thứ 2", "Nghỉ cả tuần"]
+
+
+def make_roster(n_employees, seed=0):
+    rng = random.Random(seed)
+    rows = [[f"NV {i}", "05/05/2025"] + [rng.choice(CELL_VALUES) for _ in range(7)] + [rng.choice(NOTES)]
+            for i in range(n_employees)]
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+def legacy_lookup(df_input, start_date, employee_col, note_col, day_mapping):
+    """The original iterrows() implementation, kept here as the reference."""
+    processed_rows = []
+    for index, row in df_input.iterrows():
+        employee = row.get(employee_col)
+        note = row.get(note_col, '') if note_col else ''
+        if not employee or pd.isna(employee): continue
+        employee_name = str(employee).strip()
+        for day_index, day_col in day_mapping.items():
+            current_date = start_date + timedelta(days=day_index)
+            availability_text = str(row.get(day_col, '')).lower()
+            can_do_ca1 = False
+            can_do_ca2 = False
+            if 'nghỉ' in availability_text or 'off' in availability_text or 'bận' in availability_text:
+                pass
+            else:
+                if 'ca 1' in availability_text or 'sáng' in availability_text or '9h' in availability_text or '9:00' in availability_text: can_do_ca1 = True
+                if 'ca 2' in availability_text or 'chiều' in availability_text or '14h' in availability_text or '2h' in availability_text or '14:00' in availability_text: can_do_ca2 = True
+                if not can_do_ca1 and not can_do_ca2 and availability_text.strip() != '' and not any(
+                        x in availability_text for x in ['nghỉ', 'off', 'bận']):
+                    can_do_ca1 = True
+                    can_do_ca2 = True
+            processed_rows.append({'Date': current_date.date(), 'Employee': employee_name, 'Shift': 'Ca 1',
+                                   'Can_Work': can_do_ca1, 'Note': note})
+            processed_rows.append({'Date': current_date.date(), 'Employee': employee_name, 'Shift': 'Ca 2',
+                                   'Can_Work': can_do_ca2, 'Note': note})
+    lookup_df = pd.DataFrame(processed_rows)
+    lookup_df['Date'] = pd.to_datetime(lookup_df['Date']).dt.date
+    return lookup_df
+
+
+def main():
+    start_date = pd.Timestamp("2025-05-05")
+    print(f"{'employees':>10} {'legacy (ms)':>12} {'columnar (ms)':>14} {'speedup':>8}")
+    for n_employees in (10, 100, 1000):
+        df_input = make_roster(n_employees)
+        args = (df_input, start_date, find_employee_column(df_input), find_note_column(df_input),
+                find_day_columns(df_input))
+        pd.testing.assert_frame_equal(compact_lookup(legacy_lookup(*args)), build_availability_lookup(*args))
+        repeat = 3 if n_employees >= 1000 else 7
+        legacy = sorted(timeit.repeat(lambda: legacy_lookup(*args), number=1, repeat=repeat))[repeat // 2]
+        columnar = sorted(timeit.repeat(lambda: build_availability_lookup(*args), number=1, repeat=repeat))[repeat // 2]
+        print(f"{n_employees:>10} {legacy * 1000:>12.1f} {columnar * 1000:>14.1f} {legacy / columnar:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
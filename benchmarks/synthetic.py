@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Synthetic inputs for the benchmarks: registration rosters, canned AI responses and a stub model.
+
+Everything is seeded, so two runs with the same arguments see the same data.
+Rosters mix clean shift names with the messy free text people actually type
+(Vietnamese with and without diacritics, English, time ranges), and canned
+responses are derived from the local solver so the names match the roster.
+"""
+import json
+import random
+
+import pandas as pd
+
+from prompts import estimate_tokens
+
+DAY_LABELS = ["Thứ 2", "Thứ 3", "Thứ 4", "Thứ 5", "Thứ 6", "Thứ 7", "Chủ nhật"]
+COLUMNS = ["Tên nhân viên:", "Đăng kí ca cho tuần:"] + [
+    f"bạn có thể làm việc thời gian nào? [{day}]" for day in DAY_LABELS] + ["Ghi chú (nếu có)"]
+
+AVAILABILITY_TEXT = {
+    'vi': ["Ca 1", "Ca 2", "Ca 1, Ca 2", "Nghỉ", "Bận", "Sáng", "Chiều", "9h-15h", "14h-20h", "12h-18h",
+           "Có thể", "Ca 1 (9:00)", "từ 2h chiều", "nghi", "ca1", "CA 2 ", "Sáng + chiều", "Cả ngày",
+           "bận buổi sáng", "Xin nghỉ"],
+    'en': ["Shift 1", "Shift 2", "Morning", "Afternoon", "off", "busy", "anytime", "9am-3pm", "2pm-8pm",
+           "Available", "Morning only", "after 2pm", "OFF (exam)", "any shift"],
+}
+NOTES = {
+    'vi': ["Muốn làm Ca 1", "Chỉ làm 9h-12h Thứ 2", "Xin off Thứ 2", "Nghỉ cả tuần", "Ưu tiên ca chiều",
+           "Tuần này thi, làm ít ca thôi", "Có thể làm thêm cuối tuần", "Không làm Chủ nhật"],
+    'en': ["Prefer morning shifts", "Only 9-12 on Monday", "Off Monday please", "Away all week",
+           "Can cover weekends", "Max 3 shifts this week"],
+}
+LANGUAGES = ('vi', 'en', 'mixed')
+
+
+def _pick_language(rng, language):
+    return rng.choice(('vi', 'en')) if language == 'mixed' else language
+
+
+def make_roster(n_employees, note_density=0.3, language='mixed', blank_rate=0.08, week="05/05/2025", seed=0):
+    """A registration table shaped like a Google Form export.
+
+    ``note_density`` is the share of employees with a note, ``blank_rate`` the
+    share of empty day cells; ``language`` is 'vi', 'en' or 'mixed' (per employee).
+    """
+    if language not in LANGUAGES:
+        raise ValueError(f"language must be one of {LANGUAGES}")
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n_employees):
+        lang = _pick_language(rng, language)
+        days = [None if rng.random() < blank_rate else rng.choice(AVAILABILITY_TEXT[lang]) for _ in DAY_LABELS]
+        note = rng.choice(NOTES[lang]) if rng.random() < note_density else None
+        rows.append([f"NV {i:04d}", week] + days + [note])
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+def roster_to_paste(df_roster):
+    """The tab-separated text a user would paste from Excel."""
+    return df_roster.to_csv(sep='\t', index=False)
+
+
+def canned_markdown_response(df_schedule, day_first=False):
+    """A Markdown answer for a 3-column schedule, wrapped in the prose models tend to add.
+
+    ``day_first`` writes DD/MM/YYYY dates, which sends the parser down its slower fallback path.
+    """
+    date_format = '%d/%m/%Y' if day_first else '%Y-%m-%d'
+    lines = ["Dưới đây là lịch làm việc đề xuất:", "", "| Ngày | Ca | Nhân viên được phân công |", "|---|---|---|"]
+    for day, shift, staff in df_schedule[['Ngày', 'Ca', 'Nhân viên được phân công']].itertuples(index=False):
+        lines.append(f"| {pd.Timestamp(day).strftime(date_format)} | {shift} | {staff} |")
+    lines += ["", "Lưu ý: lịch đã ưu tiên nguyện vọng trong ghi chú."]
+    return "\n".join(lines)
+
+
+def canned_json_response(df_schedule):
+    """A schema-conforming JSON answer (see SCHEDULE_JSON_SCHEMA) for a 3-column schedule."""
+    entries = []
+    for day, shift, staff in df_schedule[['Ngày', 'Ca', 'Nhân viên được phân công']].itertuples(index=False):
+        names = [name.strip() for name in str(staff).split(',') if name.strip()]
+        missing = sum(int(name.split()[1]) for name in names if name.startswith('(Thiếu'))
+        entries.append({"date": pd.Timestamp(day).strftime('%Y-%m-%d'), "shift": shift,
+                        "employees": [name for name in names if not name.startswith('(')], "missing": missing})
+    return json.dumps({"schedule": entries, "notes": "Lịch mẫu cho benchmark."}, ensure_ascii=False)
+
+
+class StubUsage:
+    """Mimics ``response.usage_metadata`` (token counts estimated locally)."""
+
+    def __init__(self, prompt, text):
+        self.prompt_token_count = estimate_tokens(prompt)
+        self.candidates_token_count = estimate_tokens(text)
+        self.total_token_count = self.prompt_token_count + self.candidates_token_count
+
+
+class StubResponse:
+    def __init__(self, prompt, text):
+        self.text = text
+        self.usage_metadata = StubUsage(prompt, text)
+
+
+class StubModel:
+    """Stands in for ``genai.GenerativeModel``: answers every prompt with a canned response.
+
+    Returns the JSON answer when the call asks for JSON output, the Markdown one
+    otherwise. ``latency`` (seconds) is slept per call via the injected ``sleep``.
+    """
+
+    def __init__(self, markdown_text, json_text, latency=0.0, sleep=None):
+        self.markdown_text = markdown_text
+        self.json_text = json_text
+        self.latency = latency
+        self.sleep = sleep
+        self.calls = 0
+
+    def generate_content(self, prompt, request_options=None, generation_config=None, **kwargs):
+        self.calls += 1
+        if self.latency and self.sleep is not None:
+            self.sleep(self.latency)
+        wants_json = (generation_config or {}).get("response_mime_type") == "application/json"
+        return StubResponse(prompt, self.json_text if wants_json else self.markdown_text)
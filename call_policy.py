@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""Retry / timeout / fallback policy around ``model.generate_content``.
+
+Every attempt is bounded by a per-call timeout and an overall deadline. Transient
+errors (429, 5xx, timeouts, connection resets) are retried with jittered
+exponential backoff and count toward the model's circuit breaker. Other errors,
+an exhausted retry budget or an open circuit breaker move on to the next model
+in the fallback list; errors such as a bad request or a rejected API key do not
+open the breaker. A streamed call only counts as answered once its first chunk
+has arrived, since rate limits and server errors surface there. Clock, sleep
+and random source are injectable, so the whole policy can be exercised with a
+local fake model object.
+"""
+import itertools
+import random
+import threading
+import time
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_MARKERS = ("429", "500", "502", "503", "504", "resource exhausted", "rate limit", "quota",
+                     "unavailable", "deadline", "timed out", "timeout", "internal error")
+
+
+class CallPolicy:
+    """Tunable parameters of the model call policy."""
+
+    def __init__(self, models, deadline_seconds=90.0, call_timeout_seconds=60.0, max_attempts_per_model=3,
+                 base_delay_seconds=1.0, max_delay_seconds=16.0, jitter=0.5, breaker_failure_threshold=3,
+                 breaker_reset_seconds=60.0):
+        self.models = list(models)  # Model chính trước, sau đó các model dự phòng theo thứ tự
+        self.deadline_seconds = deadline_seconds
+        self.call_timeout_seconds = call_timeout_seconds
+        self.max_attempts_per_model = max_attempts_per_model
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.jitter = jitter
+        self.breaker_failure_threshold = breaker_failure_threshold
+        self.breaker_reset_seconds = breaker_reset_seconds
+
+    def backoff_delay(self, retry_number, rng=random):
+        """Exponential delay for the n-th retry (1-based), scaled by a random factor in [1 - jitter, 1 + jitter]."""
+        delay = min(self.max_delay_seconds, self.base_delay_seconds * (2 ** (retry_number - 1)))
+        return max(0.0, delay * (1 + rng.uniform(-self.jitter, self.jitter)))
+
+
+class CircuitBreaker:
+    """Per-model breaker: opens after N consecutive failures, allows one trial call after the reset timeout.
+
+    While half-open only one caller (the probe) is let through; the others are
+    refused until the probe succeeds or fails. A probe that never reports back
+    gives up its turn after another ``reset_seconds``.
+    """
+
+    def __init__(self, failure_threshold=3, reset_seconds=60.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self.clock() - self.opened_at >= self.reset_seconds else "open"
+
+    def allow(self):
+        """True when a call may go out; in the half-open state this admits the single probe."""
+        with self._lock:
+            state = self.state
+            if state != "half-open":
+                return state == "closed"
+            if self.probe_started is not None and self.clock() - self.probe_started < self.reset_seconds:
+                return False  # Đang có một lần gọi thử
+            self.probe_started = self.clock()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probe_started = None
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()  # Mở (lại) mạch
+
+    def release(self):
+        """Ends a probe without a verdict (e.g. the call failed for a reason unrelated to the model's health)."""
+        with self._lock:
+            self.probe_started = None
+
+
+class BreakerRegistry:
+    """Process-wide breakers keyed by model name (shared by sessions and batch threads)."""
+
+    def __init__(self, failure_threshold=3, reset_seconds=60.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name):
+        with self._lock:
+            if model_name not in self._breakers:
+                self._breakers[model_name] = CircuitBreaker(self.failure_threshold, self.reset_seconds, self.clock)
+            return self._breakers[model_name]
+
+
+class ModelCallError(Exception):
+    """Raised when every model in the policy failed; ``attempts`` holds the per-attempt log."""
+
+    def __init__(self, message, attempts):
+        super().__init__(message)
+        self.attempts = attempts
+
+
+def is_retryable(error):
+    """True for rate limits, server errors, timeouts and connection problems."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    code = getattr(error, "code", None)
+    if isinstance(code, int) and code in RETRYABLE_STATUS_CODES:
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in RETRYABLE_MARKERS)
+
+
+def _opened_stream(response):
+    """Waits for the first chunk of a streamed response; returns an iterator over all of its chunks."""
+    chunks = iter(response)
+    try:
+        first = next(chunks)
+    except StopIteration:
+        return iter(())
+    return itertools.chain((first,), chunks)
+
+
+def call_with_policy(prompt, get_model, policy, breakers, generate_kwargs=None,
+                     clock=time.monotonic, sleep=time.sleep, rng=random, stream=False):
+    """Calls ``get_model(name).generate_content(prompt, ...)`` following ``policy``.
+
+    Returns (response, model_name, attempts) where ``attempts`` is a list of dicts
+    with model, attempt number, latency (s), outcome and error text. Raises
+    ModelCallError when no model produced a response before the deadline. With
+    ``stream`` the call is made with ``stream=True``, an attempt succeeds when the
+    first chunk arrives (its latency is the time to that chunk) and the response
+    is an iterator over every chunk.
+    """
+    generate_kwargs = dict(generate_kwargs or {})
+    if stream:
+        generate_kwargs["stream"] = True
+    attempts = []
+    started = clock()
+
+    def remaining():
+        return policy.deadline_seconds - (clock() - started)
+
+    for model_name in policy.models:
+        breaker = breakers.get(model_name)
+        if not breaker.allow():
+            attempts.append({"model": model_name, "attempt": 0, "latency": 0.0, "outcome": "circuit_open",
+                             "error": None})
+            continue
+        for attempt in range(1, policy.max_attempts_per_model + 1):
+            if remaining() <= 0:
+                raise ModelCallError("Hết thời gian cho phép khi gọi AI.", attempts)
+            timeout = min(policy.call_timeout_seconds, remaining())
+            call_started = clock()
+            try:
+                response = get_model(model_name).generate_content(
+                    prompt, request_options={"timeout": timeout}, **generate_kwargs)
+                if stream:
+                    response = _opened_stream(response)
+            except Exception as e:
+                latency = clock() - call_started
+                retryable = is_retryable(e)
+                attempts.append({"model": model_name, "attempt": attempt, "latency": latency,
+                                 "outcome": "retryable_error" if retryable else "error", "error": str(e)})
+                if retryable:
+                    breaker.record_failure()
+                else:
+                    breaker.release()  # Lỗi yêu cầu (prompt sai, khóa API...) không nói gì về tình trạng model
+                if not retryable or attempt == policy.max_attempts_per_model or not breaker.allow():
+                    break  # Chuyển sang model dự phòng
+                delay = policy.backoff_delay(attempt, rng)
+                if delay >= remaining():
+                    break
+                sleep(delay)
+                continue
+            attempts.append({"model": model_name, "attempt": attempt, "latency": clock() - call_started,
+                             "outcome": "ok", "error": None})
+            breaker.record_success()
+            return response, model_name, attempts
+    raise ModelCallError("Tất cả model AI đều lỗi hoặc đang tạm ngưng.", attempts)
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""Command-line batch scheduling without the Streamlit UI.
+
+    python cli.py roster.tsv weeks/ -o schedules/ --engine local --workers 8
+
+Every input (a TSV/TXT file, a CSV/XLSX export, or a directory of them) is split by
+week/store like the batch mode of the app, scheduled, and written as one
+workbook per input with a sheet per group (``--output csv`` writes one CSV per
+group instead), named after the input file (plus its extension when two inputs
+share a name). Files are processed in parallel worker processes; with
+``--engine ai`` each process builds its model client, breakers, cache and rate
+limiter once and reuses them for every file it handles.
+"""
+import argparse
+import importlib.util
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+import scheduler
+from ai_cache import ResponseCache
+from batch import RateLimiter, build_batch_workbook, sheet_name, split_into_groups
+from call_policy import BreakerRegistry, CallPolicy
+from instrumentation import RunTrace, TraceLog, span_or_null
+from roster_files import read_registration_file
+from shifts import ShiftConfigError, ShiftModel
+
+TEXT_EXTENSIONS = ('.tsv', '.txt')
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm')
+CSV_EXTENSIONS = ('.csv',)
+AI_WORKERS = 4  # Với AI giới hạn là số yêu cầu/phút, không phải số CPU
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".ai_cache")
+
+
+def collect_inputs(paths):
+    """Expands directories (non-recursive) into their TSV/TXT/CSV/XLSX files, keeping the given order."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if name.lower().endswith(TEXT_EXTENSIONS + CSV_EXTENSIONS + EXCEL_EXTENSIONS)
+                         and not name.startswith('~$'))
+        else:
+            files.append(path)
+    return files
+
+
+def output_stems(files):
+    """Output name stem of each input: the file name, plus its extension when two inputs share a name ('r_tsv').
+
+    Raises ValueError when two inputs would still write the same file (same name in different folders).
+    """
+    names = [os.path.splitext(os.path.basename(path)) for path in files]
+    counts = {}
+    for stem, _ in names:
+        counts[stem] = counts.get(stem, 0) + 1
+    stems = [f"{stem}_{extension.lstrip('.').lower()}" if counts[stem] > 1 else stem for stem, extension in names]
+    duplicates = sorted({path for path, stem in zip(files, stems) if stems.count(stem) > 1})
+    if duplicates:
+        raise ValueError("Các file đầu vào sẽ ghi đè kết quả của nhau: " + ", ".join(duplicates))
+    return stems
+
+
+def read_roster(path):
+    """Reads one registration file: CSV/XLSX exports via roster_files (needed columns only), TSV/TXT like a paste."""
+    if path.lower().endswith(EXCEL_EXTENSIONS + CSV_EXTENSIONS):
+        with open(path, 'rb') as file:
+            return read_registration_file(file.read(), path)
+    with open(path, encoding='utf-8-sig') as file:
+        return scheduler.read_registration_table(file.read())
+
+
+def load_shifts(path):
+    """Reads a shifts_definition mapping (see shifts.py) from a JSON or YAML file; raises ShiftConfigError."""
+    try:
+        with open(path, encoding='utf-8') as file:
+            definition = yaml.safe_load(file)  # JSON cũng là YAML hợp lệ
+    except (OSError, yaml.YAMLError) as e:
+        raise ShiftConfigError(f"Không đọc được file ca '{path}': {e}") from e
+    if not isinstance(definition, dict):
+        raise ShiftConfigError(f"File ca '{path}' phải là một bảng tên ca -> {{start, end, staff, keywords}}.")
+    definition = definition.get("shifts_definition", definition)
+    ShiftModel(definition)  # Kiểm tra giờ, số người...
+    return definition
+
+
+_session = None  # Phiên AI của tiến trình này (init_worker), dùng chung cho mọi file
+
+
+def _ai_session(options):
+    """Model getter, policy, breakers, cache and rate limiter for one worker process (None for the local engine)."""
+    if options['engine'] != 'ai':
+        return None
+    api_key = os.environ.get("GOOGLE_API_KEY")
+    if not api_key:
+        raise RuntimeError("GOOGLE_API_KEY chưa được đặt trong biến môi trường.")
+    policy = CallPolicy([scheduler.MODEL_NAME] + scheduler.FALLBACK_MODEL_NAMES)
+    return {
+        'get_model': scheduler.make_genai_model_getter(api_key),
+        'policy': policy,
+        'breakers': BreakerRegistry(policy.breaker_failure_threshold, policy.breaker_reset_seconds),
+        'cache': ResponseCache(options['cache_dir']) if options['cache_dir'] else None,
+        # Hạn mức yêu cầu/phút được chia đều cho các tiến trình
+        'rate_limiter': RateLimiter(options['requests_per_minute'] / options['workers']),
+    }
+
+
+def init_worker(options):
+    """Builds this process's AI session once (ProcessPoolExecutor initializer); errors are reported per file."""
+    global _session
+    try:
+        _session = _ai_session(options)
+    except Exception as e:
+        _session = e
+
+
+def process_file(path, options, stem=None):
+    """Schedules every group of one input file and writes the output(s) named after ``stem`` (see output_stems).
+
+    Runs in a worker process set up by ``init_worker``; returns (path, written
+    files, {group: error}).
+    """
+    errors, schedules = {}, {}
+    trace_log = TraceLog(options['trace_log']) if options.get('trace_log') else None
+    session = _session
+    if isinstance(session, Exception):
+        return path, [], {"*": str(session)}
+    try:
+        groups, _ = split_into_groups(read_roster(path))
+    except Exception as e:
+        return path, [], {"*": str(e)}
+    if not groups:
+        return path, [], {"*": "Không xác định được tuần đăng ký của dòng nào."}
+    for label, sub_df in groups:
+        trace = RunTrace("cli", source=path, group=label, engine=options['engine'],
+                         rows=len(sub_df)) if trace_log is not None else None
+        try:
+            if session is not None:
+                df_schedule, _ = scheduler.generate_schedule(
+                    sub_df, options['requirements'], session['get_model'], session['policy'], session['breakers'],
+                    output_format=options['output_format'], compact_prompt=options['compact'], cache=session['cache'],
+                    trace=trace, rate_limiter=session['rate_limiter'])
+            else:
+                df_schedule, _ = scheduler.generate_schedule(sub_df, options['requirements'], trace=trace)
+            if df_schedule.empty:
+                errors[label] = "Không có dữ liệu đăng ký hợp lệ."
+            else:
+                with span_or_null(trace, "create_8_column_df"):
+                    schedules[label] = scheduler.create_8_column_df(
+                        df_schedule, *scheduler.display_layout(options['requirements']))
+        except Exception as e:
+            errors[label] = str(e)
+        if trace is not None:
+            trace.meta["error"] = errors.get(label)
+            trace_log.write(trace)
+
+    written = []
+    if schedules:
+        stem = stem or os.path.splitext(os.path.basename(path))[0]
+        if options['output'] == 'csv':
+            used = set()
+            for label, df_schedule in schedules.items():
+                target = os.path.join(options['output_dir'], f"{stem} - {sheet_name(label, used)}.csv")
+                df_schedule.to_csv(target, index=False, encoding='utf-8-sig')
+                written.append(target)
+        else:
+            target = os.path.join(options['output_dir'], f"{stem}_schedule.xlsx")
+            with open(target, 'wb') as file:
+                file.write(build_batch_workbook(schedules, options['excel_engine']))
+            written.append(target)
+    return path, written, errors
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Tạo lịch làm việc hàng loạt từ file đăng ký (không cần giao diện).")
+    parser.add_argument("inputs", nargs="+", help="File .tsv/.txt/.csv/.xlsx hoặc thư mục chứa các file đó")
+    parser.add_argument("-o", "--output-dir", default="schedules", help="Thư mục ghi kết quả (mặc định: schedules)")
+    parser.add_argument("--output", choices=["xlsx", "csv"], default="xlsx",
+                        help="xlsx: một workbook/file đầu vào; csv: một file/nhóm")
+    parser.add_argument("--engine", choices=["local", "ai"], default="local",
+                        help="local: bộ giải cục bộ; ai: Gemini (cần GOOGLE_API_KEY)")
+    parser.add_argument("--format", choices=["json", "markdown"], default="json", help="Định dạng phản hồi AI")
+    parser.add_argument("--full-prompt", action="store_true", help="Dùng prompt đầy đủ thay vì prompt rút gọn")
+    parser.add_argument("--workers", type=int, default=None,
+                        help=f"Số tiến trình xử lý song song (mặc định: số CPU với local, {AI_WORKERS} với ai)")
+    parser.add_argument("--requests-per-minute", type=float, default=15, help="Tổng số yêu cầu AI/phút")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Thư mục cache phản hồi AI ('' để tắt)")
+    parser.add_argument("--trace-log", default="", help="Ghi thời gian từng bước/token mỗi nhóm vào file JSON lines")
+    parser.add_argument("--shifts", default="", help="File JSON/YAML định nghĩa ca (giờ, số người, từ khóa); "
+                                                     "mặc định Ca 1 09:00-15:00, Ca 2 14:00-20:00")
+    parser.add_argument("--max-consecutive-days", type=int, default=scheduler.DEFAULT_REQUIREMENTS["max_consecutive_days"])
+    parser.add_argument("--min-rest-hours", type=int, default=scheduler.DEFAULT_REQUIREMENTS["min_rest_hours"])
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    files = collect_inputs(args.inputs)
+    if not files:
+        print("Không tìm thấy file đầu vào nào.", file=sys.stderr)
+        return 2
+    try:
+        stems = output_stems(files)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    try:
+        shifts_definition = load_shifts(args.shifts) if args.shifts else scheduler.DEFAULT_REQUIREMENTS["shifts_definition"]
+    except ShiftConfigError as e:
+        print(f"Cấu hình ca không hợp lệ: {e}", file=sys.stderr)
+        return 2
+    if args.engine == "ai" and not os.environ.get("GOOGLE_API_KEY"):
+        print("GOOGLE_API_KEY chưa được đặt trong biến môi trường.", file=sys.stderr)
+        return 2
+    os.makedirs(args.output_dir, exist_ok=True)
+    workers = args.workers or (AI_WORKERS if args.engine == "ai" else os.cpu_count() or 1)
+    workers = max(1, min(workers, len(files)))
+    options = {
+        'engine': args.engine,
+        'output': args.output,
+        'output_dir': args.output_dir,
+        'output_format': scheduler.OUTPUT_JSON if args.format == "json" else scheduler.OUTPUT_MARKDOWN,
+        'compact': not args.full_prompt,
+        'workers': workers,
+        'requests_per_minute': args.requests_per_minute,
+        'cache_dir': args.cache_dir,
+        'trace_log': args.trace_log,
+        'excel_engine': 'xlsxwriter' if importlib.util.find_spec('xlsxwriter') is not None else 'openpyxl',
+        'requirements': {**scheduler.DEFAULT_REQUIREMENTS, "shifts_definition": shifts_definition,
+                         "max_consecutive_days": args.max_consecutive_days, "min_rest_hours": args.min_rest_hours},
+    }
+
+    if workers == 1:
+        init_worker(options)
+        failed = _report(process_file(path, options, stem) for path, stem in zip(files, stems))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(options,)) as executor:
+            failed = _report(executor.map(process_file, files, [options] * len(files), stems))
+    return 1 if failed else 0
+
+
+def _report(outcomes):
+    """Prints each file's outcome as it completes; returns the number of failed groups."""
+    failed = 0
+    for path, written, errors in outcomes:
+        for target in written:
+            print(f"✅ {path} -> {target}")
+        for label, message in errors.items():
+            failed += 1
+            print(f"❌ {path} [{label}]: {message}", file=sys.stderr)
+    return failed
+
+
+if __name__ == "__main__":
+    sys.exit(main())
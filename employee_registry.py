@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Employee identity for one pasted roster: stable integer IDs and name matching.
+
+The roster's names get IDs 0..n-1 in roster order. Names are matched on a
+normalized key (NFC, casefold, single spaces), so 'Nguyễn  An' and 'nguyễn an'
+are the same person. A name the AI spelled differently is then looked up
+without diacritics and spaces ('Nguyen An', 'NV1' for 'NV 1'), and finally by a
+strict fuzzy match on that key (same number of words, one clear winner above
+FUZZY_CUTOFF, same digits), so 'Nguyên' and 'Nguyên Đào', 'Tran Van Anh' and
+'Trần Văn An' or 'NV 1' and 'NV 10' stay different people. Every lookup after
+the first is a dict hit.
+"""
+import difflib
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from availability_text import normalize_text
+from schedule_table import STAFF_COLUMN, split_staff
+
+FUZZY_CUTOFF = 0.95
+MISSING_MARKER = "(Thiếu"
+_DIGITS = re.compile(r"\d+")
+
+
+def normalize_name(name):
+    """Exact-match key of a name: NFC, casefold, whitespace collapsed."""
+    return ' '.join(unicodedata.normalize('NFC', str(name)).casefold().split())
+
+
+def _compact_key(key):
+    """Fuzzy-match key of a normalized name: no diacritics and no spaces ('NV 1' and 'NV1' agree)."""
+    return normalize_text(key).replace(' ', '')
+
+
+class EmployeeRegistry:
+    """Roster names with integer IDs and an exact-then-fuzzy lookup index."""
+
+    def __init__(self, names):
+        self.names = []  # id -> tên như trong danh sách đăng ký
+        self._ids = {}  # khóa chuẩn hóa -> id
+        folded = {}  # khóa bỏ dấu và khoảng trắng -> id, None khi hai người trùng khóa
+        self._word_counts = {}  # khóa bỏ dấu và khoảng trắng -> số từ của tên
+        for name in names:
+            if name is None or (not isinstance(name, str) and pd.isna(name)):
+                continue
+            name = str(name).strip()
+            key = normalize_name(name)
+            if not key or key in self._ids:
+                continue
+            self._ids[key] = len(self.names)
+            self.names.append(name)
+            fold = _compact_key(key)
+            folded[fold] = None if fold in folded else self._ids[key]
+            self._word_counts[fold] = len(key.split())
+        self._folded = {fold: employee_id for fold, employee_id in folded.items() if employee_id is not None}
+        self._resolved = {}  # khóa chưa gặp -> id hoặc None (ghi nhớ kết quả khớp gần đúng)
+
+    @classmethod
+    def from_lookup(cls, lookup_df):
+        """Registry of the employees of an availability lookup (roster order)."""
+        if lookup_df is None or lookup_df.empty:
+            return cls(())
+        return cls(pd.unique(lookup_df['Employee']))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return self.id_of(name) is not None
+
+    def id_of(self, name):
+        """ID of ``name``: exact key, then without diacritics and spaces, then a strict fuzzy match; None if unknown."""
+        key = normalize_name(name)
+        employee_id = self._ids.get(key)
+        if employee_id is not None or not key:
+            return employee_id
+        if key not in self._resolved:
+            self._resolved[key] = self._match(key)
+        return self._resolved[key]
+
+    def _match(self, key):
+        fold = _compact_key(key)
+        if fold in self._folded:
+            return self._folded[fold]
+        words = len(key.split())
+        candidates = [other for other in self._folded if self._word_counts[other] == words]
+        close = difflib.get_close_matches(fold, candidates, n=2, cutoff=FUZZY_CUTOFF)
+        if not close or (len(close) > 1 and difflib.SequenceMatcher(None, fold, close[0]).ratio() ==
+                         difflib.SequenceMatcher(None, fold, close[1]).ratio()):
+            return None  # Không ai hoặc hai người giống như nhau: không đoán
+        if _DIGITS.findall(fold) != _DIGITS.findall(close[0]):
+            return None  # 'NV 1' không phải 'NV 10'
+        return self._folded[close[0]]
+
+    def canonical(self, name):
+        """Roster spelling of ``name`` (the stripped input when it matches nobody)."""
+        employee_id = self.id_of(name)
+        return self.names[employee_id] if employee_id is not None else str(name).strip()
+
+    def codes(self, values):
+        """int32 IDs of ``values`` (-1 where unknown); each distinct value is looked up once."""
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+        ids = [self.id_of(value) for value in uniques]
+        table = np.array([-1] + [-1 if employee_id is None else employee_id for employee_id in ids], dtype=np.int32)
+        return table[codes + 1]  # Mã -1 (NaN) -> ô đầu tiên
+
+    def canonicalize_staff(self, cell):
+        """Staff cell with every known name in roster spelling; '(Thiếu N người)' and unknown names kept."""
+        names = [name if name.startswith(MISSING_MARKER) else self.canonical(name) for name in split_staff(cell)]
+        return ", ".join(names)
+
+    def canonicalize_schedule(self, df_schedule):
+        """(schedule with roster spellings, {AI spelling: roster name}) of a 3-column schedule."""
+        if df_schedule is None or df_schedule.empty or STAFF_COLUMN not in df_schedule.columns or not self.names:
+            return df_schedule, {}
+        renamed = {}
+        for cell in pd.unique(df_schedule[STAFF_COLUMN].dropna()):
+            for name in split_staff(cell):
+                if not name.startswith(MISSING_MARKER) and self.id_of(name) is not None and \
+                        self.canonical(name) != name:
+                    renamed[name] = self.canonical(name)
+        if not renamed:
+            return df_schedule, {}
+        fixed = df_schedule.copy()
+        fixed[STAFF_COLUMN] = fixed[STAFF_COLUMN].map(self.canonicalize_staff, na_action='ignore')
+        fixed.attrs = dict(df_schedule.attrs)
+        return fixed, renamed
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Per-stage timing and token accounting for one run of the pipeline.
+
+A ``RunTrace`` collects named spans (wall time in ms plus free-form attributes)
+and the token counts of the model call, read from ``response.usage_metadata``
+when the API returns it and estimated locally otherwise. Finished traces are
+appended to a JSON-lines file, one line per run, so slow runs can be found
+with ``jq``/pandas; the app also keeps the last few in the session for its
+diagnostics panel.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from prompts import estimate_tokens
+
+USAGE_FIELDS = {"prompt_tokens": "prompt_token_count", "response_tokens": "candidates_token_count",
+                "total_tokens": "total_token_count"}
+
+
+class RunTrace:
+    """Spans and token counts of one run (a paste, a generation, an editor render...)."""
+
+    def __init__(self, kind, clock=time.perf_counter, **meta):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.meta = meta  # Ngữ cảnh của lần chạy: engine, định dạng, số dòng...
+        self.clock = clock
+        self.started_at = time.time()
+        self._started = clock()
+        self.spans = []  # {"name", "start_ms", "ms", "error", **attrs}
+        self.tokens = {}
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Times the ``with`` block; the yielded dict can receive attributes known only at the end."""
+        started = self.clock()
+        record = {"name": name, "start_ms": round((started - self._started) * 1000, 1), **attrs}
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record["ms"] = round((self.clock() - started) * 1000, 1)
+            self.spans.append(record)
+
+    def record_usage(self, response, prompt=None, response_text=None):
+        """Token counts from ``response.usage_metadata``; falls back to local estimates of prompt/response text."""
+        usage = getattr(response, "usage_metadata", None)
+        counts = {key: getattr(usage, field, None) for key, field in USAGE_FIELDS.items()} if usage else {}
+        if counts and counts["prompt_tokens"] is not None:
+            self.tokens = {**{key: int(value or 0) for key, value in counts.items()}, "source": "usage_metadata"}
+        else:
+            if response_text is None:
+                response_text = getattr(response, "text", None)
+            self.record_estimate(prompt, response_text)
+
+    def record_estimate(self, prompt=None, response_text=None):
+        """Locally estimated token counts (cached responses, streams without usage data)."""
+        prompt_tokens = estimate_tokens(prompt) if prompt else 0
+        response_tokens = estimate_tokens(response_text) if response_text else 0
+        self.tokens = {"prompt_tokens": prompt_tokens, "response_tokens": response_tokens,
+                       "total_tokens": prompt_tokens + response_tokens, "source": "estimate"}
+
+    @property
+    def total_ms(self):
+        return round((self.clock() - self._started) * 1000, 1)
+
+    def to_record(self):
+        """JSON-serializable summary of the run."""
+        return {"ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)), "run_id": self.run_id,
+                "kind": self.kind, "total_ms": self.total_ms, **self.meta, "spans": list(self.spans),
+                "tokens": dict(self.tokens)}
+
+
+class TraceLog:
+    """Appends finished runs to a JSON-lines file (one line per run, safe across threads)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, trace):
+        """Writes ``trace`` (RunTrace or record dict); logging failures never break a run."""
+        record = trace.to_record() if isinstance(trace, RunTrace) else trace
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            try:
+                with open(self.path, "a", encoding="utf-8") as file:
+                    file.write(line)
+            except OSError:
+                return False
+        return True
+
+
+def span_or_null(trace, name, **attrs):
+    """``trace.span(...)`` or a no-op context manager yielding a throwaway dict when there is no trace."""
+    if trace is None:
+        return _null_span(attrs)
+    return trace.span(name, **attrs)
+
+
+@contextmanager
+def _null_span(attrs):
+    yield dict(attrs)
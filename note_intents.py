@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""Rule-based reading of the free-text 'Ghi chú' column into scheduling constraints.
+
+A note is split into clauses (',', ';', '.', 'nhưng', 'but'); each clause is
+read on the normalized text of ``availability_text`` for:
+
+* polarity: 'nghỉ', 'xin off', 'bận', 'không làm', 'away'... (negative) or
+  'muốn', 'ưu tiên', 'có thể', 'prefer', 'can cover'... (positive); a clause
+  without either keeps the polarity of the one before only when it is just a
+  list of days or shifts ('Xin off T2, T3');
+* days: 'thứ 2', 'T2', 'chủ nhật', 'CN', 'cuối tuần', 'Monday', 'weekends'...,
+  and ranges such as 'thứ 2 đến thứ 4' or 'T6-CN';
+* shifts: keywords, times and ranges, through ``ShiftModel.mentioned_shifts``;
+* hours: 'chỉ làm 9h-12h', 'từ 16h' (the employee works only then on those days);
+* 'chỉ làm' / 'only' with shifts or days: the other shifts / days are ruled out;
+* a weekly cap: 'tối đa 3 ca', 'max 3 shifts'.
+
+A negative clause naming nothing is a week off ('nghỉ cả tuần'); with days
+only, those days are off; with shifts, those shifts are blocked. A positive
+clause gives soft preferences that the solver weighs by
+``preferences_weight_hint``. Clauses that say none of this are kept verbatim
+for the prompt. Each distinct note is read once per shift model, and
+``apply_note_intents`` applies the result to a whole lookup table.
+"""
+import re
+import unicodedata
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from availability_text import DAY_MINUTES, MEMO_SIZE, normalize_text
+from prompts import DAY_ABBREVIATIONS
+from shifts import _overlap, shift_model as get_shift_model
+
+NEGATIVE_WORDS = ('nghi', 'off', 'xin off', 'busy', 'unavailable', 'away', 'khong lam', 'khong the', 'khong di',
+                  'khong muon', 'cannot', "can't", 'cant', 'not available', 'vang')
+RAW_NEGATIVE_WORDS = ('bận',)  # 'ban' không dấu trùng với 'bạn': chỉ so trên chữ có dấu
+ONLY_WORDS = ('chi lam', 'chi di', 'chi', 'only')
+RAW_ONLY_PATTERN = re.compile(r"(?<!\w)(?:chỉ|only)(?!\w)")  # 'chi' không dấu trùng với 'chị'
+LIST_WORDS = frozenset(('va', 'voi', 'and', 'ngay', 'ca', 'nua', 'luon', 'also', 'too'))  # Nối trong danh sách
+POSITIVE_WORDS = ('muon', 'uu tien', 'co the', 'thich', 'lam them', 'prefer', 'want', 'would like', 'can cover',
+                  'can work', 'available', 'ok')
+WEEK_WORDS = ('tuan', 'week')
+DAY_WORDS = {
+    'thu 2': (0,), 'thu hai': (0,), 't2': (0,), 'mon': (0,), 'monday': (0,),
+    'thu 3': (1,), 'thu ba': (1,), 't3': (1,), 'tue': (1,), 'tues': (1,), 'tuesday': (1,),
+    'thu 4': (2,), 'thu tu': (2,), 't4': (2,), 'wed': (2,), 'wednesday': (2,),
+    'thu 5': (3,), 'thu nam': (3,), 't5': (3,), 'thur': (3,), 'thurs': (3,), 'thursday': (3,),
+    'thu 6': (4,), 'thu sau': (4,), 't6': (4,), 'fri': (4,), 'friday': (4,),
+    'thu 7': (5,), 'thu bay': (5,), 't7': (5,), 'sat': (5,), 'saturday': (5,),
+    'chu nhat': (6,), 'cn': (6,), 'sun': (6,), 'sunday': (6,),
+    'cuoi tuan': (5, 6), 'weekend': (5, 6),
+}
+DAY_KEYS = {word.replace(' ', ''): days for word, days in DAY_WORDS.items()}
+CLAUSE_SPLIT = re.compile(r"[,;.\n]|(?<![a-zà-ỹ])(?:nhưng|but)(?![a-zà-ỹ])", re.IGNORECASE)
+
+
+def _phrases(words):
+    alternatives = '|'.join(re.escape(word).replace(r'\ ', r'\s*') for word in sorted(words, key=len, reverse=True))
+    return re.compile(rf"(?<![a-z0-9])(?:{alternatives})s?(?![a-z0-9])")
+
+
+NEGATIVE_PATTERN = _phrases(NEGATIVE_WORDS)
+POSITIVE_PATTERN = _phrases(POSITIVE_WORDS)
+WEEK_PATTERN = _phrases(WEEK_WORDS)
+DAY_PATTERN = _phrases(DAY_WORDS)
+ONLY_PATTERN = _phrases(ONLY_WORDS)
+DAY_RANGE_PATTERN = re.compile(rf"(?P<first>{DAY_PATTERN.pattern})\s*(?:-|–|~|den|toi|to|through)\s*"
+                               rf"(?P<last>{DAY_PATTERN.pattern})")
+CAP_PATTERN = re.compile(r"(?<![a-z])(?:toi da|max(?:imum)?|at most|khong qua|chi lam|only)\s*(\d{1,2})\s*"
+                         r"(?:ca|shifts?|buoi)(?![a-z])")
+
+
+def _days(phrase):
+    key = phrase.replace(' ', '')
+    return DAY_KEYS.get(key) or DAY_KEYS[key[:-1]]  # 'weekends', 'mondays'
+
+
+def _clause_days(clause):
+    """(weekdays a clause names, the clause without them); a range gives every day in between ('T6-T2' wraps)."""
+    days = set()
+
+    def expand(match):
+        first, last = _days(match.group('first')), _days(match.group('last'))
+        if len(first) == len(last) == 1:
+            days.update((first[0] + step) % 7 for step in range((last[0] - first[0]) % 7 + 1))
+        else:
+            days.update(first + last)
+        return ' '
+
+    rest = DAY_RANGE_PATTERN.sub(expand, clause)
+    days.update(day for match in DAY_PATTERN.finditer(rest) for day in _days(match.group()))
+    return days, DAY_PATTERN.sub(' ', rest)
+
+
+class NoteIntent(namedtuple('NoteIntent', 'week_off off_days blocked preferred_days preferred_shifts hours '
+                                          'max_shifts unparsed')):
+    """Constraints read from one note.
+
+    ``off_days`` / ``preferred_days`` are weekdays (0 = Thứ 2); ``blocked`` holds
+    (weekday or None for every day, shift) pairs; ``hours`` holds
+    (weekday or None, start, end) minute windows the employee works in;
+    ``max_shifts`` is a weekly cap or None; ``unparsed`` holds the clauses
+    that gave none of these, as written.
+    """
+    __slots__ = ()
+
+    @property
+    def understood(self):
+        return bool(self.week_off or self.off_days or self.blocked or self.preferred_days or self.preferred_shifts
+                    or self.hours or self.max_shifts is not None)
+
+    def fits(self, weekday, shift, interval):
+        """(allowed, partial) of ``shift`` (``interval`` in minutes) on ``weekday``."""
+        if self.week_off or weekday in self.off_days or (weekday, shift) in self.blocked or \
+                (None, shift) in self.blocked:
+            return False, False
+        windows = [(start, end) for day, start, end in self.hours if day is None or day == weekday]
+        if not windows:
+            return True, False
+        shifted = (interval[0] + DAY_MINUTES, interval[1] + DAY_MINUTES)
+        covered = max(max(_overlap(window, interval), _overlap(window, shifted)) for window in windows)
+        return covered > 0, 0 < covered < interval[1] - interval[0]
+
+    def preference(self, weekday, shift):
+        """Soft preference count: one for a preferred day, one for a preferred shift."""
+        return (weekday in self.preferred_days) + (shift in self.preferred_shifts)
+
+
+EMPTY_INTENT = NoteIntent(False, frozenset(), frozenset(), frozenset(), frozenset(), (), None, ())
+NoteConstraints = namedtuple('NoteConstraints', 'lookup partial preference caps')
+
+
+class NoteClassifier:
+    """Reads notes against the shifts of one ShiftModel; each distinct note is read once."""
+
+    def __init__(self, shift_model):
+        self.shift_model = shift_model
+        self._memo = {}  # chuỗi đã chuẩn hóa -> NoteIntent
+
+    def classify(self, note):
+        """NoteIntent of one note (EMPTY_INTENT for blank or non-text values)."""
+        if not isinstance(note, str) or not note.strip():
+            return EMPTY_INTENT
+        key = note.strip()
+        intent = self._memo.get(key)
+        if intent is None:
+            if len(self._memo) >= MEMO_SIZE:
+                self._memo.clear()
+            intent = self._memo[key] = self._read(key)
+        return intent
+
+    def _read(self, note):
+        week_off, cap = False, None
+        off_days, blocked, preferred_days, preferred_shifts, hours, unparsed = set(), set(), set(), set(), [], []
+        polarity = None
+        for raw_clause in CLAUSE_SPLIT.split(note):
+            clause = normalize_text(raw_clause)
+            if not clause:
+                continue
+            raw = unicodedata.normalize('NFC', raw_clause.lower())
+            negative = NEGATIVE_PATTERN.search(clause) or any(word in raw for word in RAW_NEGATIVE_WORDS)
+            explicit = 'negative' if negative else 'positive' if POSITIVE_PATTERN.search(clause) else None
+            days, rest = _clause_days(clause)
+            cap_match = CAP_PATTERN.search(rest)
+            if cap_match:
+                cap = int(cap_match.group(1))
+                rest = rest[:cap_match.start()] + ' ' + rest[cap_match.end():]
+            intervals = self.shift_model.tokenizer.tokenize_normalized(' '.join(rest.split())).intervals
+            shifts = self.shift_model.mentioned_shifts(rest)
+            only = explicit is None and ONLY_PATTERN.search(rest) is not None and RAW_ONLY_PATTERN.search(raw)
+            if explicit:
+                polarity = explicit
+            elif only or not (days or shifts) or not self._bare_list(rest):
+                polarity = None  # Chỉ mệnh đề liệt kê ngày/ca mới mang nghĩa của mệnh đề trước
+
+            understood = bool(cap_match)
+            if polarity == 'negative':
+                if shifts:
+                    blocked.update((day, shift) for day in (days or {None}) for shift in shifts)
+                elif days:
+                    off_days.update(days)
+                elif explicit and not cap_match:
+                    week_off = True  # 'nghỉ cả tuần', 'xin off': không nêu ngày là cả tuần
+                continue
+            if only and shifts and not intervals:  # 'thứ 3 chỉ làm ca 2': các ca khác bị chặn
+                others = [name for name in self.shift_model.names if name not in shifts]
+                blocked.update((day, shift) for day in (days or {None}) for shift in others)
+                understood = True
+            elif only and days and not intervals:  # 'chỉ làm T3, T5': các ngày khác nghỉ
+                off_days.update(set(range(7)) - days)
+                understood = True
+            if intervals:
+                hours.extend((day, start, end) for day in (sorted(days) or [None]) for start, end in intervals)
+                understood = True
+            if polarity == 'positive' and (days or shifts):
+                preferred_days.update(days)
+                preferred_shifts.update(shifts)
+                understood = True
+            if not understood:
+                unparsed.append(' '.join(raw_clause.split()))
+        if week_off and WEEK_PATTERN.search(normalize_text(note)) is None and (off_days or blocked):
+            week_off = False  # Đã có phạm vi ngày/ca ở mệnh đề khác
+        return NoteIntent(week_off, frozenset(off_days), frozenset(blocked), frozenset(preferred_days),
+                          frozenset(preferred_shifts), tuple(hours), cap, tuple(unparsed))
+
+    def _bare_list(self, rest):
+        """Whether a clause without its days names only shifts, times and list words ('T3', 'ca 2 và T4')."""
+        leftover = self.shift_model.tokenizer.tokenize_normalized(' '.join(rest.split())).rest
+        for pattern in self.shift_model.patterns.values():
+            if pattern is not None:
+                leftover = pattern.sub(' ', leftover)
+        return set(re.findall(r"[a-z0-9]+", leftover)) <= LIST_WORDS
+
+
+@lru_cache(maxsize=32)
+def note_classifier(shift_model):
+    """The NoteClassifier of ``shift_model`` (one per model, so its memo is shared)."""
+    return NoteClassifier(shift_model)
+
+
+def classify_notes(notes, shift_model=None):
+    """NoteIntent of every note, in order; each distinct note is read once."""
+    classifier = note_classifier(shift_model or get_shift_model())
+    codes, uniques = pd.factorize(pd.Series(notes, dtype=object), use_na_sentinel=False)
+    intents = [classifier.classify(note) for note in uniques]
+    return [intents[code] for code in codes]
+
+
+def note_intents(lookup_df, shift_model=None):
+    """{employee: NoteIntent} for the employees whose note says something the classifier understands."""
+    if lookup_df is None or lookup_df.empty or 'Note' not in lookup_df.columns:
+        return {}
+    notes = lookup_df.loc[~lookup_df['Employee'].duplicated(), ['Employee', 'Note']]
+    notes = notes[notes['Note'].notna()]
+    employees = notes['Employee'].astype(str).str.strip()
+    return {employee: intent for employee, intent in zip(employees, classify_notes(notes['Note'], shift_model))
+            if intent.understood}
+
+
+def apply_note_intents(lookup_df, intents, shift_model=None):
+    """Applies ``intents`` to an availability lookup.
+
+    Returns NoteConstraints: ``lookup`` is a copy whose Can_Work is cleared where
+    a note rules the slot out; ``partial`` holds the (employee, date, shift)
+    slots the employee can only work part of; ``preference`` maps slots to their
+    soft preference count; ``caps`` maps employees to a weekly shift cap.
+    """
+    if not intents or lookup_df is None or lookup_df.empty:
+        return NoteConstraints(lookup_df, frozenset(), {}, {})
+    model = shift_model or get_shift_model()
+    names = lookup_df['Employee'].astype(str).str.strip()
+    positions = np.flatnonzero(names.isin(list(intents)).to_numpy())  # Chỉ các dòng của người có ghi chú
+    rows = lookup_df.iloc[positions]
+    employees = names.iloc[positions].to_numpy(dtype=object)
+    days = pd.to_datetime(rows['Date'])
+    dates = days.dt.date.to_numpy(dtype=object)  # Khóa ô theo datetime.date như bộ giải
+    weekdays = days.dt.weekday.to_numpy()
+    shifts = rows['Shift'].to_numpy(dtype=object)
+    can_work = (lookup_df['Can_Work'] == True).to_numpy(dtype=bool, copy=True)
+    partial, preference = set(), {}
+    for index, position in enumerate(positions):
+        employee, shift = employees[index], shifts[index]
+        interval = model.intervals.get(shift)
+        if interval is None:
+            continue
+        intent = intents[employee]
+        allowed, is_partial = intent.fits(weekdays[index], shift, interval)
+        if not allowed:
+            can_work[position] = False
+            continue
+        slot = (employee, dates[index], shift)
+        if is_partial and can_work[position]:
+            partial.add(slot)
+        score = intent.preference(weekdays[index], shift)
+        if score:
+            preference[slot] = score
+    lookup = lookup_df.assign(Can_Work=can_work)
+    caps = {employee: intent.max_shifts for employee, intent in intents.items() if intent.max_shifts is not None}
+    return NoteConstraints(lookup, frozenset(partial), preference, caps)
+
+
+def _clock_text(minutes):
+    minutes %= DAY_MINUTES
+    return f"{minutes // 60}h{minutes % 60:02d}" if minutes % 60 else f"{minutes // 60}h"
+
+
+def _window_text(start, end):
+    if end == DAY_MINUTES:
+        return f"từ {_clock_text(start)}"
+    if start == 0:
+        return f"đến {_clock_text(end)}"
+    return f"{_clock_text(start)}-{_clock_text(end)}"
+
+
+def describe_intent(intent):
+    """Short Vietnamese summary of the soft part of ``intent`` (week off, off days and blocks are left out)."""
+    parts = []
+    if intent.preferred_days or intent.preferred_shifts:
+        wanted = [DAY_ABBREVIATIONS[day] for day in sorted(intent.preferred_days)] + sorted(intent.preferred_shifts)
+        parts.append("ưu tiên " + ", ".join(wanted))
+    if intent.hours:
+        windows = ", ".join(_window_text(start, end) + (f" {DAY_ABBREVIATIONS[day]}" if day is not None else "")
+                            for day, start, end in intent.hours)
+        parts.append(f"chỉ làm {windows}")
+    if intent.max_shifts is not None:
+        parts.append(f"tối đa {intent.max_shifts} ca/tuần")
+    return "; ".join(parts)
+
+
+def prompt_notes(lookup_df, intents):
+    """{employee: note text for the prompt}.
+
+    Understood notes give their soft part plus the clauses the classifier did
+    not read, verbatim; other notes are sent as written.
+    """
+    if lookup_df is None or lookup_df.empty or 'Note' not in lookup_df.columns:
+        return {}
+    rows = lookup_df.drop_duplicates('Employee')
+    notes = {}
+    for employee, note in zip(rows['Employee'], rows['Note']):
+        intent = intents.get(str(employee).strip())
+        if intent is None:
+            notes[employee] = note
+        else:
+            notes[employee] = "; ".join(part for part in (describe_intent(intent), *intent.unparsed) if part)
+    return notes
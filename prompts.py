@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Compact prompt building blocks for the scheduling prompt.
+
+Instead of 9+ verbose lines per employee, the compact format sends one row per
+employee of a pre-normalized availability matrix (built from the lookup table of
+``preprocess_pasted_data_for_lookup``) and lists notes only where they exist.
+"""
+import math
+import re
+
+import numpy as np
+import pandas as pd
+
+from availability import AvailabilityMatrix
+
+DAY_ABBREVIATIONS = ["T2", "T3", "T4", "T5", "T6", "T7", "CN"]
+OFF_CODE = "-"
+TOKEN_PIECE = re.compile(r"\w+|[^\w\s]")
+CODE_ALPHABET = "123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def shift_code(shift_name):
+    """Short code of a shift in the matrix: 'Ca 1' -> '1'."""
+    return str(shift_name).replace("Ca", "").strip() or str(shift_name)
+
+
+def shift_codes(shift_names):
+    """One-character codes for the matrix cells: 'Ca N' -> 'N' when that is unambiguous, else 1-9 then A-Z."""
+    codes = [shift_code(name) for name in shift_names]
+    if all(len(code) == 1 for code in codes) and len(set(codes)) == len(codes):
+        return codes
+    return list(CODE_ALPHABET[:len(shift_names)])
+
+
+def compact_availability_block(lookup_df, shift_names, notes=None):
+    """Renders the availability lookup as a 'Tên|T2|...|CN' matrix plus a notes section.
+
+    Each cell lists the codes of the shifts the employee can work that day
+    ('12' = Ca 1 and Ca 2, '-' = off; see shift_codes). Employees keep their roster order.
+    ``notes`` ({employee: text}) replaces the raw Note column, e.g. with the part
+    of each note the matrix does not already encode.
+    """
+    if lookup_df is None or lookup_df.empty:
+        return "(Không có dữ liệu đăng ký)"
+    matrix = AvailabilityMatrix.from_lookup(lookup_df)
+    cells = np.full(matrix.can_work.shape[:2], "", dtype=object)
+    for shift, code in zip(shift_names, shift_codes(shift_names)):
+        if shift in matrix.shifts:
+            cells = cells + np.where(matrix.can_work[:, :, matrix.shifts.index(shift)], code, "")
+    cells[cells == ""] = OFF_CODE
+
+    header = "Tên|" + "|".join(DAY_ABBREVIATIONS[day.weekday()] for day in matrix.day_dates())
+    lines = [header] + [f"{name}|" + "|".join(row) for name, row in zip(matrix.employees, cells)]
+
+    if notes is None:
+        notes = dict(zip(matrix.employees, matrix.notes))
+    notes = {name: str(note).strip() for name, note in notes.items() if pd.notna(note) and str(note).strip()}
+    if notes:
+        lines.append("Ghi chú (chỉ nhân viên có ghi chú):")
+        lines.extend(f"{name}: {note}" for name, note in notes.items())
+    return "\n".join(lines)
+
+
+def estimate_tokens(text):
+    """Rough, offline token estimate (words and punctuation x 1.3 for Vietnamese sub-word splits)."""
+    return math.ceil(len(TOKEN_PIECE.findall(str(text))) * 1.3)
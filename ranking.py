@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Ranks replacement candidates for each (date, shift) of the schedule being edited.
+
+Scores read the running counters of a ``ScheduleValidator`` (weekly load,
+shifts per day, worked days) plus the availability index and the notes, so a
+ranking never scans the schedule. All slots are ranked once up front; after an
+edit only the slots of the affected employees within reach of the edited day
+(same week or a consecutive-day run) are re-ranked, lazily on the next lookup.
+"""
+from datetime import timedelta
+
+from solver import _is_excluded, _week_key
+
+# Điểm phạt cho các trường hợp sẽ gây vi phạm ràng buộc nếu được chọn
+BLOCKED_PENALTY = 100
+CAP_PENALTY = 50
+LOAD_WEIGHT = 10
+NOTE_WEIGHT = 10
+
+
+class CandidateRanker:
+    """Keeps a best-first candidate list per slot, invalidated by validator edits."""
+
+    def __init__(self, validator, availability_index, notes=None, preference_weight=0.7):
+        self.validator = validator
+        self.slots = availability_index['slots']
+        shift_model = validator.shift_model
+        # Ca mà ghi chú nhắc tới (từ khóa, giờ, khoảng giờ), đọc một lần cho mỗi nhân viên
+        self.note_shifts = {name: shift_model.mentioned_shifts(note) for name, note in (notes or {}).items()
+                            if isinstance(note, str) and note.strip()}
+        self.preference_weight = float(preference_weight)
+        self.horizon = max(6, validator.max_consecutive)  # Khoảng ngày một chỉnh sửa có thể ảnh hưởng
+        self._slots_by_employee = {}
+        for slot, names in self.slots.items():
+            for name in names:
+                self._slots_by_employee.setdefault(name, []).append(slot)
+        self._ranked = {}  # (date, shift) -> tuple of (name, score, reasons), best first
+        validator.listeners.append(self._on_cell_change)
+        for day, shift in self.slots:
+            self.rank(day, shift)
+
+    def rank(self, day, shift):
+        """Candidates registered for the slot, best first (ties broken by name)."""
+        slot = (day, shift)
+        if slot not in self._ranked:
+            scored = [(name, *self.score(name, day, shift)) for name in self.slots.get(slot, ())]
+            scored.sort(key=lambda item: (-item[1], item[0]))
+            self._ranked[slot] = tuple(scored)
+        return self._ranked[slot]
+
+    def ranked_names(self, day, shift):
+        return tuple(name for name, _, _ in self.rank(day, shift))
+
+    def labels(self, day, shift):
+        """Dropdown labels: name, weekly load and a warning mark when picking the person would break a rule."""
+        return {name: f"{name} ({reasons[0]}){' ⚠️' if score < 0 else ''}" for name, score, reasons in self.rank(day, shift)}
+
+    def score(self, employee, day, shift):
+        """Returns (score, reasons); higher is better."""
+        validator = self.validator
+        today = validator.by_day.get((employee, day), [])
+        in_slot = shift in today  # Đang được xếp vào chính ca này: không tính ca này vào tải
+        load = validator.by_week.get((employee, _week_key(day)), 0) - in_slot
+        day_count = len(today) - in_slot
+        score, reasons = LOAD_WEIGHT * (validator.week_target - load), [f"{load}/{validator.week_target} ca tuần"]
+
+        if _is_excluded(employee):
+            score -= BLOCKED_PENALTY
+            reasons.append("FM/Sup")
+        if day_count >= validator.max_per_day:
+            score -= BLOCKED_PENALTY
+            reasons.append("đã làm ca khác trong ngày")
+        if load >= validator.week_target:
+            score -= CAP_PENALTY
+            reasons.append("đã đủ ca tuần")
+        if not today and self._streak_with(employee, day) > validator.max_consecutive:
+            score -= CAP_PENALTY
+            reasons.append(f"quá {validator.max_consecutive} ngày liên tiếp")
+
+        note_shifts = self.note_shifts.get(employee)
+        if note_shifts:
+            if shift in note_shifts:
+                score += NOTE_WEIGHT * self.preference_weight
+                reasons.append("ghi chú hợp ca")
+            else:
+                score -= NOTE_WEIGHT * self.preference_weight
+                reasons.append("ghi chú muốn ca khác")
+        return score, reasons
+
+    def _streak_with(self, employee, day):
+        """Length of the run ``day`` would join, walked at most max_consecutive days each way."""
+        worked = self.validator.days.get(employee, set())
+        streak = 1
+        for step in (-1, 1):
+            probe = day + timedelta(days=step)
+            while probe in worked and streak <= self.validator.max_consecutive:
+                streak += 1
+                probe += timedelta(days=step)
+        return streak
+
+    def detach(self):
+        """Stops following the validator (when the ranker is replaced)."""
+        if self._on_cell_change in self.validator.listeners:
+            self.validator.listeners.remove(self._on_cell_change)
+
+    def _on_cell_change(self, day, employees):
+        for employee in employees:
+            for slot in self._slots_by_employee.get(employee, ()):
+                if abs((slot[0] - day).days) <= self.horizon:
+                    self._ranked.pop(slot, None)
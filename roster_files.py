@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""Reading registration exports (XLSX / CSV / TSV files) instead of a pasted table.
+
+A file is parsed once: the header row is found on a small sample (the first
+HEADER_SAMPLE_ROWS rows, so title lines above the header are fine), then only
+the columns the scheduler reads (name, week, store, the seven day columns and
+notes) are loaded. CSV goes through the pyarrow engine and Excel through
+calamine when they are installed, otherwise pandas' default engines. The result
+has the same columns and cleaning as ``scheduler.read_registration_table``, and
+``file_hash`` gives the key under which callers cache it.
+"""
+import csv
+import hashlib
+import importlib.util
+import io
+import itertools
+import os
+
+import pandas as pd
+
+from availability import find_day_columns, find_employee_column, find_note_column, find_week_column
+from batch import find_store_column
+from scheduler import PREDEFINED_COLUMNS, RosterFormatError, ignore
+
+CSV_EXTENSIONS = ('.csv', '.tsv', '.txt')
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm', '.xls')
+UPLOAD_EXTENSIONS = CSV_EXTENSIONS + EXCEL_EXTENSIONS
+HEADER_SAMPLE_ROWS = 10
+SNIFF_BYTES = 64 * 1024
+TEXT_ENCODINGS = ('utf-8-sig', 'cp1258')  # Xuất từ Excel tiếng Việt trên Windows
+
+
+def file_hash(data):
+    """SHA-256 of the file bytes (cache key of the parsed table)."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _csv_engine():
+    return 'pyarrow' if importlib.util.find_spec('pyarrow') is not None else 'c'
+
+
+def _excel_engine():
+    if importlib.util.find_spec('python_calamine') is not None:
+        return 'calamine'
+    return None  # pandas chọn theo phần mở rộng (openpyxl cho .xlsx, xlrd cho .xls)
+
+
+def _probe(header):
+    labels = ['' if pd.isna(cell) else str(cell).strip() for cell in header]
+    return labels, pd.DataFrame(columns=pd.Index(labels, dtype=object))
+
+
+def find_header_row(sample):
+    """Index of the first sample row with an employee-name column and at least one day column, or None."""
+    for position, row in enumerate(sample.itertuples(index=False)):
+        if not any('tên' in str(cell).lower() for cell in row):
+            continue  # Dòng dữ liệu: bỏ qua trước khi dựng bảng thử
+        _, probe = _probe(row)
+        if find_employee_column(probe) is not None and find_day_columns(probe):
+            return position
+    return None
+
+
+def needed_columns(header):
+    """Positions of the header cells the scheduler reads: name, week, store, day columns and notes."""
+    labels, probe = _probe(header)
+    wanted = {find_employee_column(probe), find_week_column(probe), find_note_column(probe),
+              find_store_column(probe), *find_day_columns(probe).values()}
+    wanted.discard(None)
+    return [position for position, label in enumerate(labels) if label and label in wanted]
+
+
+def _layout(sample, notify):
+    """(header row index or None, column positions, column names) from the sample."""
+    header_row = find_header_row(sample)
+    if header_row is None:
+        notify("Không thấy dòng tiêu đề trong tệp, dùng tên cột mặc định.", "ℹ️")
+        count = min(sample.shape[1], len(PREDEFINED_COLUMNS))
+        return None, list(range(count)), PREDEFINED_COLUMNS[:count]
+    header = sample.iloc[header_row].tolist()
+    positions = needed_columns(header)
+    if not positions:
+        raise RosterFormatError("Tệp không có cột tên nhân viên / ngày trong tuần.")
+    notify(f"Đã đọc tiêu đề ở dòng {header_row + 1}, lấy {len(positions)}/{len(header)} cột cần thiết.", "ℹ️")
+    return header_row, positions, [str(header[position]).strip() for position in positions]
+
+
+def _finish(df_raw, first_row, names):
+    df_input = df_raw.iloc[first_row:]
+    df_input.columns = names
+    df_input.dropna(axis=0, how='all', inplace=True)
+    df_input.dropna(axis=1, how='all', inplace=True)
+    return df_input.reset_index(drop=True)
+
+
+def _decode_sample(data):
+    for encoding in TEXT_ENCODINGS:
+        try:
+            return data[:SNIFF_BYTES].decode(encoding), encoding
+        except UnicodeDecodeError as e:
+            if e.start >= SNIFF_BYTES - 4:  # Ký tự nhiều byte bị cắt ở cuối mẫu
+                return data[:e.start].decode(encoding), encoding
+    raise RosterFormatError("Không đọc được bảng mã của tệp (cần UTF-8).")
+
+
+def _separator(text):
+    """Tab, ';' or ',' when every sample line has the same number of them, else csv.Sniffer's guess."""
+    lines = [line for line in text.splitlines()[:HEADER_SAMPLE_ROWS] if line.strip()]
+    for candidate in ('\t', ';', ','):
+        counts = {line.count(candidate) for line in lines}
+        if len(counts) == 1 and counts != {0}:
+            return candidate
+    try:
+        return csv.Sniffer().sniff('\n'.join(lines), delimiters='\t,;').delimiter
+    except csv.Error:
+        return '\t' if any('\t' in line for line in lines) else ','
+
+
+def _csv_sample(text, sep):
+    """First HEADER_SAMPLE_ROWS records as a DataFrame; rows may have any number of cells (title lines)."""
+    try:
+        rows = list(itertools.islice(csv.reader(io.StringIO(text), delimiter=sep, skipinitialspace=True),
+                                     HEADER_SAMPLE_ROWS))
+    except csv.Error as e:
+        raise RosterFormatError(f"Không đọc được tệp CSV: {e}") from None
+    return pd.DataFrame([[cell or None for cell in row] for row in rows], dtype=object)
+
+
+def read_csv_roster(data, notify=ignore):
+    """Reads a CSV/TSV export (separator and encoding detected on the sample).
+
+    Lines above the header row are skipped, so they may have any number of cells.
+    """
+    text, encoding = _decode_sample(data)
+    sep = _separator(text)
+    header_row, positions, names = _layout(_csv_sample(text, sep), notify)
+    skip = header_row + 1 if header_row is not None else 0
+    options = dict(sep=sep, header=None, skiprows=skip, usecols=positions, dtype=str, encoding=encoding)
+    if encoding == 'utf-8-sig' and _csv_engine() == 'pyarrow':
+        try:
+            df_raw = pd.read_csv(io.BytesIO(data), engine='pyarrow', **options)
+        except ValueError:  # Dòng lệch số cột, xuống dòng trong ô...: đọc lại bằng engine C
+            pass
+        else:
+            for column in df_raw.columns:
+                df_raw[column] = df_raw[column].str.lstrip()  # pyarrow không có skipinitialspace
+            return _finish(df_raw, 0, names)
+    try:
+        df_raw = pd.read_csv(io.BytesIO(data), skipinitialspace=True, **options)
+    except ValueError as e:  # ParserError (dòng lệch số cột) hoặc cột ngoài bảng
+        raise RosterFormatError(f"Tệp có dòng không đúng số cột: {e}") from None
+    return _finish(df_raw, 0, names)
+
+
+def read_excel_roster(data, notify=ignore):
+    """Reads the first sheet of an Excel export; the workbook is opened once for the sample and the data."""
+    with pd.ExcelFile(io.BytesIO(data), engine=_excel_engine()) as workbook:
+        sample = workbook.parse(0, header=None, nrows=HEADER_SAMPLE_ROWS, dtype=str)
+        header_row, positions, names = _layout(sample, notify)
+        df_raw = workbook.parse(0, header=None, usecols=positions, dtype=str)
+    return _finish(df_raw, header_row + 1 if header_row is not None else 0, names)
+
+
+def read_registration_file(data, file_name, notify=ignore):
+    """Reads an uploaded registration export (bytes) by extension; raises RosterFormatError when unsupported."""
+    extension = os.path.splitext(str(file_name).lower())[1]
+    if extension in EXCEL_EXTENSIONS:
+        df_input = read_excel_roster(data, notify)
+    elif extension in CSV_EXTENSIONS:
+        df_input = read_csv_roster(data, notify)
+    else:
+        raise RosterFormatError(f"Định dạng tệp không hỗ trợ: '{extension}' (dùng {', '.join(UPLOAD_EXTENSIONS)}).")
+    if df_input.empty:
+        raise RosterFormatError("Tệp không có dòng đăng ký nào.")
+    return df_input
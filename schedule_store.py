@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""Local SQLite store for rosters, availability lookups and schedule versions.
+
+Nothing here imports Streamlit, so a refresh or a restarted container can
+reload a week's work without another AI run, and scripts can read the history.
+Tables:
+
+* ``rosters``: pasted registration tables, de-duplicated by content hash;
+* ``lookups``: availability lookup per roster and shift configuration;
+* ``schedules``: every generated or edited schedule of a (week, label), numbered
+  1, 2, ... per week, as the 3-column schedule plus the display table.
+
+DataFrames are stored as JSON (``orient="split"``). Each operation opens its own
+connection, so one store can be shared across Streamlit sessions and threads.
+"""
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from datetime import timedelta
+
+import pandas as pd
+
+from availability import LOOKUP_COLUMNS, compact_lookup, empty_lookup
+from schedule_table import SCHEDULE_COLUMNS
+
+KIND_GENERATED = "generated"
+KIND_EDITED = "edited"
+HISTORY_COLUMNS = ["id", "week", "label", "version", "kind", "engine", "created", "roster_id"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rosters (
+    id INTEGER PRIMARY KEY,
+    content_hash TEXT NOT NULL UNIQUE,
+    week TEXT,
+    label TEXT NOT NULL DEFAULT '',
+    created REAL NOT NULL,
+    roster_json TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lookups (
+    roster_id INTEGER NOT NULL REFERENCES rosters(id),
+    shifts_key TEXT NOT NULL,
+    lookup_json TEXT NOT NULL,
+    PRIMARY KEY (roster_id, shifts_key)
+);
+CREATE TABLE IF NOT EXISTS schedules (
+    id INTEGER PRIMARY KEY,
+    roster_id INTEGER REFERENCES rosters(id),
+    week TEXT NOT NULL,
+    label TEXT NOT NULL DEFAULT '',
+    version INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    engine TEXT,
+    created REAL NOT NULL,
+    schedule_json TEXT NOT NULL,
+    table_json TEXT
+);
+CREATE INDEX IF NOT EXISTS schedules_by_week ON schedules (week, label, version);
+"""
+
+
+def week_key(week):
+    """'YYYY-MM-DD' of the Monday of ``week`` (date, Timestamp or string), or None."""
+    if week is None or (not isinstance(week, str) and pd.isna(week)):
+        return None
+    day = pd.Timestamp(week)
+    return (day - timedelta(days=day.weekday())).strftime('%Y-%m-%d')
+
+
+def _frame_to_json(df):
+    return df.to_json(orient="split", index=False, date_format="iso", force_ascii=False)
+
+
+def _frame_from_json(text):
+    if not text:
+        return None
+    return pd.read_json(io.StringIO(text), orient="split", dtype=False, convert_dates=False)
+
+
+def _lookup_from_json(text):
+    lookup_df = _frame_from_json(text)
+    if lookup_df is None or lookup_df.empty:
+        return empty_lookup()
+    return compact_lookup(lookup_df.reindex(columns=LOOKUP_COLUMNS))
+
+
+def _schedule_from_json(text):
+    schedule_df = _frame_from_json(text)
+    if schedule_df is None or schedule_df.empty:
+        return pd.DataFrame(columns=SCHEDULE_COLUMNS)
+    schedule_df['Ngày'] = pd.to_datetime(schedule_df['Ngày'])
+    return schedule_df
+
+
+class ScheduleStore:
+    """SQLite-backed history of rosters and schedules (see the module docstring)."""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """One short-lived connection per operation; commits on success."""
+        with closing(sqlite3.connect(self.path, timeout=10)) as connection:
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            with connection:
+                yield connection
+
+    # --- Rosters and lookups ---
+    def save_roster(self, df_input, week=None, label=""):
+        """Stores a pasted registration table (once per distinct content); returns its id."""
+        roster_json = _frame_to_json(df_input)
+        content_hash = hashlib.sha256(f"{label}\n{roster_json}".encode("utf-8")).hexdigest()
+        with self._connect() as connection:
+            connection.execute("INSERT OR IGNORE INTO rosters (content_hash, week, label, created, roster_json) "
+                               "VALUES (?, ?, ?, ?, ?)", (content_hash, week_key(week), label, time.time(), roster_json))
+            return connection.execute("SELECT id FROM rosters WHERE content_hash = ?", (content_hash,)).fetchone()[0]
+
+    def load_roster(self, roster_id):
+        """The registration table of ``roster_id`` (None if unknown)."""
+        with self._connect() as connection:
+            row = connection.execute("SELECT roster_json FROM rosters WHERE id = ?", (roster_id,)).fetchone()
+        return _frame_from_json(row["roster_json"]) if row else None
+
+    def save_lookup(self, roster_id, shifts_key, lookup_df):
+        """Stores the availability lookup of a roster for one shift configuration."""
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO lookups (roster_id, shifts_key, lookup_json) VALUES (?, ?, ?)",
+                               (roster_id, shifts_key, _frame_to_json(lookup_df)))
+
+    def load_lookup(self, roster_id, shifts_key):
+        """The stored lookup for (roster, shift configuration), or None when it was never built."""
+        with self._connect() as connection:
+            row = connection.execute("SELECT lookup_json FROM lookups WHERE roster_id = ? AND shifts_key = ?",
+                                     (roster_id, shifts_key)).fetchone()
+        return _lookup_from_json(row["lookup_json"]) if row else None
+
+    # --- Schedule versions ---
+    def save_schedule(self, week, schedule_df, table_df=None, roster_id=None, kind=KIND_GENERATED, engine=None,
+                      label=""):
+        """Appends a version of the (week, label) schedule; returns (schedule id, version number)."""
+        week = week_key(week)
+        with self._connect() as connection:
+            # Take the write lock before reading MAX(version) so concurrent saves get distinct versions
+            connection.execute("BEGIN IMMEDIATE")
+            version = connection.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM schedules WHERE week = ? AND label = ?",
+                                         (week, label)).fetchone()[0]
+            cursor = connection.execute(
+                "INSERT INTO schedules (roster_id, week, label, version, kind, engine, created, schedule_json, table_json) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (roster_id, week, label, version, kind, engine, time.time(), _frame_to_json(schedule_df),
+                 _frame_to_json(table_df) if table_df is not None else None))
+            return cursor.lastrowid, version
+
+    def history(self, week=None, label=None, limit=50):
+        """Stored versions, newest first, as a DataFrame with HISTORY_COLUMNS."""
+        query, params = f"SELECT {', '.join(HISTORY_COLUMNS)} FROM schedules", []
+        conditions = [(column, value) for column, value in (("week", week_key(week)), ("label", label))
+                      if value is not None]
+        if conditions:
+            query += " WHERE " + " AND ".join(f"{column} = ?" for column, _ in conditions)
+            params = [value for _, value in conditions]
+        query += " ORDER BY created DESC, id DESC LIMIT ?"
+        with self._connect() as connection:
+            rows = connection.execute(query, params + [limit]).fetchall()
+        return pd.DataFrame([tuple(row) for row in rows], columns=HISTORY_COLUMNS)
+
+    def load_schedule(self, schedule_id):
+        """One stored version: dict with its metadata, 'schedule' (3 columns) and 'table' (display, or None)."""
+        with self._connect() as connection:
+            row = connection.execute("SELECT * FROM schedules WHERE id = ?", (schedule_id,)).fetchone()
+        if row is None:
+            return None
+        record = {column: row[column] for column in HISTORY_COLUMNS}
+        record["schedule"] = _schedule_from_json(row["schedule_json"])
+        record["table"] = _frame_from_json(row["table_json"])
+        return record
+
+    def latest_schedule(self, week, label="", before=False):
+        """Newest version of ``week`` (or, with ``before``, of the most recent earlier week); None if none."""
+        week = week_key(week)
+        condition = "week < ?" if before else "week = ?"
+        with self._connect() as connection:
+            row = connection.execute(f"SELECT id FROM schedules WHERE {condition} AND label = ? "
+                                     "ORDER BY week DESC, version DESC LIMIT 1", (week, label)).fetchone()
+        return self.load_schedule(row["id"]) if row else None
+
+    def previous_week_start(self, week, label=""):
+        """Monday of the most recent stored week before ``week`` (None if there is none)."""
+        with self._connect() as connection:
+            return connection.execute("SELECT MAX(week) FROM schedules WHERE week < ? AND label = ?",
+                                      (week_key(week), label)).fetchone()[0]
+
+    def previous_week(self, week, shifts_key, label=""):
+        """Last stored schedule before ``week`` with the lookup it was built from, for warm starts.
+
+        Returns (record, lookup DataFrame) or None when there is no earlier
+        schedule or its roster was never processed with these shifts.
+        """
+        record = self.latest_schedule(week, label, before=True)
+        if record is None or record["roster_id"] is None:
+            return None
+        lookup_df = self.load_lookup(record["roster_id"], shifts_key)
+        return (record, lookup_df) if lookup_df is not None and not lookup_df.empty else None
+
+
+def shifts_key(requirements):
+    """Stable key of the shift configuration of ``requirements`` (the lookup depends on it)."""
+    return json.dumps(requirements["shifts_definition"], ensure_ascii=False, sort_keys=True, default=list)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Helpers for the 3-column schedule table (Ngày / Ca / Nhân viên được phân công)."""
+import json
+import re
+from datetime import datetime
+
+import pandas as pd
+
+STAFF_COLUMN = "Nhân viên được phân công"
+SCHEDULE_COLUMNS = ["Ngày", "Ca", STAFF_COLUMN]
+DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%Y/%m/%d', '%d-%m-%Y', '%m-%d-%Y']
+SEPARATOR_CELL = re.compile(r'^:?-{2,}:?$')
+
+# Schema for the structured (JSON) output mode, passed as generation_config["response_schema"]
+SCHEDULE_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "schedule": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "date": {"type": "string", "description": "YYYY-MM-DD"},
+                    "shift": {"type": "string"},
+                    "employees": {"type": "array", "items": {"type": "string"}},
+                    "missing": {"type": "integer", "description": "Số người còn thiếu so với yêu cầu"},
+                },
+                "required": ["date", "shift", "employees"],
+            },
+        },
+        "notes": {"type": "string"},
+    },
+    "required": ["schedule"],
+}
+
+
+def split_staff(cell):
+    """Splits a comma-separated staff cell into stripped, non-empty names."""
+    if cell is None or (not isinstance(cell, str) and pd.isna(cell)):
+        return []
+    return [name.strip() for name in str(cell).split(',') if name.strip()]
+
+
+def build_assignment_index(schedule_df):
+    """Maps (date, shift) to the tuple of names assigned in the schedule.
+
+    Like the old per-cell filters, only the first row of a duplicated
+    (date, shift) pair is used.
+    """
+    if schedule_df is None or schedule_df.empty or 'Ngày' not in schedule_df.columns:
+        return {}
+    dates = pd.to_datetime(schedule_df['Ngày'], errors='coerce')
+    staff = schedule_df[STAFF_COLUMN] if STAFF_COLUMN in schedule_df.columns else pd.Series('', index=schedule_df.index)
+    table = pd.DataFrame({'Date': dates, 'Ca': schedule_df['Ca'], 'Staff': staff}).dropna(subset=['Date', 'Ca'])
+    table = table.drop_duplicates(subset=['Date', 'Ca'], keep='first')
+    return {(day.date(), shift): tuple(split_staff(cell))
+            for day, shift, cell in zip(table['Date'], table['Ca'], table['Staff'])}
+
+
+def parse_schedule_date(text):
+    """Parses a date cell from the AI table; returns a Timestamp or None."""
+    value = str(text).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return pd.Timestamp(datetime.strptime(value, fmt))
+        except ValueError:
+            continue
+    return None
+
+
+class IncrementalScheduleParser:
+    """Parses markdown schedule rows as streamed text arrives.
+
+    ``feed`` only consumes complete lines, so a stream cut off mid-row still
+    yields every row received up to that point.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self.rows = []
+
+    def feed(self, text):
+        """Adds a chunk of streamed text; returns the number of new schedule rows parsed."""
+        self._buffer += text or ""
+        *lines, self._buffer = self._buffer.split("\n")
+        return sum(self._parse_line(line) for line in lines)
+
+    def finish(self):
+        """Parses the final line if the stream ended without a newline."""
+        line, self._buffer = self._buffer, ""
+        return self._parse_line(line)
+
+    def _parse_line(self, line):
+        line = line.strip()
+        if not line.startswith("|"):
+            return 0
+        cells = [cell.strip() for cell in line.strip("|").split("|")]
+        if len(cells) < 2 or all(SEPARATOR_CELL.match(cell) for cell in cells if cell):
+            return 0
+        day = parse_schedule_date(cells[0])
+        if day is None:  # Dòng tiêu đề hoặc ngày không hợp lệ
+            return 0
+        self.rows.append((day, cells[1], cells[2] if len(cells) > 2 else ""))
+        return 1
+
+    def to_dataframe(self):
+        """Rows received so far as the 3-column schedule DataFrame."""
+        df_schedule = pd.DataFrame(self.rows, columns=SCHEDULE_COLUMNS)
+        df_schedule["Ngày"] = pd.to_datetime(df_schedule["Ngày"])
+        return df_schedule
+
+
+def parse_schedule_json(response_text):
+    """Parses a schema-constrained JSON response into the 3-column schedule DataFrame.
+
+    Dates must be ISO (YYYY-MM-DD) and are converted in one vectorized call; a shortfall
+    in ``missing`` becomes the usual '(Thiếu N người)' marker. The optional free-text
+    ``notes`` are kept in ``DataFrame.attrs['notes']``. Raises ValueError when the
+    payload does not match the schema.
+    """
+    payload = json.loads(response_text)
+    entries = payload.get("schedule") if isinstance(payload, dict) else payload
+    if not isinstance(entries, list):
+        raise ValueError("JSON response has no 'schedule' array")
+    rows = []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            raise ValueError(f"Invalid schedule entry: {entry!r}")
+        staff = [str(name).strip() for name in entry.get("employees") or [] if str(name).strip()]
+        missing = int(entry.get("missing") or 0)
+        if missing > 0:
+            staff.append(f"(Thiếu {missing} người)")
+        rows.append((entry.get("date"), str(entry.get("shift", "")).strip(), ", ".join(staff)))
+    df_schedule = pd.DataFrame(rows, columns=SCHEDULE_COLUMNS)
+    df_schedule["Ngày"] = pd.to_datetime(df_schedule["Ngày"], format="%Y-%m-%d", errors="coerce")
+    df_schedule = df_schedule.dropna(subset=["Ngày"]).reset_index(drop=True)
+    if isinstance(payload, dict) and payload.get("notes"):
+        df_schedule.attrs["notes"] = str(payload["notes"])
+    return df_schedule
@@ -0,0 +1,762 @@
+# -*- coding: utf-8 -*-
+"""Headless scheduling API: reading registrations, building prompts, generating and parsing schedules.
+
+Nothing here imports Streamlit or reads secrets, so the functions can be used
+from batch jobs and ``cli.py``. ``app.py`` wraps them with toasts and error
+boxes. Progress messages go through an optional ``notify(message, icon)``
+callback. Errors that the UI reports as critical are raised as
+RosterFormatError / ScheduleParseError.
+"""
+import io
+import re
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from ai_cache import make_cache_key
+from availability import (build_availability_lookup, empty_lookup, find_day_columns, find_employee_column,
+                          find_note_column, find_week_column, parse_week_start)
+from call_policy import BreakerRegistry, CallPolicy, call_with_policy
+from employee_registry import EmployeeRegistry
+from instrumentation import span_or_null
+from note_intents import apply_note_intents, note_intents, prompt_notes
+from prompts import DAY_ABBREVIATIONS, compact_availability_block, estimate_tokens, shift_codes
+from schedule_table import SCHEDULE_JSON_SCHEMA, STAFF_COLUMN, parse_schedule_json
+from shifts import DEFAULT_SHIFTS_DEFINITION, DISPLAY_SLOTS, shift_model
+from solver import solve_schedule
+
+# Generation config for Google Generative AI
+generation_config = {"temperature": 0.7, "top_p": 1, "top_k": 1, "max_output_tokens": 4096}
+MODEL_NAME = "gemini-1.5-flash"
+FALLBACK_MODEL_NAMES = ["gemini-1.5-flash-8b", "gemini-2.0-flash"]  # Thử theo thứ tự khi model chính lỗi
+
+# Structured output mode: schema-constrained JSON instead of a markdown table
+JSON_GENERATION_CONFIG = {"response_mime_type": "application/json", "response_schema": SCHEDULE_JSON_SCHEMA}
+OUTPUT_JSON = "JSON có cấu trúc"
+OUTPUT_MARKDOWN = "Bảng Markdown"
+
+# Constraints used when the caller does not pass its own (same defaults as the sidebar)
+DEFAULT_REQUIREMENTS = {
+    "shifts_definition": DEFAULT_SHIFTS_DEFINITION,
+    "max_shifts_per_day": 1,
+    "shifts_per_week_target": 4,
+    "min_rest_hours": 8,
+    "max_consecutive_days": 6,
+    "preferences_weight_hint": 0.7,
+}
+
+# --- Define Predefined Column Names ---
+PREDEFINED_COLUMNS = [
+    "Tên nhân viên:",
+    "Đăng kí ca cho tuần:",
+    "bạn có thể làm việc thời gian nào? [Thứ 2]",
+    "bạn có thể làm việc thời gian nào? [Thứ 3]",
+    "bạn có thể làm việc thời gian nào? [Thứ 4]",
+    "bạn có thể làm việc thời gian nào? [Thứ 5]",
+    "bạn có thể làm việc thời gian nào? [Thứ 6]",
+    "bạn có thể làm việc thời gian nào? [Thứ 7]",
+    "bạn có thể làm việc thời gian nào? [Chủ nhật]",
+    "Ghi chú (nếu có)"
+]
+HEADER_KEYWORDS = ["tên", "thứ", "ghi chú", "tuần", "ngày"]
+
+
+class RosterFormatError(ValueError):
+    """The registration table lacks a column the scheduler needs."""
+
+
+class ScheduleParseError(ValueError):
+    """No schedule could be read from the AI response; ``table`` holds the partial table if any."""
+
+    def __init__(self, message, table=None):
+        super().__init__(message)
+        self.table = table
+
+
+class StreamInterruptedError(Exception):
+    """A streamed AI response broke off; ``text`` holds what arrived, up to the last complete line."""
+
+    def __init__(self, message, text, model_name, attempts):
+        super().__init__(message)
+        self.text = text
+        self.model_name = model_name
+        self.attempts = attempts
+
+
+def ignore(message, icon=None):
+    """Default ``notify`` callback: drops progress messages."""
+
+
+# --- Reading registration data ---
+def read_registration_table(text, notify=ignore):
+    """Reads tab-separated registration data, falling back to PREDEFINED_COLUMNS when there is no usable header."""
+    data_io = io.StringIO(text)
+    # Cố gắng đọc với header, nếu lỗi thì đọc không header
+    try:
+        temp_df = pd.read_csv(data_io, sep='\t', header=0, skipinitialspace=True)
+        # Kiểm tra xem header có hợp lệ không (ví dụ: chứa từ khóa)
+        if not any(keyword in str(col).lower() for col in temp_df.columns for keyword in HEADER_KEYWORDS):
+            notify("Tiêu đề không khớp với từ khóa mong đợi, thử đọc lại không có tiêu đề.", "ℹ️")
+            data_io.seek(0)  # Reset lại con trỏ file
+            temp_df = pd.read_csv(data_io, sep='\t', header=None, names=PREDEFINED_COLUMNS, skipinitialspace=True)
+            notify("Đã sử dụng tên cột mặc định.", "ℹ️")
+        else:
+            notify("Đã đọc dữ liệu với tiêu đề từ người dùng.", "ℹ️")
+    except pd.errors.ParserError:  # Xảy ra khi số cột không khớp header
+        notify("Lỗi khi đọc với tiêu đề (số cột không khớp). Thử đọc không có tiêu đề.", "⚠️")
+        data_io.seek(0)
+        temp_df = pd.read_csv(data_io, sep='\t', header=None, names=PREDEFINED_COLUMNS, skipinitialspace=True)
+        notify("Đã sử dụng tên cột mặc định.", "ℹ️")
+    except Exception:  # Các lỗi khác khi đọc với header
+        notify("Lỗi khi đọc với tiêu đề. Thử đọc không có tiêu đề.", "⚠️")
+        data_io.seek(0)
+        temp_df = pd.read_csv(data_io, sep='\t', header=None, names=PREDEFINED_COLUMNS, skipinitialspace=True)
+        notify("Đã sử dụng tên cột mặc định.", "ℹ️")
+    temp_df.dropna(axis=0, how='all', inplace=True)
+    temp_df.dropna(axis=1, how='all', inplace=True)
+    return temp_df
+
+
+def find_start_date(df_input, notify=ignore):
+    """Finds the start date (Monday) from the input DataFrame."""
+    week_start_col = find_week_column(df_input)
+    start_date = None
+    if week_start_col and not df_input[week_start_col].dropna().empty:
+        date_val_str = str(df_input[week_start_col].dropna().iloc[0])  # Get value as string
+        try:
+            # Thử DD/MM/YYYY, MM/DD/YYYY, YYYY-MM-DD rồi để pandas tự động phát hiện; lùi về thứ 2 đầu tuần
+            start_date = parse_week_start(date_val_str)
+        except Exception as e:
+            notify(f"Lỗi phân tích ngày tháng từ cột '{week_start_col}': {e}. Giá trị: '{date_val_str}'", "⚠️")
+    return start_date
+
+
+def preprocess_pasted_data_for_lookup(df_input, notify=ignore, requirements=None):
+    """Builds the availability lookup table (Date / Employee / Shift / Can_Work / Note).
+
+    Cells are classified against the shifts of ``requirements`` (default: Ca 1 /
+    Ca 2). Returns an empty table when the week cannot be determined; raises
+    RosterFormatError when the day or employee columns are missing.
+    """
+    start_date = find_start_date(df_input, notify)
+    if start_date is None:
+        notify("⚠️ Không xác định được ngày bắt đầu tuần. Chức năng tìm thay thế sẽ không hoạt động.", "⚠️")
+        return empty_lookup()
+    employee_col = find_employee_column(df_input)
+    day_mapping = find_day_columns(df_input)
+    if not day_mapping: raise RosterFormatError("❌ Không tìm thấy các cột ngày (VD: '... [Thứ 2]'). Kiểm tra lại tên cột.")
+    if not employee_col: raise RosterFormatError("❌ Không tìm thấy cột tên nhân viên.")
+    # Xử lý theo cột (melt các cột ngày + regex biên dịch sẵn) thay vì duyệt từng dòng
+    return build_availability_lookup(df_input, start_date, employee_col, find_note_column(df_input), day_mapping,
+                                     shift_model(requirements))
+
+
+def roster_registry(df_input):
+    """EmployeeRegistry of the pasted roster's name column (empty when there is none)."""
+    employee_col = find_employee_column(df_input) if df_input is not None else None
+    return EmployeeRegistry(df_input[employee_col] if employee_col else ())
+
+
+def match_roster_names(df_schedule, registry, notify=ignore):
+    """Rewrites names the AI spelled differently ('Nguyen An') to the roster spelling ('Nguyễn An')."""
+    df_schedule, renamed = registry.canonicalize_schedule(df_schedule)
+    if renamed:
+        notify(f"Đã khớp {len(renamed)} tên AI viết khác danh sách: "
+               + ", ".join(f"{ai_name} → {name}" for ai_name, name in list(renamed.items())[:5]), "🔤")
+    return df_schedule
+
+
+def _join_vi(items):
+    """'A', 'A và B', 'A, B và C'."""
+    items = list(items)
+    return items[0] if len(items) == 1 else ", ".join(items[:-1]) + " và " + items[-1]
+
+
+def _staffing_by_shift(model, day):
+    """Prompt text for the staffing of ``day``: '**1 người/ca** (Ca 1 và Ca 2)' or one count per shift."""
+    counts = {name: model.staff_needed(day, name) for name in model.names}
+    if len(set(counts.values())) == 1:
+        return f"**{next(iter(counts.values()))} người/ca** ({_join_vi(model.names)})"
+    return ", ".join(f"{name}: **{count} người**" for name, count in counts.items())
+
+
+def _markdown_example(model):
+    """Example rows of the Markdown output format (the classic double-day example for Ca 1 / Ca 2)."""
+    if model.default_staffing and model.names == list(DEFAULT_SHIFTS_DEFINITION):
+        return """Ví dụ định dạng bảng MARKDOWN mong muốn (với ngày bắt đầu là 2025-05-05, là ngày Double Day):
+
+| Ngày       | Ca    | Nhân viên được phân công |
+|------------|-------|--------------------------|
+| 2025-05-05 | Ca 1  | NV A, NV B               | <--- 2 người vì là ngày 5/5
+| 2025-05-05 | Ca 2  | NV C, NV D               | <--- 2 người vì là ngày 5/5
+| 2025-05-06 | Ca 1  | NV E                     | <--- 1 người vì là ngày thường
+| ... (cho đến 2025-05-11) ... | ...   | ...                      |"""
+    rows = [f"| 2025-05-05 | {name:<5} | NV {chr(ord('A') + i):<22}|" for i, name in enumerate(model.names)]
+    return "\n".join(["Ví dụ định dạng bảng MARKDOWN mong muốn (với ngày bắt đầu là 2025-05-05):", "",
+                      "| Ngày       | Ca    | Nhân viên được phân công |",
+                      "|------------|-------|--------------------------|"] + rows +
+                     ["| ... (cho đến 2025-05-11) ... | ...   | ...                      |"])
+
+
+# --- Prompt building (verbose and compact) ---
+def build_schedule_prompt(df_input, requirements, output_format=OUTPUT_MARKDOWN, compact=False, notify=ignore):
+    """Constructs the scheduling prompt for one week of registration data.
+
+    Raises RosterFormatError if the employee name column cannot be found.
+    """
+    if compact:
+        return build_compact_schedule_prompt(df_input, requirements, output_format, notify)
+    notify(" Chuẩn bị dữ liệu và tạo prompt cho AI...", "⚙️")
+    data_prompt_list = [];
+    data_prompt_list.append("Dữ liệu đăng ký của nhân viên:")
+    employee_col = next((col for col in df_input.columns if 'tên' in col.lower()), None)
+    note_col = next((col for col in df_input.columns if 'ghi chú' in col.lower()), None)
+    day_keywords = ['thứ 2', 'thứ 3', 'thứ 4', 'thứ 5', 'thứ 6', 'thứ 7', 'chủ nhật', 'mon', 'tue', 'wed', 'thu', 'fri',
+                    'sat', 'sun', 'cn']
+    day_cols_map = {}  # Sử dụng map để giữ đúng thứ tự ngày
+    days_order = ["thứ 2", "thứ 3", "thứ 4", "thứ 5", "thứ 6", "thứ 7", "chủ nhật"]  # hoặc "cn"
+
+    # Tìm cột cho từng ngày
+    for day_name_vn in days_order:
+        for col in df_input.columns:
+            col_lower = str(col).lower()
+            # Kiểm tra chính xác hơn, ví dụ: "[thứ 2]" hoặc "thứ 2" ở cuối
+            if f"[{day_name_vn}]" in col_lower or col_lower.endswith(day_name_vn) or day_name_vn in col_lower:
+                day_cols_map[day_name_vn] = col
+                break
+    day_cols = [day_cols_map[d] for d in days_order if d in day_cols_map]  # Lấy các cột theo đúng thứ tự
+
+    start_date = find_start_date(df_input, notify)
+    start_date_str_for_prompt = start_date.strftime('%Y-%m-%d') if start_date else "Không xác định"
+    if not employee_col: raise RosterFormatError("Lỗi: Không thể xác định cột 'Tên nhân viên'.")
+    if not day_cols: notify("Không tìm thấy đủ các cột ngày (Thứ 2-CN). Kiểm tra lại tên cột trong file Excel.", "⚠️")
+    if start_date is None: notify("Không xác định được ngày bắt đầu tuần.", "⚠️")
+
+    data_prompt_list.append(f"(Dữ liệu cho tuần bắt đầu Thứ 2 khoảng: {start_date_str_for_prompt})")
+    unique_employee_names = df_input[employee_col].astype(
+        str).str.strip().unique()  # Lấy danh sách tên nhân viên duy nhất
+    data_prompt_list.append(
+        f"**LƯU Ý QUAN TRỌNG VỀ TÊN NHÂN VIÊN:** Danh sách nhân viên bao gồm: {', '.join(unique_employee_names)}. Mỗi tên là một người riêng biệt. Ví dụ, 'Nguyên' và 'Nguyên Đào' là HAI NGƯỜI KHÁC NHAU. Tuyệt đối không được nhầm lẫn họ.")
+
+    for index, row in df_input.iterrows():  # Format data for prompt
+        emp_name = str(row[employee_col]).strip();
+        data_prompt_list.append(f"Nhân viên: {emp_name}")
+        availability_info = []
+        if day_cols:
+            for day_col_name in day_cols:  # Duyệt theo thứ tự đã sắp xếp
+                cell_value = row.get(day_col_name)
+                # Lấy tên ngày từ tên cột để hiển thị (ví dụ: "Thứ 2" từ "bạn có thể làm việc thời gian nào? [Thứ 2]")
+                clean_day_name = day_col_name
+                match = re.search(r'\[(.*?)\]', day_col_name)
+                if match:
+                    clean_day_name = match.group(1)
+                elif any(d in day_col_name.lower() for d in days_order):
+                    for d_keyword in days_order:
+                        if d_keyword in day_col_name.lower():
+                            clean_day_name = d_keyword.capitalize()
+                            break
+
+                if pd.notna(cell_value):
+                    availability_info.append(f"- {clean_day_name}: {cell_value}")
+                else:
+                    availability_info.append(f"- {clean_day_name}: (Trống)")
+        else:
+            availability_info.append(f"  (Thông tin chi tiết: {row.to_dict()})")
+        data_prompt_list.extend(availability_info)
+        if note_col and pd.notna(row.get(note_col)):
+            data_prompt_list.append(f"- Ghi chú: {row[note_col]}")
+        else:
+            data_prompt_list.append(f"- Ghi chú: Không có")
+        data_prompt_list.append("---")
+    data_prompt = "\n".join(data_prompt_list)
+
+    model = shift_model(requirements)
+    daily_staffing_prompt = "- **Yêu cầu số lượng nhân viên (Part-time) mỗi ca:**\n"
+    if start_date:
+        for i in range(7):
+            current_day = start_date + timedelta(days=i)
+            # --- CHANGE 2: Updated the staffing logic (2 for sale days, 1 for normal days) ---
+            day_name_vn = ["Thứ 2", "Thứ 3", "Thứ 4", "Thứ 5", "Thứ 6", "Thứ 7", "Chủ Nhật"][i]
+            daily_staffing_prompt += f"  + Ngày {current_day.strftime('%Y-%m-%d')} ({day_name_vn}): {_staffing_by_shift(model, current_day)}.\n"
+    elif model.default_staffing:
+        # --- CHANGE 3: Updated the fallback staffing number ---
+        daily_staffing_prompt += "  + **1 người/ca** cho tất cả các ngày.\n"
+    else:
+        for name in model.names:
+            curve = model.staff_curve(name) or (1,) * 7
+            daily_staffing_prompt += f"  + {name}: " + ", ".join(
+                f"{day} {count} người" for day, count in zip(DAY_ABBREVIATIONS, curve)) + ".\n"
+
+    req_prompt_list = []  # Format requirements for prompt
+    req_prompt_list.append("\nRàng buộc và Quy tắc xếp lịch:")
+    # --- ADDED RULE: Treat employee names as distinct ---
+    req_prompt_list.append(
+        f"- **QUY TẮC XỬ LÝ TÊN NHÂN VIÊN (CỰC KỲ QUAN TRỌNG):** Mỗi tên nhân viên được cung cấp trong dữ liệu (ví dụ: {', '.join(unique_employee_names[:3])}...) phải được coi là một cá nhân HOÀN TOÀN RIÊNG BIỆT. KHÔNG được phép gộp hoặc nhầm lẫn các tên tương tự nhau (ví dụ: 'Nguyên' và 'Nguyên Đào' là hai người khác nhau và phải được xếp lịch độc lập). Hãy xử lý từng dòng dữ liệu nhân viên một cách riêng rẽ.")
+    req_prompt_list.append("- Ca làm việc: " + ", ".join(
+        f"{name} ({spec['start']} - {spec['end']})" for name, spec in requirements['shifts_definition'].items()) + ".")
+    req_prompt_list.append(f"- Mỗi nhân viên làm tối đa {requirements['max_shifts_per_day']} ca/ngày.")
+    # --- MODIFIED LINE (Rule for 4 shifts per week) ---
+    req_prompt_list.append(
+        f"- **MỤC TIÊU QUAN TRỌNG NHẤT (BẮT BUỘC TUÂN THỦ):** Phân bổ chính xác **{requirements['shifts_per_week_target']} ca làm việc cho MỖI nhân viên** (trừ FM/Sup, hoặc những người có ghi chú 'nghỉ cả tuần' / 'xin nghỉ nguyên tuần' trong cột Ghi Chú, hoặc những người không đăng ký đủ số buổi khả dụng để đạt {requirements['shifts_per_week_target']} ca). Việc này phải được ưu tiên HÀNG ĐẦU, chỉ sau việc tôn trọng các ngày đăng ký 'Nghỉ' cụ thể của nhân viên (ví dụ: 'Nghỉ' trong cột của Thứ 2 thì không xếp lịch cho Thứ 2). Nếu không thể đạt được mục tiêu {requirements['shifts_per_week_target']} ca cho một nhân viên nào đó (mà họ đủ điều kiện), AI PHẢI giải thích rõ ràng lý do cụ thể cho từng trường hợp không đạt được trong phần phản hồi của mình, ngay bên dưới bảng lịch.")
+    req_prompt_list.append(f"- Ít nhất {requirements['min_rest_hours']} giờ nghỉ giữa các ca (nếu có thể >1 ca/ngày).")
+    req_prompt_list.append(f"- Tối đa {requirements['max_consecutive_days']} ngày làm việc liên tiếp.")
+    req_prompt_list.append(daily_staffing_prompt[:-1])  # Remove last newline
+    # --- CHANGE 4: Updated the summary note for staffing ---
+    if model.default_staffing:
+        req_prompt_list.append(
+            "  + **LƯU Ý:** Ngày trùng tháng (ví dụ 3/3, 5/5) cần 2 người/ca, các ngày khác cần 1 người/ca.")
+    req_prompt_list.append(f"- Xử lý 'Ghi chú' của nhân viên (trong cột 'Ghi chú (nếu có)'):")
+    req_prompt_list.append(
+        f"  + **Ưu tiên 1 (Bắt buộc):** Nếu cột 'Ghi chú' chứa 'nghỉ cả tuần', 'xin nghỉ nguyên tuần', 'nghỉ', 'bận', 'không thể', 'xin off' -> TUYỆT ĐỐI KHÔNG xếp lịch cho nhân viên đó trong cả tuần (trừ khi ghi chú chỉ rõ phạm vi ngày cụ thể).")
+    req_prompt_list.append(
+        f"  + **Ưu tiên 2 (Mong muốn):** Nếu cột 'Ghi chú' chứa 'muốn làm', 'ưu tiên', 'có thể làm' -> CỐ GẮNG xếp nếu không vi phạm ràng buộc khác (mức độ ưu tiên gợi ý: {requirements['preferences_weight_hint']}).")
+    req_prompt_list.append(
+        f"  + **Ưu tiên 3 (Giờ làm không trọn vẹn trong cột Ghi chú):** Nếu cột 'Ghi chú' có giờ cụ thể (VD: 'chỉ làm 9h-12h', 'làm từ 16h'), hãy làm theo các bước sau:")
+    req_prompt_list.append(
+        f"      1. Ưu tiên xếp đủ số người có thể làm **trọn vẹn** ca đó trước (dựa trên đăng ký các cột ngày).")
+    req_prompt_list.append(
+        f"      2. **CHỈ KHI** ca đó vẫn còn thiếu người theo yêu cầu số lượng, thì MỚI xem xét xếp nhân viên có giờ làm không trọn vẹn (theo cột Ghi chú) vào để đáp ứng nguyện vọng của họ (dù họ không làm đủ giờ).")
+    req_prompt_list.append(
+        f"      3. Nếu ca đã đủ người làm trọn vẹn, thì KHÔNG xếp thêm người chỉ làm được một phần giờ (theo cột Ghi chú).")
+    req_prompt_list.append(
+        "- Chỉ xếp lịch vào ca nhân viên đăng ký/có thể làm (dựa trên dữ liệu các cột ngày Thứ 2 - Chủ Nhật).")
+    req_prompt_list.append("- Bỏ qua nhân viên 'FM/Sup'.")
+    req_prompt = "\n".join(req_prompt_list)
+
+    if output_format == OUTPUT_JSON:
+        shift_choices = " hoặc ".join(f'"{name}"' for name in model.names)
+        return f"""
+Bạn là một trợ lý quản lý lịch làm việc siêu hạng. Dựa vào dữ liệu đăng ký của nhân viên (chủ yếu là Part-time) và các quy tắc ràng buộc dưới đây, hãy tạo ra một lịch làm việc tối ưu cho tuần, **bắt đầu từ ngày Thứ Hai là {start_date_str_for_prompt} (YYYY-MM-DD)**.
+
+{data_prompt}
+
+{req_prompt}
+
+**Yêu cầu đầu ra (JSON theo schema):**
+- "schedule": một phần tử cho MỖI ca của MỖI ngày từ Thứ 2 ({start_date_str_for_prompt}) đến Chủ Nhật, sắp xếp theo ngày.
+- "date": ngày theo định dạng YYYY-MM-DD; "shift": tên ca ({shift_choices}).
+- "employees": danh sách TẤT CẢ tên nhân viên được xếp vào ca đó, viết CHÍNH XÁC như trong dữ liệu.
+- "missing": số người còn thiếu so với yêu cầu số người/ca của ngày đó (0 nếu đủ).
+- "notes": lý do ngắn gọn nếu không đạt mục tiêu {requirements['shifts_per_week_target']} ca/tuần cho nhân viên nào đó (để trống nếu không có).
+**Đảm bảo xử lý các 'Ghi chú' theo hướng dẫn đã nêu** và mọi ràng buộc khác (đặc biệt là **số người/ca theo từng ngày**, **MỤC TIÊU {requirements['shifts_per_week_target']} ca/người/tuần PHẢI ĐƯỢC ƯU TIÊN TỐI ĐA**, và {requirements['max_shifts_per_day']} ca/người/ngày).
+"""
+    full_prompt = f"""
+Bạn là một trợ lý quản lý lịch làm việc siêu hạng. Dựa vào dữ liệu đăng ký của nhân viên (chủ yếu là Part-time) và các quy tắc ràng buộc dưới đây, hãy tạo ra một lịch làm việc tối ưu cho tuần, **bắt đầu từ ngày Thứ Hai là {start_date_str_for_prompt} (YYYY-MM-DD)**.
+
+{data_prompt}
+
+{req_prompt}
+
+**Yêu cầu đầu ra:**
+Hãy trình bày lịch làm việc dưới dạng một bảng MARKDOWN rõ ràng.
+**Cột đầu tiên PHẢI là "Ngày" và chứa ngày tháng cụ thể (theo định dạng YYYY-MM-DD)** cho từng ngày trong tuần (Thứ 2 đến Chủ Nhật), tính toán dựa trên ngày bắt đầu tuần đã cho ({start_date_str_for_prompt}).
+Các cột tiếp theo là "Ca" và "Nhân viên được phân công". Sắp xếp theo ngày. **Trong cột "Nhân viên được phân công", liệt kê TẤT CẢ tên nhân viên được xếp vào ca đó, cách nhau bằng dấu phẩy.**
+
+**--- CHANGE 5: Updated the example Markdown table in the prompt ---**
+{_markdown_example(model)}
+
+**QUAN TRỌNG:** Chỉ trả về BẢNG MARKDOWN lịch làm việc, không thêm bất kỳ lời giải thích hay bình luận nào khác trước hoặc sau bảng. Đảm bảo cột "Ngày" chứa ngày YYYY-MM-DD chính xác cho cả tuần. **Đảm bảo xử lý các 'Ghi chú' theo hướng dẫn đã nêu, đặc biệt là logic ưu tiên cho giờ làm không trọn vẹn.** Đảm bảo mọi ràng buộc khác được đáp ứng (đặc biệt là **số người/ca theo từng ngày** như đã nêu ở trên, **MỤC TIÊU {requirements['shifts_per_week_target']} ca/người/tuần PHẢI ĐƯỢC ƯU TIÊN TỐI ĐA**, và {requirements['max_shifts_per_day']} ca/người/ngày).
+Nếu không thể tạo lịch đáp ứng tất cả ràng buộc (ví dụ: thiếu người cho một ca nào đó, hoặc không thể đảm bảo {requirements['shifts_per_week_target']} ca/tuần cho mọi người), hãy ghi rõ điều đó trong bảng hoặc nêu lý do ngắn gọn ngay dưới bảng. **Đặc biệt, nếu một ca không đủ số người yêu cầu (ví dụ, cần 2 người nhưng chỉ xếp được 1), hãy ghi chú trong cột 'Nhân viên được phân công' là 'Tên NV được xếp, (Thiếu 1 người)' hoặc nếu không có ai thì ghi '(Thiếu 2 người)' hoặc tương tự.**
+"""
+    return full_prompt
+
+
+# --- Compact Prompt: normalized availability matrix + notes only where they exist ---
+def build_compact_schedule_prompt(df_input, requirements, output_format=OUTPUT_MARKDOWN, notify=ignore):
+    """Builds a short prompt whose size grows by one matrix row (plus an optional note) per employee."""
+    notify(" Chuẩn bị dữ liệu và tạo prompt rút gọn cho AI...", "⚙️")
+    start_date = find_start_date(df_input, notify)
+    employee_col = find_employee_column(df_input)
+    day_mapping = find_day_columns(df_input)
+    if not employee_col: raise RosterFormatError("Lỗi: Không thể xác định cột 'Tên nhân viên'.")
+    if start_date is None or not day_mapping:
+        notify("Không xác định được tuần hoặc các cột ngày, dùng prompt đầy đủ.", "⚠️")
+        return build_schedule_prompt(df_input, requirements, output_format, compact=False, notify=notify)
+    model = shift_model(requirements)
+    lookup_df = build_availability_lookup(df_input, start_date, employee_col, find_note_column(df_input), day_mapping,
+                                          model)
+    intents = note_intents(lookup_df, model)  # Ghi chú hiểu được: áp dụng thẳng vào ma trận, chỉ gửi phần mềm
+    notes = prompt_notes(lookup_df, intents)
+    lookup_df = apply_note_intents(lookup_df, intents, model).lookup
+    shifts = requirements['shifts_definition']
+    start_str = start_date.strftime('%Y-%m-%d')
+
+    week_days = [start_date + timedelta(days=i) for i in range(7)]
+    if model.default_staffing:
+        double_days = [d.strftime('%Y-%m-%d') for d in week_days if d.day == d.month]
+        staffing = "1 người/ca" + (f"; ngày {', '.join(double_days)}: 2 người/ca" if double_days else "")
+    else:  # Mỗi ca một dòng số người T2..CN (gộp khi cả tuần như nhau)
+        curves = {name: [model.staff_needed(day, name) for day in week_days] for name in model.names}
+        staffing = "; ".join(f"{name} {curve[0]} người/ca" if len(set(curve)) == 1 else
+                             f"{name} {'/'.join(map(str, curve))} người (T2→CN)" for name, curve in curves.items())
+    w = requirements['preferences_weight_hint']
+    target = requirements['shifts_per_week_target']
+    rules = "\n".join([
+        "Quy tắc:",
+        "- Ca: " + ", ".join(f"{name} {spec['start']}-{spec['end']}" for name, spec in shifts.items()) + ".",
+        f"- Số người: {staffing}.",
+        f"- Mỗi người tối đa {requirements['max_shifts_per_day']} ca/ngày, nghỉ ≥{requirements['min_rest_hours']}h giữa 2 ca, "
+        f"tối đa {requirements['max_consecutive_days']} ngày liên tiếp.",
+        f"- ƯU TIÊN CAO NHẤT: đúng {target} ca/người/tuần (trừ FM/Sup, người nghỉ cả tuần, người đăng ký không đủ buổi); "
+        f"nếu không đạt phải nêu lý do.",
+        "- Chỉ xếp vào ô có mã ca đăng ký. Mỗi tên là một người riêng biệt, không gộp tên gần giống nhau. Bỏ qua FM/Sup.",
+        f"- Ghi chú: ngày/ca nghỉ đã trừ khỏi ma trận; 'ưu tiên' -> cố gắng đáp ứng (trọng số {w}); 'chỉ làm' giờ không "
+        f"trọn ca -> chỉ xếp khi ca còn thiếu người làm trọn ca; ghi chú khác 'nghỉ/bận' -> không xếp.",
+    ])
+    matrix = compact_availability_block(lookup_df, model.names, notes)
+    codes = shift_codes(model.names)
+    example = (f"VD '{codes[0]}{codes[1]}' = {model.names[0]} và {model.names[1]}, " if len(codes) > 1 else "")
+    if any(code not in name for code, name in zip(codes, model.names)):  # Mã không suy ra được từ tên ca
+        example = "mã " + ", ".join(f"{code} = {name}" for code, name in zip(codes, model.names)) + "; " + example
+    legend = f"Ma trận đăng ký (tuần từ Thứ 2 {start_str}; ô = mã ca có thể làm, {example}'-' = nghỉ):"
+    if output_format == OUTPUT_JSON:
+        output = ("Đầu ra: JSON theo schema; mỗi (ngày YYYY-MM-DD, ca) một phần tử, 'employees' ghi đúng tên như dữ liệu, "
+                  "'missing' = số người còn thiếu, 'notes' = lý do nếu không đạt mục tiêu.")
+    else:
+        output = ("Đầu ra: CHỈ một bảng Markdown '| Ngày | Ca | Nhân viên được phân công |', ngày YYYY-MM-DD, mỗi (ngày, ca) "
+                  "một dòng, tên cách nhau bằng dấu phẩy, ghi '(Thiếu N người)' nếu thiếu.")
+    return f"Lập lịch làm việc tối ưu cho tuần bắt đầu Thứ 2 {start_str}.\n\n{legend}\n{matrix}\n\n{rules}\n\n{output}\n"
+
+
+# --- AI response parsing ---
+def parse_ai_schedule(ai_response_text, notify=ignore):
+    """Parses the AI's Markdown table response into the 3-column schedule DataFrame.
+
+    Returns None when the table holds no valid rows; raises ScheduleParseError when
+    no usable table can be read.
+    """
+    # Cố gắng tìm bảng Markdown, kể cả khi có text thừa xung quanh
+    table_match = re.search(r"(\n?\|.*?\n(?:\|.*?\n)+)", ai_response_text, re.DOTALL)
+    if not table_match:
+        # Nếu không tìm thấy bảng hoàn chỉnh, thử tìm các dòng bắt đầu bằng '|'
+        lines = [line.strip() for line in ai_response_text.strip().split('\n') if line.strip().startswith('|')]
+        if len(lines) > 1:
+            notify("Không tìm thấy cấu trúc Markdown chuẩn, thử phân tích các dòng bắt đầu bằng '|'.", "⚠️")
+            table_content = "\n".join(lines)
+            # Kiểm tra xem có dòng header hợp lệ không (chứa ít nhất 2 dấu gạch nối)
+            if not re.search(r"\|.*-.*-.*\|", lines[1]):
+                notify("Dòng header Markdown có vẻ không hợp lệ, sẽ cố gắng thêm header mặc định.", "⚠️")
+                # Thêm header giả định nếu dòng thứ hai không phải là dòng phân cách header
+                table_content = "| Ngày | Ca | Nhân viên được phân công |\n|---|---|---|\n" + table_content
+        else:
+            raise ScheduleParseError("Không tìm thấy định dạng bảng Markdown trong phản hồi của AI.")
+    else:
+        table_content = table_match.group(1).strip()
+        # Kiểm tra lại header sau khi trích xuất
+        lines = table_content.split('\n')
+        if len(lines) > 1 and not re.search(r"\|.*-.*-.*\|", lines[1]):  # Kiểm tra dòng thứ 2 (index 1)
+            notify("Dòng header Markdown sau khi trích xuất có vẻ không hợp lệ, sẽ cố gắng thêm header mặc định.", "⚠️")
+            # Giả định dòng đầu là header data, chèn dòng phân cách
+            table_content = lines[0] + "\n|---|---|---|\n" + "\n".join(lines[1:])
+
+    try:
+        data_io = io.StringIO(table_content)
+        # Đọc CSV, bỏ qua các dòng trống và dòng không phải là bảng
+        df_schedule = pd.read_csv(data_io, sep='|', skipinitialspace=True, on_bad_lines='skip')
+
+        # Loại bỏ các cột và hàng trống hoặc không hợp lệ
+        df_schedule = df_schedule.dropna(axis=1, how='all')  # Bỏ cột toàn NaN
+        if df_schedule.shape[1] > 0 and df_schedule.iloc[:,
+                                        0].isnull().all():  # Nếu cột đầu tiên toàn NaN (thường do dấu | ở đầu)
+            df_schedule = df_schedule.iloc[:, 1:]
+        if df_schedule.shape[1] > 0 and df_schedule.iloc[:,
+                                        -1].isnull().all():  # Nếu cột cuối cùng toàn NaN (thường do dấu | ở cuối)
+            df_schedule = df_schedule.iloc[:, :-1]
+
+        df_schedule.columns = [col.strip() for col in df_schedule.columns]
+        # Loại bỏ dòng phân cách của Markdown (ví dụ: |---|---|---|)
+        df_schedule = df_schedule[~df_schedule.iloc[:, 0].astype(str).str.contains(r'--\s*--', na=False)]
+        df_schedule = df_schedule.dropna(axis=0, how='all')  # Bỏ hàng toàn NaN
+
+        # Đổi tên cột nếu cần
+        expected_cols = ["Ngày", "Ca", "Nhân viên được phân công"]
+        if len(df_schedule.columns) >= 3:
+            current_cols = df_schedule.columns.tolist()
+            # Kiểm tra xem tên cột hiện tại có vẻ hợp lý không
+            # Chỉ đổi tên nếu tên cột hiện tại không chứa các từ khóa mong đợi
+            if not (expected_cols[0].lower() in current_cols[0].lower() and \
+                    expected_cols[1].lower() in current_cols[1].lower() and \
+                    expected_cols[2].lower() in current_cols[2].lower()):
+                notify(f"Tên cột từ AI không khớp hoàn toàn: {current_cols}. Sử dụng tên cột mặc định.", "⚠️")
+                df_schedule = df_schedule.iloc[:, :len(expected_cols)]  # Chỉ lấy đủ số cột mong đợi
+                df_schedule.columns = expected_cols[:len(df_schedule.columns)]
+            else:  # Nếu tên cột có vẻ ổn, chỉ chuẩn hóa và lấy 3 cột chính
+                df_schedule = df_schedule.iloc[:, :3]
+                df_schedule.columns = expected_cols
+
+        elif len(df_schedule.columns) == 2 and expected_cols[0].lower() in df_schedule.columns[0].lower() and \
+                expected_cols[1].lower() in df_schedule.columns[1].lower():
+            notify("Bảng từ AI thiếu cột 'Nhân viên được phân công'. Sẽ hiển thị với cột đó trống.", "⚠️")
+            df_schedule["Nhân viên được phân công"] = ""
+            df_schedule.columns = expected_cols
+        else:
+            raise ScheduleParseError(
+                f"Lỗi phân tích: Bảng chỉ có {len(df_schedule.columns)} cột, cần ít nhất 3 cột ('Ngày', 'Ca', 'Nhân viên').",
+                table=df_schedule)
+
+        # Làm sạch dữ liệu trong các ô
+        for col in df_schedule.columns:
+            if df_schedule[col].dtype == 'object':
+                df_schedule[col] = df_schedule[col].str.strip()
+
+        # Chuyển đổi cột 'Ngày'
+        if "Ngày" in df_schedule.columns:
+            try:
+                df_schedule['Ngày_str_backup'] = df_schedule['Ngày']  # Giữ lại giá trị string gốc
+                df_schedule['Ngày'] = pd.to_datetime(df_schedule['Ngày'], errors='coerce')
+                if df_schedule['Ngày'].isnull().any():
+                    notify("Cảnh báo: Một số giá trị 'Ngày' từ AI không hợp lệ. Đang thử chuyển đổi lại...", "⚠️")
+                    for idx, row_data in df_schedule.iterrows():
+                        if pd.isna(row_data['Ngày']):
+                            try_formats = ['%d/%m/%Y', '%m/%d/%Y', '%Y/%m/%d', '%d-%m-%Y', '%m-%d-%Y']
+                            for fmt in try_formats:
+                                try:
+                                    converted_date = pd.to_datetime(row_data['Ngày_str_backup'], format=fmt,
+                                                                    errors='raise')
+                                    df_schedule.loc[idx, 'Ngày'] = converted_date
+                                    break  # Chuyển đổi thành công
+                                except (ValueError, TypeError):
+                                    continue  # Thử định dạng tiếp theo
+                df_schedule = df_schedule.dropna(subset=['Ngày'])
+                df_schedule.drop(columns=['Ngày_str_backup'], inplace=True, errors='ignore')
+            except Exception as date_err:
+                notify(f"Lỗi chuyển đổi cột 'Ngày' từ AI: {date_err}. Kiểm tra định dạng ngày.", "⚠️")
+                df_schedule.drop(columns=['Ngày_str_backup'], inplace=True, errors='ignore')
+        else:
+            raise ScheduleParseError("Lỗi nghiêm trọng: Không tìm thấy cột 'Ngày' trong bảng phân tích.")
+
+        if df_schedule.empty:
+            notify("Không có dữ liệu hợp lệ sau khi phân tích phản hồi từ AI.", "⚠️")
+            return None
+
+        notify("✅ Phân tích lịch trình từ AI thành công.", "✅");
+        return df_schedule
+    except ScheduleParseError:
+        raise
+    except Exception as e:
+        raise ScheduleParseError(f"Lỗi nghiêm trọng khi phân tích bảng Markdown từ AI: {e}") from e
+
+
+def parse_ai_response(ai_response_text, output_format, notify=ignore):
+    """Parses the AI response: structured JSON first (if requested), Markdown table as fallback."""
+    if output_format == OUTPUT_JSON:
+        try:
+            df_schedule = parse_schedule_json(ai_response_text)
+            if not df_schedule.empty:
+                notify("✅ Phân tích lịch trình JSON từ AI thành công.", "✅")
+                return df_schedule
+        except (ValueError, TypeError) as e:
+            notify(f"Phản hồi JSON không hợp lệ ({e}). Thử phân tích dạng bảng Markdown...", "⚠️")
+    return parse_ai_schedule(ai_response_text, notify)
+
+
+# --- 8-column display table ---
+DISPLAY_SHIFTS = list(DEFAULT_SHIFTS_DEFINITION)
+VIETNAMESE_DAYS = np.array(["Thứ 2", "Thứ 3", "Thứ 4", "Thứ 5", "Thứ 6", "Thứ 7", "Chủ Nhật"], dtype=object)
+
+
+def display_columns(shifts=None, slots=DISPLAY_SLOTS):
+    """Display table columns: 'Thứ', 'Ngày', then '<shift> (NV<i>)'; ``slots`` is one count or {shift: count}."""
+    shifts = shifts or DISPLAY_SHIFTS
+    counts = slots if isinstance(slots, dict) else dict.fromkeys(shifts, slots)
+    return ['Thứ', 'Ngày'] + [f"{shift} (NV{i})" for shift in shifts for i in range(1, counts.get(shift, DISPLAY_SLOTS) + 1)]
+
+
+def display_layout(requirements=None):
+    """(shift names, {shift: slots}) of the display/editor table for the configured shifts."""
+    model = shift_model(requirements)
+    return model.names, model.slot_counts()
+
+
+def create_8_column_df(df_schedule, shifts=None, min_slots=DISPLAY_SLOTS):
+    """Creates the display table (one row per date, one column per shift slot) from the 3-column schedule.
+
+    The staff cells are split with one explode and laid out with one pivot, so
+    multi-week schedules take the same few passes. Columns cover ``shifts``
+    (default: 'Ca 1', 'Ca 2' and any other shift in the data) with at least
+    ``min_slots`` slots each (one count or {shift: count}, see display_layout)
+    and more where a shift has more staff, which is the classic 8-column
+    layout for the usual data. As before, only the first row of a duplicated
+    (date, shift) pair is used.
+    """
+    if df_schedule is None or df_schedule.empty or 'Ngày' not in df_schedule.columns or 'Ca' not in df_schedule.columns:
+        return pd.DataFrame(columns=display_columns(shifts, min_slots))
+    staff = (df_schedule[STAFF_COLUMN] if STAFF_COLUMN in df_schedule.columns
+             else pd.Series('', index=df_schedule.index))
+    table = pd.DataFrame({'Date': pd.to_datetime(df_schedule['Ngày'], errors='coerce'), 'Ca': df_schedule['Ca'],
+                          'Staff': staff}).dropna(subset=['Date', 'Ca'])
+    if table.empty:
+        return pd.DataFrame(columns=display_columns(shifts, min_slots))
+    table['Date'] = table['Date'].dt.normalize()
+    table['Ca'] = table['Ca'].astype(str)
+    table = table.drop_duplicates(subset=['Date', 'Ca'], keep='first').reset_index(drop=True)
+    dates = pd.DatetimeIndex(table['Date'].drop_duplicates().sort_values())
+
+    # Một dòng cho mỗi (ngày, ca, người); vị trí NV tính sau khi bỏ tên rỗng
+    names = table['Staff'].fillna('').astype(str).str.split(',').explode().str.strip()
+    names = names[names.notna() & (names != '')]
+    assigned = pd.DataFrame({'Date': table['Date'].to_numpy()[names.index], 'Ca': table['Ca'].to_numpy()[names.index],
+                             'Slot': names.groupby(level=0).cumcount().to_numpy() + 1, 'Name': names.to_numpy()})
+
+    shift_order = list(shifts) if shifts is not None else DISPLAY_SHIFTS + [
+        shift for shift in table['Ca'].unique() if shift not in DISPLAY_SHIFTS]
+    assigned = assigned[assigned['Ca'].isin(shift_order)]
+    most_staff = assigned.groupby('Ca')['Slot'].max()
+    minimum = min_slots if isinstance(min_slots, dict) else dict.fromkeys(shift_order, min_slots)
+    slot_counts = {shift: max(minimum.get(shift, DISPLAY_SLOTS), int(most_staff.get(shift, 0))) for shift in shift_order}
+    slots = pd.MultiIndex.from_tuples([(shift, i) for shift in shift_order for i in range(1, slot_counts[shift] + 1)],
+                                      names=['Ca', 'Slot'])
+    grid = assigned.pivot(index='Date', columns=['Ca', 'Slot'], values='Name').reindex(index=dates, columns=slots)
+
+    columns = display_columns(shift_order, slot_counts)
+    df_display = pd.DataFrame({'Thứ': VIETNAMESE_DAYS[dates.weekday], 'Ngày': dates.strftime('%d/%m/%Y')})
+    df_display[columns[2:]] = grid.fillna('').to_numpy(dtype=object)
+    return df_display
+
+
+def schedule_from_display(df_display):
+    """Inverse of create_8_column_df: the 3-column schedule (Ngày, Ca, names joined by ', ') of a display table.
+
+    Used to store the edited grid as a schedule version; empty slots are dropped
+    and rows whose 'Ngày' is not a dd/mm/YYYY date are skipped.
+    """
+    slot_columns = [col for col in (df_display.columns if df_display is not None else []) if ' (NV' in str(col)]
+    if df_display is None or df_display.empty or 'Ngày' not in df_display.columns or not slot_columns:
+        return pd.DataFrame(columns=['Ngày', 'Ca', STAFF_COLUMN])
+    cells = df_display.melt(id_vars=['Ngày'], value_vars=slot_columns, var_name='Column', value_name='Name')
+    cells['Ngày'] = pd.to_datetime(cells['Ngày'], format='%d/%m/%Y', errors='coerce')
+    cells['Ca'] = cells['Column'].astype(str).str.rsplit(' (NV', n=1).str[0]
+    cells['Name'] = cells['Name'].fillna('').astype(str).str.strip()
+    cells = cells.dropna(subset=['Ngày'])
+    shift_order = list(dict.fromkeys(cells['Ca']))
+    staff = cells[cells['Name'] != ''].groupby(['Ngày', 'Ca'], sort=False)['Name'].agg(', '.join)
+    slots = pd.MultiIndex.from_product([sorted(cells['Ngày'].unique()), shift_order], names=['Ngày', 'Ca'])
+    schedule_df = staff.reindex(slots, fill_value='').rename(STAFF_COLUMN).reset_index()
+    return schedule_df[['Ngày', 'Ca', STAFF_COLUMN]]
+
+
+# --- Generation ---
+def call_generation_config(output_format):
+    """Per-call generation_config overrides for the selected output format."""
+    return JSON_GENERATION_CONFIG if output_format == OUTPUT_JSON else {}
+
+
+def count_prompt_tokens(full_prompt, model=None):
+    """(token count, exact) of a prompt: the model's count_tokens when it answers, else the local estimate."""
+    if model is not None:
+        try:
+            return int(model.count_tokens(full_prompt).total_tokens), True
+        except Exception:  # Lỗi mạng / model giả không có count_tokens: dùng ước tính
+            pass
+    return estimate_tokens(full_prompt), False
+
+
+def _read_stream(chunks, on_chunk):
+    """(text, last chunk, error or None) of a streamed response; each chunk's text goes to ``on_chunk`` on arrival."""
+    received, last_chunk = [], None
+    try:
+        for last_chunk in chunks:
+            received.append(last_chunk.text)
+            on_chunk(received[-1])
+    except Exception as e:
+        return "".join(received), last_chunk, e
+    return "".join(received), last_chunk, None
+
+
+def request_ai_schedule(full_prompt, get_model, policy, breakers, output_format=OUTPUT_MARKDOWN, cache=None,
+                        force_refresh=False, trace=None, rate_limiter=None, on_chunk=None, notify=ignore):
+    """Sends one prompt through the call policy, reusing/storing the response in ``cache`` if given.
+
+    Returns (response text, served model name or None when cached, attempts). With a
+    ``trace`` (see instrumentation.RunTrace) the call is timed as a "model_call" span
+    and its token counts are recorded. ``rate_limiter`` (batch.RateLimiter) is only
+    waited on when the model is actually called, not for cache hits. With
+    ``on_chunk`` the response is streamed and each chunk's text is passed to it;
+    a stream that breaks off raises StreamInterruptedError and is not cached.
+    Cache hits, fallback models and answers are reported through ``notify``.
+    """
+    call_config = call_generation_config(output_format)
+    cache_key = make_cache_key(full_prompt, MODEL_NAME, {**generation_config, **call_config})
+    with span_or_null(trace, "model_call") as span:
+        if cache is not None:
+            if force_refresh:
+                cache.invalidate(cache_key)
+            else:
+                cached_entry = cache.get(cache_key)
+                if cached_entry and cached_entry.get("text"):
+                    span.update(cached=True)
+                    if trace is not None:
+                        trace.record_estimate(full_prompt, cached_entry["text"])
+                    notify("⚡ Dùng lại phản hồi AI đã lưu (cache).", "⚡")
+                    return cached_entry["text"], None, []
+        if rate_limiter is not None:
+            rate_limiter.wait()
+        response, served_model, attempts = call_with_policy(full_prompt, get_model, policy, breakers,
+                                                            generate_kwargs={"generation_config": call_config or None},
+                                                            stream=on_chunk is not None)
+        span.update(cached=False, model=served_model, attempts=len(attempts))
+        if on_chunk is None:
+            response_text = response.text
+        else:
+            span.update(stream=True, first_chunk_ms=round(attempts[-1]["latency"] * 1000, 1))
+            response_text, response, error = _read_stream(response, on_chunk)  # usage_metadata ở chunk cuối
+            if error is not None:
+                span.update(truncated=True)
+                if trace is not None:
+                    trace.record_usage(response, full_prompt, response_text)
+                raise StreamInterruptedError(f"Luồng phản hồi từ AI bị ngắt ({error}).",
+                                             response_text[:response_text.rfind("\n") + 1],  # Bỏ dòng cuối dở
+                                             served_model, attempts) from error
+        if trace is not None:
+            trace.record_usage(response, full_prompt, response_text)
+    if served_model != policy.models[0]:
+        notify(f"⚠️ {policy.models[0]} không phản hồi, đã dùng model dự phòng {served_model}.", "⚠️")
+    notify(f"✅ AI ({served_model}) đã phản hồi.", "✅")
+    if cache is not None:
+        cache.put(cache_key, response_text, served_model)
+    return response_text, served_model, attempts
+
+
+def generate_schedule(df_input, requirements=None, get_model=None, policy=None, breakers=None,
+                      output_format=OUTPUT_JSON, compact_prompt=True, cache=None, notify=ignore, trace=None,
+                      rate_limiter=None):
+    """Generates the 3-column schedule for one week of registrations.
+
+    Without ``get_model`` the local solver is used; otherwise the prompt is sent
+    through ``policy``/``breakers`` (see call_policy), throttled by ``rate_limiter``
+    on cache misses, and the response parsed.
+    Stages are timed as spans of ``trace`` when one is given.
+    Returns (schedule DataFrame, AI response text or None).
+    """
+    requirements = requirements or DEFAULT_REQUIREMENTS
+    if get_model is None:
+        with span_or_null(trace, "preprocess"):
+            lookup_df = preprocess_pasted_data_for_lookup(df_input, notify, requirements)
+        with span_or_null(trace, "solve_local"):
+            return solve_schedule(lookup_df, requirements), None
+    policy = policy or CallPolicy([MODEL_NAME])
+    breakers = breakers or BreakerRegistry(policy.breaker_failure_threshold, policy.breaker_reset_seconds)
+    with span_or_null(trace, "prompt_build", compact=compact_prompt):
+        full_prompt = build_schedule_prompt(df_input, requirements, output_format, compact=compact_prompt, notify=notify)
+    response_text, _, _ = request_ai_schedule(full_prompt, get_model, policy, breakers, output_format, cache,
+                                              trace=trace, rate_limiter=rate_limiter, notify=notify)
+    with span_or_null(trace, "parse", output_format=output_format):
+        df_schedule = parse_ai_response(response_text, output_format, notify)
+    if df_schedule is None or df_schedule.empty:
+        raise ScheduleParseError("Không có dữ liệu hợp lệ sau khi phân tích phản hồi từ AI.")
+    return match_roster_names(df_schedule, roster_registry(df_input), notify), response_text
+
+
+def make_genai_model_getter(api_key):
+    """name -> google.generativeai model, configured once with ``api_key`` (imported lazily)."""
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    models = {}
+
+    def get_model(model_name):
+        if model_name not in models:
+            models[model_name] = genai.GenerativeModel(model_name=model_name, generation_config=generation_config)
+        return models[model_name]
+
+    return get_model
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""Memory budget for the large per-session artifacts of the app.
+
+Every session keeps its pasted roster, lookup table, schedules, AI response and
+copy text in session state for as long as the tab lives. ``SessionDataManager``
+measures those artifacts at the end of each run and keeps every session under a
+per-session budget and all sessions together under a global one:
+
+* for the session that just ran, the others are spilled, largest first, to
+  pickle files in a private spill directory; its derived artifacts (the lookup
+  table, the copy text and the caches built from them) are dropped only when
+  spilling alone cannot bring it under budget, since every later run would
+  have to rebuild them;
+* idle sessions are shrunk when the global budget is exceeded (least recently
+  seen first), derived artifacts first since they are cheaper to give up;
+* ``begin`` loads the spilled artifacts back before the page reads them.
+
+The session state is any mapping with get / set / del / ``in`` (Streamlit's
+per-session state in the app, a dict in scripts). A session is forgotten, with
+its spill files, when ``alive`` reports it closed or after IDLE_SECONDS without
+a run.
+"""
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from collections import namedtuple
+
+import pandas as pd
+
+SPILLABLE_KEYS = ('df_from_paste', 'schedule_df', 'edited_schedule_table', 'ai_response_text')
+# Artifact -> caches built from it, dropped with it so the memory is really released
+DERIVED_KEYS = {
+    'availability_lookup_df': ('availability_index', 'editor_index', 'schedule_validator', 'candidate_ranker'),
+    'copyable_text': (),
+}
+SESSION_BUDGET_BYTES = 64 * 1024 * 1024
+GLOBAL_BUDGET_BYTES = 512 * 1024 * 1024
+MIN_SPILL_BYTES = 64 * 1024  # Nhỏ hơn thì ghi ra đĩa không đáng
+IDLE_SECONDS = 24 * 3600
+
+Spilled = namedtuple('Spilled', 'path nbytes')
+Spilled.__doc__ = """Placeholder left in session state for an artifact written to ``path`` (``nbytes`` in memory)."""
+
+SessionFootprint = namedtuple('SessionFootprint', 'session_id memory_bytes spilled_bytes dropped last_seen active')
+
+
+def artifact_size(value):
+    """Approximate in-memory size of one artifact in bytes (deep for DataFrames, 0 for placeholders)."""
+    if value is None or isinstance(value, Spilled):
+        return 0
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+class _Session:
+    def __init__(self, session_id, state):
+        self.session_id = session_id
+        self.state = state
+        self.sizes = {}  # khóa -> byte trong bộ nhớ ở cuối lần chạy gần nhất
+        self.spilled = {}  # khóa -> Spilled
+        self.dropped = set()
+        self.report = (0, 0, ())  # (byte trong bộ nhớ, byte ghi ra đĩa, khóa đã bỏ) ở cuối lần chạy gần nhất
+        self.last_seen = time.time()
+        self.active = False
+
+    @property
+    def memory_bytes(self):
+        return sum(self.sizes.values())
+
+    def snapshot(self):
+        self.report = (self.memory_bytes, sum(spilled.nbytes for spilled in self.spilled.values()),
+                       tuple(sorted(self.dropped)))
+
+
+class SessionDataManager:
+    """Per-session and global memory budget over the artifacts named in SPILLABLE_KEYS / DERIVED_KEYS.
+
+    One instance is shared by all sessions of a process; spill files live in a
+    temporary directory under ``spill_root`` that is removed with the manager.
+    Call ``begin`` at the start of a run and ``end`` when the page is rendered.
+    ``alive(session_id)`` tells whether a session still exists (None = only
+    the idle timeout applies).
+    """
+
+    def __init__(self, spill_root=None, session_budget=SESSION_BUDGET_BYTES, global_budget=GLOBAL_BUDGET_BYTES,
+                 min_spill_bytes=MIN_SPILL_BYTES, idle_seconds=IDLE_SECONDS, alive=None, spillable=SPILLABLE_KEYS,
+                 derived=None):
+        self.session_budget = session_budget
+        self.global_budget = global_budget
+        self.min_spill_bytes = min_spill_bytes
+        self.idle_seconds = idle_seconds
+        self.alive = alive
+        self.spillable = tuple(spillable)
+        self.derived = dict(DERIVED_KEYS if derived is None else derived)
+        if spill_root:
+            os.makedirs(spill_root, exist_ok=True)
+        self.directory = tempfile.mkdtemp(prefix="sessions-", dir=spill_root)
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.directory, True)
+        self._sessions = {}
+        self._lock = threading.RLock()
+
+    def begin(self, session_id, state):
+        """Loads the session's spilled artifacts back into ``state``; returns the keys dropped since the last run.
+
+        The caller rebuilds the dropped keys (they are None in ``state``). An
+        artifact whose spill file cannot be read is reported as dropped too.
+        """
+        with self._lock:
+            session = self._session(session_id, state)
+            session.active = True
+            session.last_seen = time.time()
+            dropped = set(session.dropped)
+            for key in self.spillable:  # Theo chỗ giữ chỗ trong trạng thái, cả khi phiên đã bị quên
+                if key in state and isinstance(state[key], Spilled):
+                    value = self._load(state[key])
+                    if value is None:
+                        dropped.add(key)
+                    state[key] = value
+            session.spilled.clear()
+            session.dropped.clear()
+            self._collect()
+            return dropped
+
+    def end(self, session_id, state):
+        """Measures the session's artifacts, then enforces the session budget and the global budget."""
+        with self._lock:
+            self._collect()
+            session = self._session(session_id, state)
+            session.active = False
+            session.last_seen = time.time()
+            self._measure(session, state)
+            if session.memory_bytes > self.session_budget:
+                self._shrink(session, state, session.memory_bytes - self.session_budget, spill_first=True)
+            session.snapshot()
+            self._enforce_global(session)
+
+    def forget(self, session_id):
+        """Removes a session and its spill files (e.g. on logout)."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                shutil.rmtree(self._session_dir(session_id), ignore_errors=True)
+
+    def footprint(self, session_id=None):
+        """SessionFootprint of every live session (most recently seen first), or of one session (None if unknown).
+
+        The sizes are those at the end of each session's last run, after the budgets were applied.
+        """
+        with self._lock:
+            self._collect()
+            rows = [SessionFootprint(sid, *session.report, session.last_seen, session.active)
+                    for sid, session in self._sessions.items()]
+        rows.sort(key=lambda row: row.last_seen, reverse=True)
+        if session_id is None:
+            return rows
+        return next((row for row in rows if row.session_id == session_id), None)
+
+    def total_bytes(self):
+        """In-memory bytes of the managed artifacts of all sessions (as of their last run)."""
+        with self._lock:
+            return sum(session.memory_bytes for session in self._sessions.values())
+
+    def _session(self, session_id, state):
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = _Session(session_id, state)
+        session.state = state  # Streamlit tạo lớp bọc mới mỗi lần chạy, cùng một trạng thái phiên bên trong
+        return session
+
+    def _collect(self):
+        """Forgets closed sessions and sessions idle for longer than ``idle_seconds``."""
+        now = time.time()
+        for session_id in [sid for sid, session in self._sessions.items() if not session.active and (
+                now - session.last_seen > self.idle_seconds or (self.alive is not None and not self.alive(sid)))]:
+            self.forget(session_id)
+
+    def _measure(self, session, state):
+        sizes = {key: artifact_size(state[key]) for key in (*self.derived, *self.spillable) if key in state}
+        session.sizes = {key: size for key, size in sizes.items() if size}
+
+    def _candidates(self, session, spill_first):
+        """(key, bytes, derived) in eviction order: derived first (last with ``spill_first``), then largest first."""
+        return sorted(((key, size, key in self.derived) for key, size in session.sizes.items()
+                       if size >= self.min_spill_bytes),
+                      key=lambda item: (item[2] == spill_first, -item[1]))
+
+    def _shrink(self, session, state, excess, spill_first=False):
+        """Drops / spills artifacts of ``session`` until ``excess`` bytes are freed; returns the bytes freed.
+
+        With ``spill_first`` derived artifacts are dropped only once every other
+        artifact is spilled (the session keeps them for its next run if it can).
+        """
+        freed = 0
+        for key, size, derived in self._candidates(session, spill_first):
+            if freed >= excess:
+                break
+            if derived:
+                for dependent in self.derived[key]:
+                    self._replace(state, dependent, None)
+                self._replace(state, key, None)
+                session.dropped.add(key)
+            else:
+                spilled = self._spill(session, key, state[key], size)
+                if spilled is None:
+                    continue  # Không ghi được ra đĩa: giữ trong bộ nhớ
+                self._replace(state, key, spilled)
+                session.spilled[key] = spilled
+            del session.sizes[key]
+            freed += size
+        return freed
+
+    def _enforce_global(self, current=None):
+        total = sum(session.memory_bytes for session in self._sessions.values())
+        if total <= self.global_budget:
+            return
+        for session in sorted(self._sessions.values(), key=lambda item: item.last_seen):  # Lâu không dùng nhất trước
+            if session.active:
+                continue  # Phiên đang chạy không bị đụng tới
+            excess = total - self.global_budget
+            total -= self._shrink(session, session.state, excess, spill_first=session is current)
+            session.snapshot()
+            if total <= self.global_budget:
+                return
+
+    @staticmethod
+    def _replace(state, key, value):
+        if key in state:
+            del state[key]  # Xóa hẳn giá trị cũ (Streamlit giữ bản cũ đến hết lần chạy sau nếu chỉ gán đè)
+        state[key] = value
+
+    def _session_dir(self, session_id):
+        return os.path.join(self.directory, str(session_id))
+
+    def _spill(self, session, key, value, size):
+        directory = self._session_dir(session.session_id)
+        path = os.path.join(directory, f"{key}.pkl")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(path, "wb") as file:
+                pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+        except (OSError, pickle.PicklingError):
+            self._remove(path)
+            return None
+        return Spilled(path, size)
+
+    def _load(self, spilled):
+        try:
+            with open(spilled.path, "rb") as file:
+                return pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        finally:
+            self._remove(spilled.path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
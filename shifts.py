@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""Shift definitions: names, hours, staffing per day and availability matching.
+
+``requirements["shifts_definition"]`` maps each shift name to
+``{"start": "HH:MM", "end": "HH:MM"}`` plus two optional keys:
+
+* ``"keywords"``: words in an availability cell that mean this shift
+  (defaults: the classic lists for 'Ca 1' / 'Ca 2', the lower-cased name otherwise);
+* ``"staff"``: people needed, one number for every day or seven numbers
+  Monday..Sunday (default: 2 on double days such as 5/5, otherwise 1).
+
+A ``ShiftModel`` built from it classifies availability text read by the
+tokenizer of ``availability_text`` (diacritic-insensitive): 'nghỉ'/'off'/'bận'
+means no shift; time ranges ('9h-15h', '2pm-8pm', 'từ 16h') pick the shifts they
+cover fully, or else the one they overlap most; a lone time ('9h', '2h chiều')
+picks the shift with that keyword or start time, or else the one containing it;
+keywords in the rest of the text add their shifts; text naming nothing means
+every shift. ``available_hours`` also keeps the partial hours a range gives
+inside each shift. Each distinct text is classified once per model.
+"""
+import json
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from availability_text import DAY_MINUTES, DEFAULT_TOKENIZER, HALF_DAY, MEMO_SIZE, normalize_text
+
+DEFAULT_SHIFTS_DEFINITION = {"Ca 1": {"start": "09:00", "end": "15:00"}, "Ca 2": {"start": "14:00", "end": "20:00"}}
+DISPLAY_SLOTS = 3  # Số ô nhân viên tối thiểu mỗi ca trong bảng hiển thị/chỉnh sửa
+
+# Từ khóa mặc định của hai ca cổ điển; giờ ('9h', '2h') được so như giờ, không như chuỗi con
+CA1_KEYWORDS = ['ca 1', 'sáng', '9h', '9:00']
+CA2_KEYWORDS = ['ca 2', 'chiều', '14h', '2h', '14:00']
+DEFAULT_KEYWORDS = {'Ca 1': CA1_KEYWORDS, 'Ca 2': CA2_KEYWORDS}
+
+
+class ShiftConfigError(ValueError):
+    """Invalid shift definition (bad time, empty name, wrong staffing list...)."""
+
+
+def staff_needed(day):
+    """Classic staffing rule: 2 people per shift on double days (3/3, 5/5...), otherwise 1."""
+    return 2 if day.day == day.month else 1
+
+
+def to_minutes(hhmm):
+    """Converts 'HH:MM' to minutes since midnight; raises ShiftConfigError on malformed input."""
+    match = re.fullmatch(r"\s*(\d{1,2})\s*(?:[:hH]\s*(\d{2})?)?\s*", str(hhmm))
+    if not match or int(match.group(1)) > 24 or int(match.group(2) or 0) > 59:
+        raise ShiftConfigError(f"Giờ không hợp lệ: '{hhmm}' (định dạng HH:MM)")
+    return int(match.group(1)) * 60 + int(match.group(2) or 0)
+
+
+def parse_time_ranges(text):
+    """Explicit time ranges in ``text`` ('9h-15h', 'từ 16h'...) as (start, end) minute intervals."""
+    return list(DEFAULT_TOKENIZER.tokenize(text).intervals)
+
+
+def _overlap(a, b):
+    return max(0, min(a[1], b[1]) - max(a[0], b[0]))
+
+
+class ShiftModel:
+    """Ordered shifts with their intervals, keyword patterns/times and staffing curves."""
+
+    def __init__(self, shifts_definition=None, tokenizer=None):
+        if shifts_definition is None:
+            shifts_definition = DEFAULT_SHIFTS_DEFINITION
+        if not shifts_definition:
+            raise ShiftConfigError("Cần ít nhất một ca làm việc.")
+        self.names = []
+        self.intervals = {}  # name -> (start, end) phút; ca qua đêm kết thúc ở ngày hôm sau
+        self.patterns = {}  # name -> regex từ khóa (đã bỏ dấu), None khi chỉ có từ khóa giờ
+        self.keyword_times = {}  # name -> frozenset phút của từ khóa giờ ('9h', '14:00')
+        self.tokenizer = tokenizer or DEFAULT_TOKENIZER
+        self._memo = {}  # chuỗi đã chuẩn hóa -> (cờ từng ca, giờ rảnh từng ca, ca được nhắc tới)
+        self._staff = {}  # name -> tuple 7 số (T2..CN) hoặc None (quy tắc ngày đôi)
+        for name, spec in shifts_definition.items():
+            name = str(name).strip()
+            if not name or name in self.intervals:
+                raise ShiftConfigError(f"Tên ca trống hoặc bị trùng: '{name}'")
+            if not isinstance(spec, dict) or not spec.get("start") or not spec.get("end"):
+                raise ShiftConfigError(f"{name}: cần giờ bắt đầu và kết thúc ('start', 'end').")
+            start, end = to_minutes(spec["start"]), to_minutes(spec["end"])
+            if end <= start:
+                end += DAY_MINUTES
+            keywords = [str(k).strip().lower() for k in (spec.get("keywords") or DEFAULT_KEYWORDS.get(name, [name]))
+                        if str(k).strip()]
+            self.names.append(name)
+            self.intervals[name] = (start, end)
+            self._add_keywords(name, keywords or [name.lower()])
+            self._staff[name] = self._parse_staff(name, spec.get("staff"))
+        self.default_staffing = all(curve is None for curve in self._staff.values())
+
+    def _add_keywords(self, name, keywords):
+        words, times = [], set()
+        for keyword in keywords:
+            tokens = self.tokenizer.tokenize(keyword)
+            if tokens.times and not tokens.rest and not tokens.intervals:
+                times.update(tokens.times)
+            else:
+                words.append(re.escape(normalize_text(keyword)).replace(r'\ ', r'\s*'))  # 'ca 1' khớp cả 'ca1'
+        self.patterns[name] = re.compile(rf"(?<![a-z0-9])(?:{'|'.join(words)})(?![a-z0-9])") if words else None
+        self.keyword_times[name] = frozenset(times)
+
+    @staticmethod
+    def _parse_staff(name, staff):
+        if staff is None or (isinstance(staff, str) and not staff.strip()):
+            return None
+        values = re.split(r"[,;\s]+", staff.strip()) if isinstance(staff, str) else (
+            list(staff) if isinstance(staff, (list, tuple)) else [staff])
+        try:
+            counts = [int(v) for v in values if str(v).strip() != '']
+        except (TypeError, ValueError):
+            raise ShiftConfigError(f"Số người của {name} phải là số nguyên: '{staff}'") from None
+        if len(counts) == 1:
+            counts *= 7
+        if len(counts) != 7 or min(counts) < 0:
+            raise ShiftConfigError(f"Số người của {name}: nhập 1 số hoặc 7 số (Thứ 2 → Chủ Nhật), không âm.")
+        return tuple(counts)
+
+    def staff_needed(self, day, shift):
+        """People needed for ``shift`` on ``day`` (0 for an unknown shift)."""
+        if shift not in self._staff:
+            return 0
+        curve = self._staff[shift]
+        return staff_needed(day) if curve is None else curve[day.weekday()]
+
+    def staff_curve(self, shift):
+        """Configured 7-day staffing of ``shift`` (None when the double-day rule applies)."""
+        return self._staff.get(shift)
+
+    def slots(self, shift):
+        """Editor/display slots for ``shift``: the most people it can need, at least DISPLAY_SLOTS."""
+        curve = self._staff.get(shift)
+        return max(DISPLAY_SLOTS, max(curve) if curve else 2)
+
+    def slot_counts(self):
+        return {name: self.slots(name) for name in self.names}
+
+    def match_ranges(self, ranges):
+        """Shifts fully inside one of ``ranges``; if none, the shift(s) with the largest overlap."""
+        full, best, best_overlap = set(), set(), 0
+        for start, end in ranges:
+            for name, interval in self.intervals.items():
+                # So cả với khoảng dời sang ngày hôm sau (ca qua đêm, '22h-6h')
+                overlap = max(_overlap((start, end), interval), _overlap((start, end), (interval[0] + DAY_MINUTES,
+                                                                                         interval[1] + DAY_MINUTES)))
+                if overlap >= interval[1] - interval[0]:
+                    full.add(name)
+                elif overlap > best_overlap:
+                    best, best_overlap = {name}, overlap
+                elif overlap and overlap == best_overlap:
+                    best.add(name)
+        return full or best
+
+    def match_times(self, times):
+        """Shifts of lone times: keyword time ('9h'), else the shift starting then, else the one containing it.
+
+        A time before noon without am/pm is also tried twelve hours later ('2h' -> 14:00)."""
+        found = set()
+        for moment in times:
+            candidates = (moment, moment + HALF_DAY) if moment < HALF_DAY else (moment,)
+            hits = {name for name in self.names if moment in self.keyword_times[name]}
+            hits = hits or {name for name in self.names if self.intervals[name][0] in candidates}
+            for candidate in candidates if not hits else ():
+                hits = {name for name, (start, end) in self.intervals.items()
+                        if start <= candidate < end or start <= candidate + DAY_MINUTES < end}
+                if hits:
+                    break
+            found |= hits
+        return found
+
+    def _clip(self, name, ranges):
+        """Parts of ``ranges`` inside shift ``name`` (in the shift's own minutes)."""
+        start, end = self.intervals[name]
+        parts = []
+        for low, high in ranges:
+            for shift in (0, DAY_MINUTES):
+                part = (max(low, start + shift) - shift, min(high, end + shift) - shift)
+                if part[1] > part[0]:
+                    parts.append(part)
+        return tuple(sorted(set(parts)))
+
+    def _evaluate(self, normalized):
+        tokens = self.tokenizer.tokenize_normalized(normalized)
+        named = {name for name, pattern in self.patterns.items() if pattern is not None and pattern.search(tokens.rest)}
+        named |= self.match_times(tokens.times)
+        ranged = self.match_ranges(tokens.intervals) if tokens.intervals else set()
+        mentioned = frozenset(named | ranged)
+        if tokens.off:
+            return (False,) * len(self.names), {}, mentioned
+        if not mentioned and not tokens.intervals and not tokens.times and normalized:
+            named = set(self.names)  # Không nêu ca cụ thể: làm được mọi ca
+        hours = {}
+        for name in self.names:
+            parts = (self.intervals[name],) if name in named else self._clip(name, tokens.intervals)
+            if parts:
+                hours[name] = parts
+        return tuple(name in named or name in ranged for name in self.names), hours, mentioned
+
+    def _parsed(self, text):
+        normalized = normalize_text(text)
+        result = self._memo.get(normalized)
+        if result is None:
+            if len(self._memo) >= MEMO_SIZE:
+                self._memo.clear()
+            result = self._memo[normalized] = self._evaluate(normalized)
+        if result[0] != (False,) * len(self.names) and self.tokenizer.raw_off(text):
+            result = (False,) * len(self.names), {}, result[2]  # 'bận' (có dấu) dùng chung khóa với 'bạn'
+        return result
+
+    def classify_text(self, text):
+        """Tuple of booleans (one per shift) for one availability cell."""
+        return self._parsed(text)[0]
+
+    def available_hours(self, text):
+        """{shift: ((start, end), ...)} minutes the cell leaves free in each shift; partial for '9h-12h'."""
+        return self._parsed(text)[1]
+
+    def mentioned_shifts(self, text):
+        """Shifts a free-text note names by keyword, time or range (no 'all shifts' default, off ignored)."""
+        return self._parsed(text)[2]
+
+    def classify(self, texts):
+        """Boolean matrix [len(texts), len(names)]; each distinct text is classified once."""
+        codes, uniques = pd.factorize(pd.Series(texts, dtype=object), use_na_sentinel=False)
+        table = np.array([self.classify_text(text) for text in uniques], dtype=bool).reshape(
+            len(uniques), len(self.names))
+        return table[codes]
+
+
+@lru_cache(maxsize=32)
+def _cached_model(definition_json):
+    return ShiftModel(json.loads(definition_json))
+
+
+def shift_model(requirements=None):
+    """The ShiftModel of ``requirements`` (cached per distinct shift definition)."""
+    definition = (requirements or {}).get("shifts_definition") or DEFAULT_SHIFTS_DEFINITION
+    return _cached_model(json.dumps(definition, ensure_ascii=False, default=list))
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""Deterministic local scheduling engine (no AI round trip).
+
+Reads the availability lookup table built by ``preprocess_pasted_data_for_lookup``
+(columns Date / Employee / Shift / Can_Work / Note) and the ``requirements`` dict
+from ``get_scheduling_requirements`` and returns the same 3-column schedule
+DataFrame that ``parse_ai_schedule`` produces.
+"""
+from datetime import timedelta
+
+import pandas as pd
+
+from note_intents import apply_note_intents, note_intents
+from schedule_table import SCHEDULE_COLUMNS, build_assignment_index
+from shifts import shift_model
+
+
+def _week_key(day):
+    """Monday of the week containing ``day``."""
+    return day - timedelta(days=day.weekday())
+
+
+def _is_excluded(name):
+    """FM/Sup rows are never scheduled (same rule as the AI prompt)."""
+    return "fm/sup" in name.lower()
+
+
+class _RosterState:
+    """Running per-employee counters used to check hard constraints in O(1)."""
+
+    def __init__(self, requirements, intervals):
+        self.max_per_day = int(requirements.get("max_shifts_per_day", 1))
+        self.week_target = int(requirements.get("shifts_per_week_target", 4))
+        self.max_consecutive = int(requirements.get("max_consecutive_days", 7))
+        self.min_rest_minutes = int(requirements.get("min_rest_hours", 0)) * 60
+        self.intervals = intervals
+        self.caps = {}  # employee -> số ca/tuần tối đa theo ghi chú
+        self.by_day = {}  # (employee, date) -> [shift, ...]
+        self.by_week = {}  # (employee, monday) -> count
+        self.days = {}  # employee -> set(date)
+
+    def week_load(self, employee, day):
+        return self.by_week.get((employee, _week_key(day)), 0)
+
+    def _streak_with(self, employee, day):
+        """Length of the consecutive-day run that ``day`` would belong to."""
+        worked = self.days.get(employee, set())
+        streak = 1
+        probe = day - timedelta(days=1)
+        while probe in worked:
+            streak += 1
+            probe -= timedelta(days=1)
+        probe = day + timedelta(days=1)
+        while probe in worked:
+            streak += 1
+            probe += timedelta(days=1)
+        return streak
+
+    def _rest_ok(self, employee, day, shift):
+        start, end = self.intervals[shift]
+        for offset in (-1, 0, 1):
+            other_day = day + timedelta(days=offset)
+            for other_shift in self.by_day.get((employee, other_day), []):
+                o_start, o_end = self.intervals[other_shift]
+                o_start += offset * 24 * 60
+                o_end += offset * 24 * 60
+                gap = o_start - end if o_start >= end else start - o_end
+                if gap < self.min_rest_minutes:
+                    return False
+        return True
+
+    def can_take(self, employee, day, shift):
+        today = self.by_day.get((employee, day), [])
+        if shift in today or len(today) >= self.max_per_day:
+            return False
+        if self.week_load(employee, day) >= min(self.week_target, self.caps.get(employee, self.week_target)):
+            return False
+        if day not in self.days.get(employee, set()) and self._streak_with(employee, day) > self.max_consecutive:
+            return False
+        return self._rest_ok(employee, day, shift)
+
+    def assign(self, employee, day, shift):
+        self.by_day.setdefault((employee, day), []).append(shift)
+        week = (employee, _week_key(day))
+        self.by_week[week] = self.by_week.get(week, 0) + 1
+        self.days.setdefault(employee, set()).add(day)
+
+
+def solve_schedule(availability_df, requirements, fixed=None):
+    """Builds a schedule from availability with a deterministic greedy solver.
+
+    Slots with the fewest candidates relative to their staffing need are filled
+    first. Within a slot, employees furthest from ``shifts_per_week_target`` and
+    with the fewest remaining options are preferred; names break ties so the
+    result never changes between runs. Understaffed slots are marked with
+    '(Thiếu N người)' exactly like the AI output.
+
+    ``fixed`` maps (date, shift) to names that are kept as they are (see
+    warm_start_assignments); only the other slots are solved, with the fixed
+    shifts counted against everyone's limits.
+
+    Notes are read by note_intents: week off, off days, blocked shifts and
+    working hours remove slots; people who can only work part of a shift are
+    picked after everyone who can work all of it; a preferred day or shift
+    counts as ``preferences_weight_hint`` shifts less of weekly load; a weekly
+    cap from a note lowers that employee's target.
+    """
+    if availability_df is None or availability_df.empty:
+        return pd.DataFrame(columns=SCHEDULE_COLUMNS)
+
+    model = shift_model(requirements)
+    shift_names = model.names
+    state = _RosterState(requirements, model.intervals)
+
+    lookup = availability_df[["Date", "Employee", "Shift", "Can_Work"]].copy()
+    lookup["Date"] = pd.to_datetime(lookup["Date"]).dt.date
+    lookup["Employee"] = lookup["Employee"].astype(str).str.strip()
+    dates = sorted(lookup["Date"].unique())
+    notes = apply_note_intents(lookup, note_intents(availability_df, model), model)
+    lookup, partial, preference = notes.lookup, notes.partial, notes.preference
+    state.caps = notes.caps
+    weight = float(requirements.get("preferences_weight_hint", 0.7))
+
+    available = lookup[(lookup["Can_Work"] == True) & lookup["Shift"].isin(shift_names)]
+    available = available[~available["Employee"].map(_is_excluded)]
+    candidates = {key: sorted(set(group)) for key, group in available.groupby(["Date", "Shift"])["Employee"]}
+    remaining_options = available.groupby("Employee").size().to_dict()
+
+    slots = [(day, shift) for day in dates for shift in shift_names]
+    shift_rank = {name: i for i, name in enumerate(shift_names)}
+    slots.sort(key=lambda slot: (len(candidates.get(slot, ())) - model.staff_needed(*slot), slot[0],
+                                 shift_rank[slot[1]]))
+
+    assignments = {}
+    for (day, shift), names in (fixed or {}).items():
+        if shift in shift_rank and day in dates:
+            for emp in names:
+                state.assign(emp, day, shift)
+            for emp in candidates.get((day, shift), ()):
+                remaining_options[emp] -= 1
+            assignments[(day, shift)] = list(names)
+    slots = [slot for slot in slots if slot not in assignments]
+    for day, shift in slots:
+        need = model.staff_needed(day, shift)
+        pool = [emp for emp in candidates.get((day, shift), ()) if state.can_take(emp, day, shift)]
+        pool.sort(key=lambda emp: ((emp, day, shift) in partial,
+                                   state.week_load(emp, day) - weight * preference.get((emp, day, shift), 0),
+                                   remaining_options.get(emp, 0), emp))
+        chosen = pool[:need]
+        for emp in chosen:
+            state.assign(emp, day, shift)
+        for emp in candidates.get((day, shift), ()):
+            remaining_options[emp] -= 1
+        assignments[(day, shift)] = chosen
+
+    rows = []
+    for day in dates:
+        for shift in shift_names:
+            chosen = assignments.get((day, shift), [])
+            staff = list(chosen)
+            missing = model.staff_needed(day, shift) - len(chosen)
+            if missing > 0:
+                staff.append(f"(Thiếu {missing} người)")
+            rows.append({"Ngày": pd.Timestamp(day), "Ca": shift, "Nhân viên được phân công": ", ".join(staff)})
+    return pd.DataFrame(rows, columns=SCHEDULE_COLUMNS)
+
+
+def _availability_by_day(availability_df, model):
+    """date -> frozenset of (employee, shift) pairs that can be worked (after the notes)."""
+    lookup = availability_df[["Date", "Employee", "Shift", "Can_Work"]].copy()
+    lookup["Date"] = pd.to_datetime(lookup["Date"]).dt.date
+    lookup["Employee"] = lookup["Employee"].astype(str).str.strip()
+    lookup = apply_note_intents(lookup, note_intents(availability_df, model), model).lookup
+    lookup = lookup[lookup["Can_Work"] == True]
+    days = {day: frozenset() for day in pd.to_datetime(availability_df["Date"]).dt.date.unique()}
+    for day, group in lookup.groupby("Date"):
+        days[day] = frozenset(zip(group["Employee"], group["Shift"]))
+    return days
+
+
+def warm_start_assignments(previous_availability, previous_schedule, availability_df, requirements):
+    """Assignments of an earlier week that can be reused as-is for ``availability_df``.
+
+    Days are matched by weekday. A day is reused when the same people can work
+    the same shifts as on that weekday before, the staffing is unchanged and the
+    earlier schedule filled every slot with names that are still available.
+    Returns (fixed, changed_dates): ``fixed`` is meant for
+    ``solve_schedule(..., fixed=fixed)``, which then only solves the changed days.
+    """
+    if availability_df is None or availability_df.empty:
+        return {}, []
+    model = shift_model(requirements)
+    current = _availability_by_day(availability_df, model)
+    previous = {} if previous_availability is None or previous_availability.empty else {
+        day.weekday(): (day, pairs) for day, pairs in _availability_by_day(previous_availability, model).items()}
+    previous_index = build_assignment_index(previous_schedule)
+
+    fixed, changed = {}, []
+    for day in sorted(current):
+        previous_day, previous_pairs = previous.get(day.weekday(), (None, None))
+        kept = {}
+        if previous_pairs == current[day]:
+            for shift in model.names:
+                need = model.staff_needed(day, shift)
+                if need != model.staff_needed(previous_day, shift):
+                    break
+                names = [name for name in previous_index.get((previous_day, shift), ())
+                         if (name, shift) in current[day] and not _is_excluded(name)]
+                if len(names) != need:
+                    break
+                kept[(day, shift)] = names
+            else:
+                fixed.update(kept)
+                continue
+        changed.append(day)
+    return fixed, changed
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""The modules live at the repository root (app.py imports them as top-level modules)."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""ResponseCache expiry and LRU eviction under a fake clock."""
+import pytest
+
+import ai_cache
+from ai_cache import ResponseCache, make_cache_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(ai_cache.time, "time", fake.time)
+    return fake
+
+
+def test_key_ignores_cosmetic_prompt_differences():
+    assert make_cache_key("a  \r\nb\n", "m", {}) == make_cache_key("a\nb", "m", None)
+    assert make_cache_key("a", "m", {}) != make_cache_key("a", "other", {})
+
+
+def test_entries_expire_by_creation_time_even_when_used(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path), ttl_seconds=100)
+    cache.put("k", "text", "model")
+    clock.now += 60
+    assert cache.get("k")["text"] == "text"  # Lần dùng không kéo dài hạn
+    clock.now += 41
+    assert cache.get("k") is None
+    assert cache.stats() == (0, 0)
+
+
+def test_evict_drops_expired_entries(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path), ttl_seconds=100)
+    cache.put("old", "a")
+    clock.now += 101
+    cache.put("new", "b")  # put() dọn mục hết hạn
+    assert cache.stats()[0] == 1 and cache.get("new")["text"] == "b"
+
+
+def test_least_recently_used_entry_is_evicted_first(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path), max_entries=2)
+    cache.put("a", "1")
+    clock.now += 1
+    cache.put("b", "2")
+    clock.now += 1
+    assert cache.get("a") is not None  # 'a' vừa được dùng: 'b' giờ là cũ nhất
+    clock.now += 1
+    cache.put("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a")["text"] == "1" and cache.get("c")["text"] == "3"
+
+
+def test_size_limit_keeps_the_newest_entries(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path), max_bytes=250)
+    for i in range(5):
+        cache.put(f"k{i}", "x" * 60)
+        clock.now += 1
+    count, total = cache.stats()
+    assert total <= 250 and count >= 1
+    assert cache.get("k4") is not None and cache.get("k0") is None
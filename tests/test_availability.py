@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Availability lookup: the columnar builder against the original row loop, and the AvailabilityMatrix round trip."""
+import pandas as pd
+import pytest
+
+from availability import AvailabilityMatrix, compact_lookup, find_day_columns, find_employee_column, find_note_column
+from benchmarks.bench_preprocess import COLUMNS, legacy_lookup, make_roster
+from scheduler import preprocess_pasted_data_for_lookup
+
+MESSY_ROWS = [
+    ["  Nguyễn Văn An ", "05/05/2025", "Ca 1", " CA 2 ", "ca 1, ca 2", "NGHỈ", "Off", "bận việc", None],
+    ["Trần Thị Bình", "05/05/2025", "Sáng", "chiều", "Sáng + Chiều", "", None, "Ca 1 (9:00)", "14:00"],
+    ["John Smith", "05/05/2025", "off", "OFF all day", "Có thể", "any", "ok", "9h", "14h"],
+    [None, "05/05/2025", "Ca 1", "Ca 1", "Ca 1", "Ca 1", "Ca 1", "Ca 1", "Ca 1"],  # Dòng không tên: bỏ qua
+    ["Lê Chi", "05/05/2025", "Ca 1 (sáng)", "nghỉ", "Ca 2 (chiều)", "x", "Thứ 6 được", "   ", "ca 1"],
+]
+MESSY_NOTES = [None, "Muốn làm Ca 1", "Can work weekends", None, "Xin off Thứ 2"]
+
+
+def messy_roster():
+    return pd.DataFrame([row + [note] for row, note in zip(MESSY_ROWS, MESSY_NOTES)], columns=COLUMNS)
+
+
+def reference(df_input):
+    args = (df_input, pd.Timestamp("2025-05-05"), find_employee_column(df_input), find_note_column(df_input),
+            find_day_columns(df_input))
+    return compact_lookup(legacy_lookup(*args))
+
+
+@pytest.mark.parametrize("df_input", [messy_roster(), make_roster(200, seed=3)], ids=["messy", "generated"])
+def test_preprocess_matches_the_row_by_row_reference(df_input):
+    pd.testing.assert_frame_equal(preprocess_pasted_data_for_lookup(df_input), reference(df_input))
+
+
+def test_messy_cells():
+    lookup = preprocess_pasted_data_for_lookup(messy_roster())
+    can_work = {(row.Employee, row.Date.day, row.Shift): row.Can_Work for row in lookup.itertuples()}
+    assert set(lookup['Employee']) == {"Nguyễn Văn An", "Trần Thị Bình", "John Smith", "Lê Chi"}
+    assert len(lookup) == 4 * 7 * 2
+    assert (can_work[("Nguyễn Văn An", 6, "Ca 1")], can_work[("Nguyễn Văn An", 6, "Ca 2")]) == (False, True)
+    assert not any(can_work[("Nguyễn Văn An", day, shift)] for day in (8, 9, 10) for shift in ("Ca 1", "Ca 2"))
+    assert can_work[("Trần Thị Bình", 11, "Ca 2")] and not can_work[("Trần Thị Bình", 11, "Ca 1")]
+    assert can_work[("Nguyễn Văn An", 11, "Ca 1")]  # Ô trống: rảnh cả ngày
+    assert can_work[("John Smith", 7, "Ca 1")] and can_work[("John Smith", 7, "Ca 2")]
+    assert not can_work[("Lê Chi", 10, "Ca 1")]  # Ô chỉ có khoảng trắng: không đăng ký
+
+
+def test_matrix_round_trip():
+    lookup = preprocess_pasted_data_for_lookup(make_roster(50, seed=5))
+    matrix = AvailabilityMatrix.from_lookup(lookup)
+    assert matrix.can_work.shape == (50, 7, 2)
+    pd.testing.assert_frame_equal(matrix.to_lookup(), lookup)
+    # Bảng đã chuyển kiểu object vẫn cho cùng ma trận
+    again = AvailabilityMatrix.from_lookup(lookup.astype(object))
+    assert (again.can_work == matrix.can_work).all() and list(again.employees) == list(matrix.employees)
+    assert AvailabilityMatrix.from_lookup(lookup.iloc[:0]).to_lookup().empty
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""Off words of the availability tokenizer and their effect on shift classification."""
+import pytest
+
+from availability_text import tokenize
+from shifts import ShiftModel
+
+
+@pytest.mark.parametrize('text', ["Làm ban ngày", "Ca nào cũng được bạn ơi", "ban ngay"])
+def test_ban_without_the_busy_accent_is_not_off(text):
+    assert not tokenize(text).off
+    assert ShiftModel().classify_text(text) == (True, True)
+
+
+@pytest.mark.parametrize('text', ["Bận", "bận ca 1", "BẬN", "Nghỉ", "off", "busy"])
+def test_off_words(text):
+    assert tokenize(text).off
+    assert ShiftModel().classify_text(text) == (False, False)
+
+
+def test_busy_and_friend_share_a_memo_key_but_not_a_result():
+    model = ShiftModel()
+    assert model.classify(["bạn", "bận", "bạn", "Ca 2"]).tolist() == [
+        [True, True], [False, False], [True, True], [False, True]]
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""call_with_policy against a local fake model: retry, fallback, deadline and breaker transitions."""
+import random
+
+import pytest
+
+from call_policy import BreakerRegistry, CallPolicy, CircuitBreaker, ModelCallError, call_with_policy
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class ServerError(Exception):
+    code = 503
+
+
+class BadRequest(Exception):
+    code = 400
+
+
+class FakeModel:
+    """Plays back ``outcomes`` (an exception to raise or a response text), advancing the clock by ``latency``."""
+
+    def __init__(self, clock, outcomes, latency=1.0):
+        self.clock = clock
+        self.outcomes = list(outcomes)
+        self.latency = latency
+        self.calls = 0
+
+    def generate_content(self, prompt, request_options=None, **kwargs):
+        self.calls += 1
+        self.clock.now += self.latency
+        outcome = self.outcomes.pop(0) if self.outcomes else "ok"
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def make_policy(**overrides):
+    options = dict(deadline_seconds=100.0, call_timeout_seconds=30.0, max_attempts_per_model=3,
+                   base_delay_seconds=1.0, max_delay_seconds=4.0, jitter=0.0, breaker_failure_threshold=3,
+                   breaker_reset_seconds=60.0)
+    options.update(overrides)
+    return CallPolicy(["primary", "fallback"], **options)
+
+
+def run(policy, models, clock, breakers=None):
+    breakers = breakers or BreakerRegistry(policy.breaker_failure_threshold, policy.breaker_reset_seconds, clock)
+    return call_with_policy("prompt", models.__getitem__, policy, breakers, clock=clock, sleep=clock.sleep,
+                            rng=random.Random(0))
+
+
+def test_retries_transient_errors_with_backoff():
+    clock = FakeClock()
+    models = {"primary": FakeModel(clock, [ServerError("503"), ServerError("503"), "done"])}
+    response, model_name, attempts = run(make_policy(), models, clock)
+    assert (response, model_name) == ("done", "primary")
+    assert [a["outcome"] for a in attempts] == ["retryable_error", "retryable_error", "ok"]
+    assert clock.now == 3 * 1.0 + 1.0 + 2.0  # Ba lần gọi + chờ 1s rồi 2s
+
+
+def test_non_retryable_error_falls_back_without_tripping_breaker():
+    clock = FakeClock()
+    policy = make_policy(breaker_failure_threshold=1)
+    breakers = BreakerRegistry(1, 60.0, clock)
+    models = {"primary": FakeModel(clock, [BadRequest("400 invalid prompt")]), "fallback": FakeModel(clock, ["ok"])}
+    response, model_name, attempts = run(policy, models, clock, breakers)
+    assert (response, model_name) == ("ok", "fallback")
+    assert models["primary"].calls == 1
+    assert breakers.get("primary").state == "closed"
+
+
+def test_exhausted_retries_open_breaker_and_skip_model():
+    clock = FakeClock()
+    breakers = BreakerRegistry(3, 60.0, clock)
+    models = {"primary": FakeModel(clock, [ServerError("503")] * 3), "fallback": FakeModel(clock, ["a", "b"])}
+    assert run(make_policy(), models, clock, breakers)[1] == "fallback"
+    assert breakers.get("primary").state == "open"
+    _, model_name, attempts = run(make_policy(), models, clock, breakers)
+    assert model_name == "fallback" and attempts[0]["outcome"] == "circuit_open"
+    assert models["primary"].calls == 3
+
+
+def test_deadline_stops_retrying():
+    clock = FakeClock()
+    models = {"primary": FakeModel(clock, [ServerError("503")] * 10, latency=4.0),
+              "fallback": FakeModel(clock, [ServerError("503")] * 10, latency=4.0)}
+    with pytest.raises(ModelCallError) as error:
+        run(make_policy(deadline_seconds=10.0), models, clock)
+    assert clock.now <= 10.0 + 4.0
+    assert all(a["outcome"] == "retryable_error" for a in error.value.attempts)
+
+
+def test_half_open_breaker_admits_one_probe():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=60.0, clock=clock)
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    clock.now = 60.0
+    assert breaker.state == "half-open"
+    assert breaker.allow()  # Lần gọi thử
+    assert not breaker.allow()  # Người gọi đồng thời phải chờ
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    clock.now = 120.0
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow() and breaker.allow()
+
+
+def test_abandoned_probe_expires():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=10.0, clock=clock)
+    breaker.record_failure()
+    clock.now = 10.0
+    assert breaker.allow() and not breaker.allow()
+    clock.now = 20.0
+    assert breaker.allow()
+
+
+class FakeStreamModel(FakeModel):
+    """Streams ``outcomes``: an exception raised before the first chunk, or a list of chunk texts."""
+
+    def generate_content(self, prompt, request_options=None, stream=False, **kwargs):
+        assert stream
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else ["ok"]
+
+        def chunks():
+            self.clock.now += self.latency
+            if isinstance(outcome, Exception):
+                raise outcome
+            yield from outcome
+
+        return chunks()
+
+
+def test_stream_is_retried_until_the_first_chunk_arrives():
+    clock = FakeClock()
+    models = {"primary": FakeStreamModel(clock, [ServerError("429 quota"), ["a", "b", "c"]])}
+    policy = make_policy()
+    breakers = BreakerRegistry(policy.breaker_failure_threshold, policy.breaker_reset_seconds, clock)
+    response, model_name, attempts = call_with_policy("prompt", models.__getitem__, policy, breakers, clock=clock,
+                                                      sleep=clock.sleep, rng=random.Random(0), stream=True)
+    assert model_name == "primary" and list(response) == ["a", "b", "c"]
+    assert [a["outcome"] for a in attempts] == ["retryable_error", "ok"]
+    assert attempts[-1]["latency"] == 1.0  # Thời gian tới chunk đầu tiên
+
+
+def test_request_ai_schedule_streams_chunks_and_reports_a_broken_stream(tmp_path):
+    from ai_cache import ResponseCache
+    from scheduler import StreamInterruptedError, request_ai_schedule
+
+    class Chunk:
+        def __init__(self, text):
+            self.text = text
+
+    def broken():
+        yield Chunk("| 2025-05-05 | Ca 1 | An |\n")
+        yield Chunk("| 2025-05-05 | Ca")
+        raise ConnectionError("reset")
+
+    clock = FakeClock()
+    cache = ResponseCache(str(tmp_path))
+    policy = make_policy()
+    breakers = BreakerRegistry(policy.breaker_failure_threshold, policy.breaker_reset_seconds, clock)
+    models = {"primary": FakeStreamModel(clock, [[Chunk("a\n"), Chunk("b\n")]])}
+    received = []
+    text, model_name, _ = request_ai_schedule("prompt", models.__getitem__, policy, breakers, cache=cache,
+                                              on_chunk=received.append)
+    assert (text, model_name, received) == ("a\nb\n", "primary", ["a\n", "b\n"])
+    assert request_ai_schedule("prompt", models.__getitem__, policy, breakers, cache=cache)[:2] == ("a\nb\n", None)
+
+    class BrokenStream:
+        def generate_content(self, prompt, request_options=None, stream=False, **kwargs):
+            return broken()
+
+    with pytest.raises(StreamInterruptedError) as error:
+        request_ai_schedule("other", {"primary": BrokenStream()}.__getitem__, policy, breakers, cache=cache,
+                            on_chunk=lambda text: None)
+    assert error.value.text == "| 2025-05-05 | Ca 1 | An |\n"
+    assert error.value.model_name == "primary"
+    assert len(list(tmp_path.glob("*.json"))) == 1  # Luồng bị ngắt không được lưu cache
+
+
+def test_request_ai_schedule_reports_fallback_and_cache_hits(tmp_path):
+    from ai_cache import ResponseCache
+    from scheduler import request_ai_schedule
+
+    class Response:
+        text = "| 2025-05-05 | Ca 1 | An |\n"
+
+    clock = FakeClock()
+    policy = make_policy()
+    breakers = BreakerRegistry(policy.breaker_failure_threshold, policy.breaker_reset_seconds, clock)
+    models = {"primary": FakeModel(clock, [BadRequest("400")]), "fallback": FakeModel(clock, [Response()])}
+    cache, messages = ResponseCache(str(tmp_path)), []
+
+    def notify(message, icon=None):
+        messages.append(icon)
+
+    request_ai_schedule("prompt", models.__getitem__, policy, breakers, cache=cache, notify=notify)
+    assert messages == ["⚠️", "✅"]
+    assert request_ai_schedule("prompt", models.__getitem__, policy, breakers, cache=cache, notify=notify)[1] is None
+    assert messages[-1] == "⚡"
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""Output names of the command-line batch: one target per input, never shared."""
+import pytest
+
+from cli import output_stems
+
+
+def test_unique_names_keep_their_stem():
+    assert output_stems(["in/a.tsv", "in/b.xlsx"]) == ["a", "b"]
+
+
+def test_same_name_different_extension_gets_the_extension():
+    assert output_stems(["r.tsv", "r.csv", "s.csv"]) == ["r_tsv", "r_csv", "s"]
+
+
+def test_same_file_name_in_two_folders_is_refused():
+    with pytest.raises(ValueError):
+        output_stems(["a/r.tsv", "b/r.tsv"])
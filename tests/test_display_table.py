@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Display table: create_8_column_df layout with three shifts and missing days."""
+import pandas as pd
+
+from schedule_table import STAFF_COLUMN
+from scheduler import create_8_column_df, display_columns, schedule_from_display
+
+SHIFTS = ["Ca 1", "Ca 2", "Đêm"]
+
+
+def schedule(rows):
+    return pd.DataFrame(rows, columns=['Ngày', 'Ca', STAFF_COLUMN])
+
+
+def test_three_shifts_three_staff():
+    rows = [(f"2025-05-{5 + d:02d}", shift, ", ".join(f"{shift} NV{i}" for i in range(1, 4)))
+            for d in range(7) for shift in SHIFTS]
+    df_display = create_8_column_df(schedule(rows), shifts=SHIFTS)
+    assert list(df_display.columns) == display_columns(SHIFTS, 3)
+    assert len(df_display.columns) == 2 + 3 * 3
+    assert list(df_display['Thứ']) == ["Thứ 2", "Thứ 3", "Thứ 4", "Thứ 5", "Thứ 6", "Thứ 7", "Chủ Nhật"]
+    assert df_display['Ngày'].iloc[0] == "05/05/2025"
+    assert df_display.loc[0, "Đêm (NV3)"] == "Đêm NV3"
+    # Bảng hiển thị đổi ngược lại đúng lịch ban đầu
+    back = schedule_from_display(df_display)
+    assert list(back[STAFF_COLUMN]) == [staff for _, _, staff in rows]
+
+
+def test_missing_days_and_shifts():
+    rows = [("2025-05-05", "Ca 1", "An"), ("2025-05-05", "Đêm", "Bình, Chi, Dũng, Em"),
+            ("2025-05-07", "Ca 2", ""), ("không phải ngày", "Ca 1", "Giang")]
+    df_display = create_8_column_df(schedule(rows), shifts=SHIFTS)
+    # Ngày 06/05 không có trong lịch thì không có dòng; ngày sai định dạng bị bỏ
+    assert list(df_display['Ngày']) == ["05/05/2025", "07/05/2025"]
+    # Ca Đêm có 4 người nên có 4 ô, các ca khác giữ tối thiểu 3 ô
+    assert list(df_display.columns) == display_columns(SHIFTS, {"Ca 1": 3, "Ca 2": 3, "Đêm": 4})
+    first, second = df_display.iloc[0], df_display.iloc[1]
+    assert (first["Ca 1 (NV1)"], first["Ca 1 (NV2)"], first["Ca 2 (NV1)"], first["Đêm (NV4)"]) == ("An", "", "", "Em")
+    assert (second[2:] == "").all()
+
+
+def test_empty_schedule():
+    assert list(create_8_column_df(None, shifts=SHIFTS).columns) == display_columns(SHIFTS, 3)
+    assert create_8_column_df(schedule([]), shifts=SHIFTS).empty
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""EmployeeRegistry: exact, diacritic/space-free and strict fuzzy name matching."""
+import pandas as pd
+
+from employee_registry import EmployeeRegistry
+from schedule_table import STAFF_COLUMN
+
+ROSTER = ["Trần Văn An", "Nguyễn Thị Bình", "NV 1", "NV 10", "Lê Chi", "  Lê  Chi  "]
+
+
+def test_exact_and_folded_names():
+    registry = EmployeeRegistry(ROSTER)
+    assert len(registry) == 5
+    assert registry.id_of("trần  văn an") == 0
+    assert registry.id_of("Tran Van An") == 0
+    assert registry.canonical("nguyen thi binh") == "Nguyễn Thị Bình"
+    # Bỏ khoảng trắng: 'NV1' là 'NV 1', không phải 'NV 10'
+    assert registry.id_of("NV1") == 2
+    assert registry.id_of("nv10") == 3
+
+
+def test_fuzzy_match_is_strict():
+    registry = EmployeeRegistry(ROSTER)
+    # Tên khác một chữ cái ở cuối là người khác
+    assert registry.id_of("Tran Van Anh") is None
+    assert registry.canonical("Tran Van Anh") == "Tran Van Anh"
+    assert registry.id_of("NV 100") is None
+    # Khác số từ thì không khớp gần đúng
+    assert registry.id_of("Nguyen Thi Binh Minh") is None
+    assert registry.id_of("Nguyễn Thị Bìnhh") == 1
+
+
+def test_codes_and_canonicalize_schedule():
+    registry = EmployeeRegistry(ROSTER)
+    assert list(registry.codes(["NV1", None, "Tran Van Anh", "le chi"])) == [2, -1, -1, 4]
+    schedule = pd.DataFrame({'Ngày': ["2025-05-05"], 'Ca': ["Ca 1"],
+                             STAFF_COLUMN: ["NV1, Tran Van Anh, (Thiếu 1 người)"]})
+    fixed, renamed = registry.canonicalize_schedule(schedule)
+    assert renamed == {"NV1": "NV 1"}
+    assert fixed[STAFF_COLUMN].iloc[0] == "NV 1, Tran Van Anh, (Thiếu 1 người)"
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""Reading 'Ghi chú' notes: polarity across clauses, 'chỉ làm', day ranges and unread clauses."""
+import pandas as pd
+import pytest
+
+from note_intents import note_classifier, note_intents, prompt_notes
+from shifts import shift_model
+
+
+@pytest.fixture
+def classify():
+    return note_classifier(shift_model()).classify
+
+
+@pytest.mark.parametrize('note, off_days', [
+    ("Xin off T2, T3", {0, 1}),
+    ("Nghỉ thứ 2 đến thứ 4", {0, 1, 2}),
+    ("Bận T6-CN", {4, 5, 6}),
+    ("Nghỉ CN tới T2", {6, 0}),
+])
+def test_off_days(classify, note, off_days):
+    assert classify(note).off_days == off_days
+
+
+def test_only_blocks_the_other_shifts(classify):
+    intent = classify("Thứ 2 nghỉ, thứ 3 chỉ làm ca 2")
+    assert intent.off_days == {0}
+    assert intent.blocked == {(1, 'Ca 1')}
+
+
+def test_polarity_is_not_inherited_by_a_sentence(classify):
+    intent = classify("Xin off Thứ 2, tuần này thi nên làm ít ca thôi")
+    assert intent.off_days == {0} and not intent.week_off and not intent.blocked
+    assert intent.unparsed == ("tuần này thi nên làm ít ca thôi",)
+
+
+def test_prompt_keeps_unread_clauses_verbatim():
+    notes = ["Xin off Thứ 2, tuần này thi nên làm ít ca thôi", "Muốn làm ca 1", "Đi học"]
+    lookup = pd.DataFrame({'Employee': ["An", "Bình", "Chi"], 'Note': notes})
+    intents = note_intents(lookup)
+    assert prompt_notes(lookup, intents) == {
+        "An": "tuần này thi nên làm ít ca thôi", "Bình": "ưu tiên Ca 1", "Chi": "Đi học"}
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""CandidateRanker scores and the per-slot cache the validator's edits invalidate."""
+from datetime import date, timedelta
+
+from ranking import BLOCKED_PENALTY, LOAD_WEIGHT, NOTE_WEIGHT, CandidateRanker
+from validation import ScheduleValidator
+
+DATES = [date(2025, 5, 5) + timedelta(days=i) for i in range(21)]
+SHIFTS = ["Ca 1", "Ca 2"]
+REQUIREMENTS = {"shifts_per_week_target": 4, "max_shifts_per_day": 1, "max_consecutive_days": 6,
+                "min_rest_hours": 0}
+
+
+def make_ranker(notes=None):
+    validator = ScheduleValidator(REQUIREMENTS, DATES, SHIFTS)
+    slots = {(day, shift): ("An", "Bình") for day in DATES for shift in SHIFTS}
+    return validator, CandidateRanker(validator, {'slots': slots}, notes)
+
+
+def test_scores_follow_load_day_and_notes():
+    validator, ranker = make_ranker({"Bình": "Muốn làm ca 2"})
+    assert ranker.score("An", DATES[1], "Ca 1") == (LOAD_WEIGHT * 4, ["0/4 ca tuần"])
+    assert ranker.score("Bình", DATES[1], "Ca 2")[0] == LOAD_WEIGHT * 4 + NOTE_WEIGHT * 0.7
+    assert ranker.score("Bình", DATES[1], "Ca 1")[0] == LOAD_WEIGHT * 4 - NOTE_WEIGHT * 0.7
+    validator.set_cell(DATES[1], "Ca 1", 0, "An")
+    assert ranker.score("An", DATES[1], "Ca 1")[0] == LOAD_WEIGHT * 4  # Ô của chính mình không tính vào tải
+    score, reasons = ranker.score("An", DATES[1], "Ca 2")
+    assert score == LOAD_WEIGHT * 3 - BLOCKED_PENALTY and "đã làm ca khác trong ngày" in reasons
+    assert ranker.ranked_names(DATES[1], "Ca 2") == ("Bình", "An")
+
+
+def test_edit_invalidates_only_slots_within_the_horizon():
+    validator, ranker = make_ranker()
+    same_week = ranker.rank(DATES[3], "Ca 2")
+    far_away = ranker.rank(DATES[20], "Ca 1")
+    other_person_far = ranker.rank(DATES[14], "Ca 2")
+    validator.set_cell(DATES[0], "Ca 1", 0, "An")
+    assert ranker.rank(DATES[20], "Ca 1") is far_away  # Ngoài horizon: giữ nguyên bộ đã tính
+    assert ranker.rank(DATES[14], "Ca 2") is other_person_far
+    updated = ranker.rank(DATES[3], "Ca 2")
+    assert updated is not same_week
+    assert dict((name, score) for name, score, _ in updated)["An"] == LOAD_WEIGHT * 3
+    assert ranker.ranked_names(DATES[3], "Ca 2") == ("Bình", "An")
+
+
+def test_detached_ranker_stops_following_edits():
+    validator, ranker = make_ranker()
+    before = ranker.rank(DATES[2], "Ca 1")
+    ranker.detach()
+    validator.set_cell(DATES[1], "Ca 1", 0, "An")
+    assert ranker.rank(DATES[2], "Ca 1") is before
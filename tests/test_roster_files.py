@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""read_csv_roster on exports with title lines, ragged rows and either CSV engine."""
+import pytest
+
+import roster_files
+from scheduler import RosterFormatError
+
+HEADER = "Tên nhân viên,Tuần,Thứ 2,Thứ 3,Thứ 4,Thứ 5,Thứ 6,Thứ 7,Chủ nhật,Ghi chú"
+ROWS = ("An,05/05/2025,Ca 1,Ca 2,OFF,Ca 1,Ca 1,Ca 2,Ca 1,\n"
+        "Bình,05/05/2025,Ca 2,,Ca 1,Ca 1,OFF,Ca 2,Ca 1,Xin nghỉ thứ 3\n")
+
+
+@pytest.fixture(params=['pyarrow', 'c'])
+def engine(request, monkeypatch):
+    monkeypatch.setattr(roster_files, '_csv_engine', lambda: request.param)
+    return request.param
+
+
+@pytest.mark.parametrize('title', ["", "Đăng ký ca tuần 19\n", "Cửa hàng Q1\nĐăng ký ca,tuần 19\n\n"])
+def test_title_lines_above_header_are_skipped(engine, title):
+    df = roster_files.read_csv_roster((title + HEADER + "\n" + ROWS).encode())
+    assert list(df.columns) == HEADER.split(",")
+    assert df["Tên nhân viên"].tolist() == ["An", "Bình"]
+    assert df.loc[1, "Ghi chú"] == "Xin nghỉ thứ 3"
+
+
+def test_extra_cells_in_a_data_row_are_ignored(engine):
+    data = (HEADER + "\n" + ROWS + "Chi,05/05/2025,Ca 1,Ca 1,Ca 1,Ca 1,Ca 1,Ca 1,Ca 1,,thừa\n").encode()
+    assert roster_files.read_csv_roster(data)["Tên nhân viên"].tolist() == ["An", "Bình", "Chi"]
+
+
+def test_unparseable_file_is_a_format_error(engine):
+    data = (HEADER + "\n" + ROWS + 'Chi,05/05/2025,"Ca 1,Ca 1\n').encode()
+    with pytest.raises(RosterFormatError):
+        roster_files.read_csv_roster(data)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""ScheduleStore: save/load round trips, previous_week warm starts and concurrent version numbers."""
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from availability import compact_lookup
+from schedule_store import ScheduleStore, shifts_key
+from schedule_table import STAFF_COLUMN
+from shifts import DEFAULT_SHIFTS_DEFINITION
+
+SHIFTS_KEY = shifts_key({"shifts_definition": DEFAULT_SHIFTS_DEFINITION})
+
+
+def week_schedule(start):
+    days = pd.date_range(start, periods=7)
+    return pd.DataFrame({'Ngày': days.repeat(2), 'Ca': ["Ca 1", "Ca 2"] * 7,
+                         STAFF_COLUMN: [f"NV {i % 3 + 1}" for i in range(14)]})
+
+
+def week_lookup(start):
+    days = pd.date_range(start, periods=7)
+    return compact_lookup(pd.DataFrame({'Date': days.repeat(4), 'Employee': ["An", "An", "Bình", "Bình"] * 7,
+                                        'Shift': ["Ca 1", "Ca 2"] * 14, 'Can_Work': [True, False, True, True] * 7,
+                                        'Note': ["", "", "Muốn làm sáng", ""] * 7}))
+
+
+def test_save_load_round_trip(tmp_path):
+    store = ScheduleStore(str(tmp_path / "schedules.db"))
+    roster = pd.DataFrame({'Tên nhân viên:': ["Nguyễn Văn An", "Trần Bình"], 'Thứ 2': ["Ca 1", "NGHỈ"]})
+    roster_id = store.save_roster(roster, week="2025-05-07")
+    # Cùng nội dung thì không lưu thêm bản mới
+    assert store.save_roster(roster, week="2025-05-07") == roster_id
+    pd.testing.assert_frame_equal(store.load_roster(roster_id), roster)
+
+    lookup_df = week_lookup("2025-05-05")
+    store.save_lookup(roster_id, SHIFTS_KEY, lookup_df)
+    pd.testing.assert_frame_equal(store.load_lookup(roster_id, SHIFTS_KEY), lookup_df)
+    assert store.load_lookup(roster_id, "ca khác") is None
+
+    schedule_df = week_schedule("2025-05-05")
+    table_df = pd.DataFrame({'Thứ': ["Thứ 2"], 'Ngày': ["05/05/2025"], 'Ca 1 (NV1)': ["NV 1"]})
+    schedule_id, version = store.save_schedule("2025-05-08", schedule_df, table_df, roster_id=roster_id, engine="local")
+    record = store.load_schedule(schedule_id)
+    assert (version, record["week"], record["version"], record["roster_id"]) == (1, "2025-05-05", 1, roster_id)
+    pd.testing.assert_frame_equal(record["schedule"], schedule_df, check_dtype=False)
+    pd.testing.assert_frame_equal(record["table"], table_df)
+    assert store.load_schedule(schedule_id + 1) is None
+
+
+def test_previous_week(tmp_path):
+    store = ScheduleStore(str(tmp_path / "schedules.db"))
+    assert store.previous_week("2025-05-12", SHIFTS_KEY) is None
+    roster_id = store.save_roster(pd.DataFrame({'Tên nhân viên:': ["An"]}), week="2025-05-05")
+    store.save_schedule("2025-05-05", week_schedule("2025-05-05"), roster_id=roster_id)
+    # Chưa có lookup cho roster này thì không khởi động ấm được
+    assert store.previous_week("2025-05-12", SHIFTS_KEY) is None
+
+    store.save_lookup(roster_id, SHIFTS_KEY, week_lookup("2025-05-05"))
+    edited_id, version = store.save_schedule("2025-05-05", week_schedule("2025-05-05"), roster_id=roster_id,
+                                             kind="edited")
+    store.save_schedule("2025-05-12", week_schedule("2025-05-12"), roster_id=roster_id)
+    record, lookup_df = store.previous_week("2025-05-14", SHIFTS_KEY)
+    assert (record["id"], record["version"], record["kind"]) == (edited_id, version, "edited") and version == 2
+    assert len(lookup_df) == 28
+    assert store.previous_week_start("2025-05-14") == "2025-05-05"
+    assert store.previous_week("2025-05-05", SHIFTS_KEY) is None
+
+
+def test_concurrent_saves_get_distinct_versions(tmp_path):
+    store = ScheduleStore(str(tmp_path / "schedules.db"))
+    schedule_df = week_schedule("2025-05-05")
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        saved = list(executor.map(lambda _: store.save_schedule("2025-05-05", schedule_df), range(40)))
+    assert sorted(version for _, version in saved) == list(range(1, 41))
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""SessionDataManager budgets on plain dict states: spill before drop for the session that just ran."""
+import pandas as pd
+import pytest
+
+from session_data import SessionDataManager, Spilled, artifact_size
+
+
+def frame(rows):
+    return pd.DataFrame({'Employee': [f"NV {i}" for i in range(rows)], 'Shift': ["Ca 1"] * rows})
+
+
+def state(roster_rows, lookup_rows):
+    return {'df_from_paste': frame(roster_rows), 'availability_lookup_df': frame(lookup_rows),
+            'availability_index': object()}
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return lambda **budgets: SessionDataManager(str(tmp_path), min_spill_bytes=0, **budgets)
+
+
+def test_spilling_is_enough_so_the_lookup_is_kept(manager):
+    data = state(2000, 1000)
+    data_manager = manager(session_budget=artifact_size(data['availability_lookup_df']) + 1)
+    data_manager.end("s", data)
+    assert isinstance(data['df_from_paste'], Spilled)
+    assert data['availability_lookup_df'] is not None and data['availability_index'] is not None
+    assert data_manager.begin("s", data) == set()
+    assert len(data['df_from_paste']) == 2000
+
+
+def test_lookup_is_dropped_when_spilling_is_not_enough(manager):
+    data = state(2000, 1000)
+    data_manager = manager(session_budget=1)
+    data_manager.end("s", data)
+    assert isinstance(data['df_from_paste'], Spilled)
+    assert data['availability_lookup_df'] is None and data['availability_index'] is None
+    assert data_manager.begin("s", data) == {'availability_lookup_df'}
+
+
+def test_idle_session_gives_up_derived_artifacts_first(manager):
+    idle, current = state(2000, 1000), state(10, 10)
+    budget = artifact_size(idle['df_from_paste']) + artifact_size(idle['availability_lookup_df'])
+    data_manager = manager(global_budget=budget)
+    data_manager.end("idle", idle)
+    data_manager.end("current", current)
+    assert idle['availability_lookup_df'] is None
+    assert not isinstance(idle['df_from_paste'], Spilled)
+    assert current['availability_lookup_df'] is not None
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Hard rules of the local solver on a small fixed roster: weekly target, double days, streaks, fixed slots."""
+from datetime import date, timedelta
+
+import pandas as pd
+
+from schedule_table import build_assignment_index
+from scheduler import DEFAULT_REQUIREMENTS
+from solver import solve_schedule, warm_start_assignments
+
+WEEK = [date(2025, 5, 5) + timedelta(days=i) for i in range(7)]  # 5/5 là ngày đôi: 2 người/ca
+SHIFTS = ("Ca 1", "Ca 2")
+
+
+def lookup(available, days=WEEK):
+    """Availability lookup from {employee: set of (date, shift) or None for every slot}."""
+    rows = [{"Date": pd.Timestamp(day), "Employee": employee, "Shift": shift,
+             "Can_Work": slots is None or (day, shift) in slots, "Note": None}
+            for employee, slots in available.items() for day in days for shift in SHIFTS]
+    return pd.DataFrame(rows)
+
+
+def requirements(**overrides):
+    return {**DEFAULT_REQUIREMENTS, **overrides}
+
+
+def assigned(schedule):
+    return {slot: [name for name in names if not name.startswith("(Thiếu")]
+            for slot, names in build_assignment_index(schedule).items()}
+
+
+def shifts_of(assignments, employee):
+    return sorted(day for (day, _), names in assignments.items() if employee in names)
+
+
+def longest_streak(days):
+    longest = streak = 0
+    for previous, day in zip([None] + days, days):
+        streak = streak + 1 if previous is not None and day - previous == timedelta(days=1) else 1
+        longest = max(longest, streak)
+    return longest
+
+
+def test_weekly_target_and_one_shift_per_day():
+    schedule = solve_schedule(lookup({f"NV {i}": None for i in range(5)}), requirements())
+    assignments = assigned(schedule)
+    for i in range(5):
+        days = shifts_of(assignments, f"NV {i}")
+        assert len(days) <= 4
+        assert len(days) == len(set(days))
+    assert sum(len(names) for names in assignments.values()) == 16  # 2 ca x 7 ngày + 2 người thêm ngày 5/5
+
+
+def test_double_day_needs_two_per_shift():
+    assignments = assigned(solve_schedule(lookup({f"NV {i}": None for i in range(6)}), requirements()))
+    assert all(len(assignments[(WEEK[0], shift)]) == 2 for shift in SHIFTS)
+    assert all(len(assignments[(day, shift)]) == 1 for day in WEEK[1:] for shift in SHIFTS)
+
+
+def test_max_consecutive_days():
+    available = {"An": None, "Bình": None, "Chi": None}
+    assignments = assigned(solve_schedule(lookup(available), requirements(max_consecutive_days=2,
+                                                                          shifts_per_week_target=7)))
+    assert all(longest_streak(shifts_of(assignments, name)) <= 2 for name in available)
+
+
+def test_infeasible_slots_are_marked_missing():
+    available = {"An": {(WEEK[1], "Ca 1")}, "Bình": {(WEEK[0], "Ca 1")}}
+    schedule = solve_schedule(lookup(available), requirements())
+    cells = {(row["Ngày"].date(), row["Ca"]): row["Nhân viên được phân công"] for _, row in schedule.iterrows()}
+    assert cells[(WEEK[0], "Ca 1")] == "Bình, (Thiếu 1 người)"
+    assert cells[(WEEK[0], "Ca 2")] == "(Thiếu 2 người)"
+    assert cells[(WEEK[1], "Ca 1")] == "An"
+    assert cells[(WEEK[6], "Ca 2")] == "(Thiếu 1 người)"
+
+
+def test_fixed_slots_are_kept_and_count_against_limits():
+    fixed = {(WEEK[day], "Ca 1"): ["An"] for day in range(1, 5)}
+    schedule = solve_schedule(lookup({"An": None, "Bình": None, "Chi": None}), requirements(), fixed=fixed)
+    assignments = assigned(schedule)
+    assert all(assignments[slot] == names for slot, names in fixed.items())
+    assert shifts_of(assignments, "An") == WEEK[1:5]  # Đã đủ 4 ca/tuần: không được xếp thêm
+
+
+def test_warm_start_reuses_unchanged_days():
+    previous_week = [day - timedelta(days=7) for day in WEEK]
+    available = {"An": None, "Bình": None, "Chi": None, "Dũng": None}
+    previous = lookup(available, previous_week)
+    previous_schedule = solve_schedule(previous, requirements())
+    current_available = dict(available, An={(day, shift) for day in WEEK[:-1] for shift in SHIFTS})
+    fixed, changed = warm_start_assignments(previous, previous_schedule, lookup(current_available), requirements())
+    assert WEEK[6] in changed  # Chủ nhật: An không còn rảnh
+    assert WEEK[0] in changed  # 5/5 cần 2 người/ca, 28/4 chỉ cần 1
+    assert fixed and all(slot[0] not in changed for slot in fixed)
+    schedule = solve_schedule(lookup(current_available), requirements(), fixed=fixed)
+    assignments = assigned(schedule)
+    assert all(assignments[slot] == names for slot, names in fixed.items())
+    assert "An" not in [name for shift in SHIFTS for name in assignments[(WEEK[6], shift)]]
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""ScheduleValidator edits checked against a validator rebuilt from scratch after every step."""
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from validation import ScheduleValidator
+
+DATES = [date(2025, 5, 5) + timedelta(days=i) for i in range(14)]
+SHIFTS = {"Sáng": {"start": "06:00", "end": "12:00", "staff": 1},
+          "Chiều": {"start": "13:00", "end": "21:00", "staff": 1},
+          "Đêm": {"start": "22:00", "end": "06:00", "staff": 1}}
+REQUIREMENTS = {"shifts_definition": SHIFTS, "max_shifts_per_day": 1, "shifts_per_week_target": 4,
+                "max_consecutive_days": 3, "min_rest_hours": 8}
+
+
+@pytest.fixture
+def validator():
+    return ScheduleValidator(REQUIREMENTS, DATES, list(SHIFTS))
+
+
+def nonzero(counts):
+    return {key: count for key, count in counts.items() if count}
+
+
+def edit(validator, *edits):
+    """Applies (day index, shift, position, employee) edits, comparing with a fresh validator after each one."""
+    for day, shift, position, employee in edits:
+        validator.set_cell(DATES[day], shift, position, employee)
+        rebuilt = ScheduleValidator.from_cells(REQUIREMENTS, DATES, list(SHIFTS), validator.cells.items())
+        assert validator.messages() == rebuilt.messages()
+        assert nonzero(validator.by_week) == nonzero(rebuilt.by_week)
+        assert {key: sorted(shifts) for key, shifts in validator.by_day.items()} == {
+            key: sorted(shifts) for key, shifts in rebuilt.by_day.items()}
+    return validator.messages()
+
+
+def streak_messages(validator):
+    return [message for message in validator.messages() if "liên tiếp" in message]
+
+
+def test_joining_and_splitting_a_streak(validator):
+    edit(validator, (0, "Sáng", 0, "An"), (1, "Sáng", 0, "An"), (3, "Sáng", 0, "An"), (4, "Sáng", 0, "An"))
+    assert streak_messages(validator) == []
+    edit(validator, (2, "Sáng", 0, "An"))  # Nối hai chuỗi 2 ngày thành 5 ngày
+    assert streak_messages(validator) == ["An làm 5 ngày liên tiếp từ 05/05 (tối đa 3)"]
+    edit(validator, (1, "Sáng", 0, ""))  # Tách: còn 1 ngày và 3 ngày
+    assert streak_messages(validator) == []
+    edit(validator, (5, "Sáng", 0, "An"))
+    assert streak_messages(validator) == ["An làm 4 ngày liên tiếp từ 07/05 (tối đa 3)"]
+
+
+def test_swapping_an_occupant(validator):
+    edit(validator, *[(day, "Chiều", 0, "An") for day in range(5)])
+    assert any("An có 5 ca" in message for message in validator.messages())
+    edit(validator, (2, "Chiều", 0, "Bình"))  # Đổi người trong cùng một ô
+    messages = validator.messages()
+    assert not any("An có" in message for message in messages)
+    assert not any("Bình" in message for message in messages)
+    edit(validator, (2, "Chiều", 0, "An"), (2, "Chiều", 0, "Bình"), (2, "Sáng", 0, "Bình"))
+    assert any("Bình làm 2 ca ngày 07/05" in message for message in validator.messages())
+
+
+def test_rest_gap_across_midnight(validator):
+    edit(validator, (0, "Đêm", 0, "An"), (1, "Sáng", 0, "An"))  # 22:00-06:00 rồi 06:00 hôm sau
+    assert "An nghỉ chưa đủ 8 giờ giữa các ca quanh ngày 05/05" in validator.messages()
+    assert DATES[1] in validator.violations_by_date()
+    edit(validator, (1, "Sáng", 0, ""), (1, "Chiều", 0, "An"))  # Đêm hết 06:00, Chiều từ 13:00: 7 giờ, vẫn thiếu
+    assert "An nghỉ chưa đủ 8 giờ giữa các ca quanh ngày 05/05" in validator.messages()
+    edit(validator, (0, "Đêm", 0, ""), (0, "Sáng", 0, "An"))
+    assert not any("nghỉ chưa đủ" in message for message in validator.messages())
+
+
+def test_random_edits_match_a_rebuild(validator):
+    rng = random.Random(7)
+    names = ["", "An", "Bình", "Chi"]
+    edit(validator, *[(rng.randrange(len(DATES)), rng.choice(list(SHIFTS)), rng.randrange(2), rng.choice(names))
+                      for _ in range(300)])
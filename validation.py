@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Incremental constraint checking for manual edits of a schedule.
+
+``ScheduleValidator`` keeps running per-employee counters (shifts per day and
+per week, worked days) and the current set of violations. ``set_cell`` updates
+the counters for the old and the new occupant of one editor cell and re-checks
+only the rules that cell can affect: that day, its week, the neighbouring days
+for rest and the consecutive-day run through it. An edit never rescans the
+whole schedule.
+"""
+from datetime import timedelta
+
+from shifts import shift_model
+from solver import _week_key
+
+
+class ScheduleValidator:
+    """Hard-constraint validator over editor cells keyed by (date, shift, position)."""
+
+    def __init__(self, requirements, dates, shift_names):
+        self.max_per_day = int(requirements.get("max_shifts_per_day", 1))
+        self.week_target = int(requirements.get("shifts_per_week_target", 4))
+        self.max_consecutive = int(requirements.get("max_consecutive_days", 7))
+        self.min_rest_minutes = int(requirements.get("min_rest_hours", 0)) * 60
+        self.shift_model = shift_model(requirements)  # Giờ ca và số người cần mỗi ngày
+        self.intervals = self.shift_model.intervals
+        self.shift_names = list(shift_names)
+        self.cells = {}  # (date, shift, position) -> employee
+        self.by_day = {}  # (employee, date) -> [shift, ...]
+        self.by_week = {}  # (employee, monday) -> count
+        self.days = {}  # employee -> set(date)
+        self.streaks = {}  # employee -> {(first, last)} of runs currently flagged
+        self.slot_counts = {(day, shift): 0 for day in dates for shift in self.shift_names}
+        self.violations = {}  # key -> (dates, message)
+        self.listeners = []  # callables (date, employees) notified after every change, e.g. CandidateRanker
+        for slot in self.slot_counts:
+            self._check_staffing(slot)
+
+    @classmethod
+    def from_cells(cls, requirements, dates, shift_names, cells):
+        """Builds a validator from an iterable of ((date, shift, position), employee)."""
+        validator = cls(requirements, dates, shift_names)
+        for (day, shift, position), employee in cells:
+            validator.set_cell(day, shift, position, employee)
+        return validator
+
+    def set_cell(self, day, shift, position, employee):
+        """Puts ``employee`` ('' = nobody) into one cell and refreshes the affected checks."""
+        employee = (employee or "").strip()
+        cell = (day, shift, position)
+        previous = self.cells.get(cell, "")
+        if previous == employee:
+            return False
+        if previous:
+            self._remove(previous, day, shift)
+            self.slot_counts[(day, shift)] -= 1
+        if employee:
+            self._add(employee, day, shift)
+            self.slot_counts[(day, shift)] = self.slot_counts.get((day, shift), 0) + 1
+            self.cells[cell] = employee
+        else:
+            self.cells.pop(cell, None)
+        changed = {previous, employee} - {""}
+        for name in changed:
+            self._refresh(name, day)
+        self._check_staffing((day, shift))
+        for listener in self.listeners:
+            listener(day, changed)
+        return True
+
+    def violations_by_date(self):
+        """Maps each date to the messages of the violations that involve it."""
+        by_date = {}
+        for dates, message in self.violations.values():
+            for day in dates:
+                by_date.setdefault(day, []).append(message)
+        return by_date
+
+    def messages(self):
+        return sorted(message for _, message in self.violations.values())
+
+    # --- Counters ---
+    def _add(self, employee, day, shift):
+        self.by_day.setdefault((employee, day), []).append(shift)
+        week = (employee, _week_key(day))
+        self.by_week[week] = self.by_week.get(week, 0) + 1
+        self.days.setdefault(employee, set()).add(day)
+
+    def _remove(self, employee, day, shift):
+        shifts = self.by_day[(employee, day)]
+        shifts.remove(shift)
+        if not shifts:
+            del self.by_day[(employee, day)]
+            self.days[employee].discard(day)
+        self.by_week[(employee, _week_key(day))] -= 1
+
+    # --- Checks ---
+    def _set(self, key, violated, dates, message):
+        if violated:
+            self.violations[key] = (tuple(dates), message)
+        else:
+            self.violations.pop(key, None)
+
+    def _refresh(self, employee, day):
+        label = day.strftime('%d/%m')
+        shifts = self.by_day.get((employee, day), [])
+        self._set(("duplicate", employee, day), len(shifts) != len(set(shifts)), [day],
+                  f"{employee} bị xếp trùng một ca ngày {label}")
+        self._set(("per_day", employee, day), len(shifts) > self.max_per_day, [day],
+                  f"{employee} làm {len(shifts)} ca ngày {label} (tối đa {self.max_per_day})")
+
+        monday = _week_key(day)
+        load = self.by_week.get((employee, monday), 0)
+        week_days = [monday + timedelta(days=i) for i in range(7)]
+        self._set(("week", employee, monday), load > self.week_target,
+                  [d for d in week_days if (employee, d) in self.by_day],
+                  f"{employee} có {load} ca trong tuần từ {monday.strftime('%d/%m')} (mục tiêu {self.week_target})")
+
+        for other in (day - timedelta(days=1), day):
+            self._check_rest(employee, other)
+        self._check_streaks(employee, day)
+
+    def _check_rest(self, employee, day):
+        """Rest after each shift starting on ``day`` (until the next shift, same day or ``day + 1``)."""
+        next_day = day + timedelta(days=1)
+        spans = [(*self.intervals[s], True) for s in self.by_day.get((employee, day), []) if s in self.intervals]
+        spans += [(start + 24 * 60, end + 24 * 60, False)
+                  for start, end in (self.intervals[s] for s in self.by_day.get((employee, next_day), [])
+                                     if s in self.intervals)]
+        spans.sort()
+        short_gaps = [later for earlier, later in zip(spans, spans[1:])
+                      if earlier[2] and later[0] - earlier[1] < self.min_rest_minutes]
+        dates = [day] + ([next_day] if any(not later[2] for later in short_gaps) else [])
+        self._set(("rest", employee, day), bool(short_gaps), dates,
+                  f"{employee} nghỉ chưa đủ {self.min_rest_minutes // 60} giờ giữa các ca quanh ngày {day.strftime('%d/%m')}")
+
+    def _run_around(self, employee, day):
+        """(first, last) day of the worked run containing ``day``."""
+        worked = self.days.get(employee, set())
+        first = last = day
+        while first - timedelta(days=1) in worked:
+            first -= timedelta(days=1)
+        while last + timedelta(days=1) in worked:
+            last += timedelta(days=1)
+        return first, last
+
+    def _check_streaks(self, employee, day):
+        """Re-checks the runs touching ``day`` (an edit can join or split at most these)."""
+        worked = self.days.get(employee, set())
+        flagged = self.streaks.setdefault(employee, set())
+        for first, last in [run for run in flagged if run[0] - timedelta(days=1) <= day <= run[1] + timedelta(days=1)]:
+            flagged.discard((first, last))
+            del self.violations[("streak", employee, (first, last))]
+        for probe in (day - timedelta(days=1), day, day + timedelta(days=1)):
+            if probe not in worked:
+                continue
+            first, last = self._run_around(employee, probe)
+            length = (last - first).days + 1
+            if length > self.max_consecutive:
+                flagged.add((first, last))
+                self.violations[("streak", employee, (first, last))] = (
+                    tuple(first + timedelta(days=i) for i in range(length)),
+                    f"{employee} làm {length} ngày liên tiếp từ {first.strftime('%d/%m')} "
+                    f"(tối đa {self.max_consecutive})")
+
+    def _check_staffing(self, slot):
+        day, shift = slot
+        count, needed = self.slot_counts.get(slot, 0), self.shift_model.staff_needed(day, shift)
+        self._set(("staffing", None, slot), count < needed, [day],
+                  f"{shift} ngày {day.strftime('%d/%m')} thiếu {needed - count} người (cần {needed})")